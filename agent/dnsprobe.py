@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import dns.asyncquery
+import dns.asyncresolver
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+logger = logging.getLogger(__name__)
+
+DNS_TIMEOUT = float(os.getenv("AGENT_DNS_TIMEOUT", "5"))
+DNS_PORT = int(os.getenv("AGENT_DNS_PORT", "53"))
+# Свои резолверы вместо /etc/resolv.conf, через запятую
+DNS_NAMESERVERS = [ns.strip() for ns in os.getenv("AGENT_DNS_NAMESERVERS", "").split(",") if ns.strip()]
+# Дополнительно опрашиваемые серверы для сравнения ответов, например "8.8.8.8,1.1.1.1"
+DNS_COMPARE_NAMESERVERS = [ns.strip() for ns in os.getenv("AGENT_DNS_COMPARE", "").split(",") if ns.strip()]
+
+
+def elapsed_ms(started: float) -> int:
+    return int((time.perf_counter() - started) * 1000)
+
+
+class DnsEngine:
+    """Asynchronous DNS prober shared by the whole agent.
+
+    One configured dnspython asyncio resolver lives on a private event loop
+    thread; probe threads hand it batches of (target, record types) and every
+    query of a batch is in flight at once. Optionally the same questions go
+    straight to a list of comparison nameservers, so answers from different
+    resolvers can be checked against each other.
+    """
+
+    def __init__(self, nameservers: Optional[List[str]] = None, compare: Optional[List[str]] = None,
+                 timeout: float = DNS_TIMEOUT, port: int = DNS_PORT):
+        self.timeout = timeout
+        self.port = port
+        self.compare = compare if compare is not None else DNS_COMPARE_NAMESERVERS
+        self.resolver = dns.asyncresolver.Resolver()
+        nameservers = nameservers if nameservers is not None else DNS_NAMESERVERS
+        if nameservers:
+            self.resolver.nameservers = nameservers
+        self.resolver.timeout = timeout
+        self.resolver.lifetime = timeout
+        self.resolver.port = port
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="dns-loop", daemon=True)
+        self._thread.start()
+
+    def resolve_many(self, target: str, record_types: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Resolve every record type of target concurrently; blocks the calling thread"""
+        future = asyncio.run_coroutine_threadsafe(self._resolve_many(target, record_types), self._loop)
+        return future.result(timeout=self.timeout * 2 + 1)
+
+    def resolve(self, target: str, record_type: str) -> Dict[str, Any]:
+        return self.resolve_many(target, [record_type])[record_type]
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _resolve_many(self, target: str, record_types: List[str]) -> Dict[str, Dict[str, Any]]:
+        results = await asyncio.gather(*(self._resolve(target, rt) for rt in record_types))
+        return dict(zip(record_types, results))
+
+    async def _resolve(self, target: str, record_type: str) -> Dict[str, Any]:
+        lookup = asyncio.gather(*(self._query_server(target, record_type, ns) for ns in self.compare))
+        started = time.perf_counter()
+        try:
+            answer = await self.resolver.resolve(target, record_type)
+            result = {
+                "success": True,
+                "records": [str(rdata) for rdata in answer],
+                "record_type": record_type,
+                "nameserver": answer.nameserver,
+                "authoritative": bool(answer.response.flags & dns.flags.AA),
+                "ttl": answer.rrset.ttl if answer.rrset is not None else None
+            }
+        except Exception as e:
+            result = {"success": False, "error": str(e), "record_type": record_type}
+        result["response_time"] = elapsed_ms(started)
+        servers = await lookup
+        if servers:
+            # Ответы совпадают, если все серверы ответили одним и тем же набором записей
+            record_sets = [sorted(s["records"]) if "records" in s else None for s in servers]
+            record_sets.append(sorted(result["records"]) if result["success"] else None)
+            result["comparison"] = {
+                "servers": servers,
+                "consistent": None not in record_sets and all(r == record_sets[0] for r in record_sets)
+            }
+        return result
+
+    async def _query_server(self, target: str, record_type: str, nameserver: str) -> Dict[str, Any]:
+        """Ask one nameserver directly, bypassing the resolver's server list"""
+        rdtype = dns.rdatatype.from_text(record_type)
+        query = dns.message.make_query(target, rdtype)
+        started = time.perf_counter()
+        try:
+            response, _ = await dns.asyncquery.udp_with_fallback(query, nameserver, timeout=self.timeout, port=self.port)
+        except (dns.exception.DNSException, OSError) as e:
+            return {"nameserver": nameserver, "error": str(e) or type(e).__name__,
+                    "response_time": elapsed_ms(started)}
+        return {
+            "nameserver": nameserver,
+            "rcode": dns.rcode.to_text(response.rcode()),
+            "records": [str(rdata) for rrset in response.answer if rrset.rdtype == rdtype for rdata in rrset],
+            "response_time": elapsed_ms(started),
+            "authoritative": bool(response.flags & dns.flags.AA)
+        }
+
+
+_engine: Optional[DnsEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_dns_engine() -> DnsEngine:
+    """Process-wide DNS engine, created on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DnsEngine()
+            logger.info(f"🧭 DNS engine ready: nameservers={_engine.resolver.nameservers}, compare={_engine.compare}")
+        return _engine
@@ -0,0 +1,94 @@
+import threading
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Queue
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CheckExecutor:
+    """Bounded worker pool for network probes.
+
+    A global limit caps the number of probes in flight, and a per-target limit
+    keeps one slow or rate-limited host from taking every worker. Jobs over the
+    per-target limit wait in a queue instead of blocking a worker thread.
+    """
+
+    def __init__(self, max_concurrency: int = 32, per_target_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self.per_target_concurrency = per_target_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="probe")
+        self._lock = threading.Lock()
+        self._running: Dict[str, int] = defaultdict(int)
+        self._waiting: Dict[str, deque] = defaultdict(deque)
+
+    def submit(self, target: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Schedule fn(*args, **kwargs) against target, respecting both limits"""
+        future = Future()
+        job = (future, fn, args, kwargs)
+        with self._lock:
+            if self._running[target] < self.per_target_concurrency:
+                self._running[target] += 1
+            else:
+                self._waiting[target].append(job)
+                return future
+        self._start(target, job)
+        return future
+
+    def _start(self, target: str, job):
+        future, fn, args, kwargs = job
+        if not future.set_running_or_notify_cancel():
+            self._release(target)
+            return
+        self._pool.submit(self._run, target, job)
+
+    def _run(self, target: str, job):
+        future, fn, args, kwargs = job
+        try:
+            result, error = fn(*args, **kwargs), None
+        except BaseException as e:
+            result, error = None, e
+        # Слот освобождается до колбэков future: они уже видят его свободным в in_flight
+        self._release(target)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _release(self, target: str):
+        with self._lock:
+            waiting = self._waiting.get(target)
+            if waiting:
+                next_job = waiting.popleft()
+            else:
+                next_job = None
+                self._running[target] -= 1
+                if self._running[target] <= 0:
+                    self._running.pop(target, None)
+                    self._waiting.pop(target, None)
+        if next_job:
+            self._start(target, next_job)
+
+    @property
+    def in_flight(self) -> int:
+        """Probes running or waiting for a per-target slot"""
+        with self._lock:
+            return sum(self._running.values()) + sum(len(waiting) for waiting in self._waiting.values())
+
+    def run(self, jobs: Iterable[Tuple[Any, str, Callable[..., Any], tuple]]) -> Iterator[Tuple[Any, Any]]:
+        """Run (key, target, fn, args) jobs and yield (key, result) as each completes"""
+        done: Queue = Queue()
+        pending = 0
+        for key, target, fn, args in jobs:
+            future = self.submit(target, fn, *args)
+            future.add_done_callback(lambda f, key=key: done.put((key, f)))
+            pending += 1
+        while pending:
+            key, future = done.get()
+            pending -= 1
+            yield key, future.result()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,252 @@
+import http.client
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("AGENT_HTTP_TIMEOUT", "10"))
+# cold: каждая проверка открывает новое соединение (честные DNS/TCP/TLS), pooled: keep-alive между проверками
+HTTP_MODE = os.getenv("AGENT_HTTP_MODE", "cold").lower()
+HTTP_MAX_BODY = int(os.getenv("AGENT_HTTP_MAX_BODY", str(1024 * 1024)))
+HTTP_MAX_REDIRECTS = int(os.getenv("AGENT_HTTP_MAX_REDIRECTS", "5"))
+HTTP_VERIFY_TLS = os.getenv("AGENT_HTTP_VERIFY_TLS", "true").lower() == "true"
+HTTP_POOL_IDLE_SECONDS = 30
+HTTP_POOL_PER_HOST = 4
+REDIRECT_BODY_LIMIT = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = "host-checker-agent/1.0"
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+class HttpProber:
+    """HTTP(S) probe with per-phase timings and a capped, streamed body.
+
+    Connections are opened by hand (getaddrinfo, connect, TLS handshake) so
+    each phase is timed separately, then handed to http.client. The body is
+    read in chunks and counted, never kept, up to max_body bytes. Redirects
+    are followed without downloading the intermediate bodies. In pooled mode
+    idle keep-alive connections are reused across checks of the same origin.
+    """
+
+    def __init__(self, pooled: bool = HTTP_MODE == "pooled", max_body: int = HTTP_MAX_BODY,
+                 timeout: float = HTTP_TIMEOUT, max_redirects: int = HTTP_MAX_REDIRECTS,
+                 verify_tls: bool = HTTP_VERIFY_TLS):
+        self.pooled = pooled
+        self.max_body = max_body
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._ssl = ssl.create_default_context()
+        if not verify_tls:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+        self._idle: Dict[Tuple[str, str, int], List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._lock = threading.Lock()
+
+    def check(self, url: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        hops: List[Dict[str, Any]] = []
+        current = url
+        try:
+            while True:
+                hop = self._fetch(current)
+                hops.append(hop)
+                location = hop.pop("location")
+                if not (300 <= hop["status_code"] < 400 and location):
+                    break
+                if len(hops) > self.max_redirects:
+                    return {"success": False, "error": f"Too many redirects (>{self.max_redirects})",
+                            "url": url, "redirects": hops, "response_time": int(elapsed_ms(started))}
+                current = urljoin(current, location)
+        except socket.timeout:
+            return {"success": False, "error": "HTTP request timeout", "url": url, "redirects": hops}
+        except ssl.SSLError as e:
+            return {"success": False, "error": f"TLS error: {e}", "url": url, "redirects": hops}
+        except (OSError, http.client.HTTPException) as e:
+            return {"success": False, "error": f"Connection failed: {e}", "url": url, "redirects": hops}
+
+        final = hops[-1]
+        return {
+            "success": 200 <= final["status_code"] < 400,
+            "status_code": final["status_code"],
+            "response_time": int(elapsed_ms(started)),
+            "url": url,
+            "final_url": final["url"],
+            "content_length": final["body_bytes"],
+            "body_truncated": final["body_truncated"],
+            "timings": final["timings"],
+            "address": final["address"],
+            "reused_connection": final["reused_connection"],
+            "tls_version": final.get("tls_version"),
+            "redirects": hops[:-1],
+            "mode": "pooled" if self.pooled else "cold"
+        }
+
+    def _fetch(self, url: str) -> Dict[str, Any]:
+        """One request/response; the body is counted up to the cap and discarded"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        if scheme not in ("http", "https"):
+            raise http.client.HTTPException(f"Unsupported URL scheme: {scheme}")
+        host = parts.hostname
+        port = parts.port or (443 if scheme == "https" else 80)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        key = (scheme, host, port)
+
+        conn = self._checkout(key) if self.pooled else None
+        reused = conn is not None
+        timings = {"dns": 0.0, "connect": 0.0, "tls": 0.0}
+        if conn is None:
+            conn = self._connect(scheme, host, port, timings)
+        # Адрес и TLS запоминаем до запроса: при Connection: close http.client отпускает сокет
+        peer = self._peer(conn)
+        try:
+            response, timings["ttfb"] = self._request(conn, path)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # Сервер закрыл простаивающее соединение: повторяем на новом
+            reused = False
+            conn = self._connect(scheme, host, port, timings)
+            peer = self._peer(conn)
+            try:
+                response, timings["ttfb"] = self._request(conn, path)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        location = response.getheader("Location")
+        is_redirect = 300 <= response.status < 400 and location
+        started = time.perf_counter()
+        try:
+            body_bytes, truncated = self._drain(response, REDIRECT_BODY_LIMIT if is_redirect else self.max_body)
+        except Exception:
+            conn.close()
+            raise
+        timings["transfer"] = elapsed_ms(started)
+        content_length = response.getheader("Content-Length")
+
+        hop = {
+            "url": url,
+            "status_code": response.status,
+            "location": location,
+            "timings": timings,
+            "body_bytes": body_bytes,
+            "body_truncated": truncated,
+            "content_length_header": int(content_length) if content_length and content_length.isdigit() else None,
+            "reused_connection": reused,
+            **peer
+        }
+        if self.pooled and not truncated and not response.will_close:
+            self._checkin(key, conn)
+        else:
+            conn.close()
+        return hop
+
+    def _connect(self, scheme: str, host: str, port: int, timings: Dict[str, float]) -> http.client.HTTPConnection:
+        started = time.perf_counter()
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        timings["dns"] = elapsed_ms(started)
+
+        started = time.perf_counter()
+        sock = None
+        for family, sock_type, proto, _, sockaddr in addresses:
+            sock = socket.socket(family, sock_type, proto)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(sockaddr)
+                break
+            except OSError as e:
+                sock.close()
+                sock, error = None, e
+        if sock is None:
+            raise error
+        timings["connect"] = elapsed_ms(started)
+
+        if scheme == "https":
+            started = time.perf_counter()
+            try:
+                sock = self._ssl.wrap_socket(sock, server_hostname=host)
+            except Exception:
+                sock.close()
+                raise
+            timings["tls"] = elapsed_ms(started)
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        conn.sock = sock
+        return conn
+
+    @staticmethod
+    def _peer(conn: http.client.HTTPConnection) -> Dict[str, Any]:
+        peer = {"address": conn.sock.getpeername()[0]}
+        if isinstance(conn.sock, ssl.SSLSocket):
+            peer["tls_version"] = conn.sock.version()
+        return peer
+
+    def _request(self, conn: http.client.HTTPConnection, path: str):
+        started = time.perf_counter()
+        conn.request("GET", path, headers={
+            "User-Agent": USER_AGENT,
+            "Accept": "*/*",
+            "Accept-Encoding": "identity",
+            "Connection": "keep-alive" if self.pooled else "close"
+        })
+        response = conn.getresponse()
+        return response, elapsed_ms(started)
+
+    @staticmethod
+    def _drain(response: http.client.HTTPResponse, limit: int) -> Tuple[int, bool]:
+        received = 0
+        while received < limit:
+            chunk = response.read(min(CHUNK_SIZE, limit - received))
+            if not chunk:
+                return received, False
+            received += len(chunk)
+        # Дошли до лимита: есть ли ещё данные, не скачивая их
+        return received, not response.isclosed() and response.length != 0
+
+    def _checkout(self, key) -> Optional[http.client.HTTPConnection]:
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since < HTTP_POOL_IDLE_SECONDS:
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, key, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < HTTP_POOL_PER_HOST:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+
+_prober: Optional[HttpProber] = None
+_prober_lock = threading.Lock()
+
+
+def get_http_prober() -> HttpProber:
+    """Process-wide HTTP prober, created on first use"""
+    global _prober
+    with _prober_lock:
+        if _prober is None:
+            _prober = HttpProber()
+            logger.info(f"🌍 HTTP prober ready: mode={'pooled' if _prober.pooled else 'cold'}, max_body={_prober.max_body}")
+        return _prober
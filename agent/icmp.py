@@ -0,0 +1,230 @@
+import os
+import socket
+import struct
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+PAYLOAD_SIZE = 56
+# Столько ошибок приёма подряд — и сокет считается сломанным, ping уходит в subprocess
+RECEIVE_ERROR_LIMIT = 5
+RECEIVE_RETRY_SECONDS = 0.2
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class _Probe:
+    __slots__ = ("target", "address", "sent_at", "rtt")
+
+    def __init__(self, target: str, address: str):
+        self.target = target
+        self.address = address
+        self.sent_at = 0.0
+        self.rtt: Optional[float] = None
+
+
+class IcmpPinger:
+    """In-process ICMP echo engine.
+
+    One socket is shared by every ping in the agent: requests to all targets go
+    out through it and a single receiver thread matches echo replies back to
+    their probes by identifier and sequence number. An unprivileged datagram
+    socket (net.ipv4.ping_group_range) is preferred, falling back to a raw
+    socket when the process has CAP_NET_RAW. IPv4 only.
+    """
+
+    def __init__(self):
+        self._sock, self._raw = self._open_socket()
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = 0
+        self._pending: Dict[int, _Probe] = {}
+        self._lock = threading.Lock()
+        self._replied = threading.Condition(self._lock)
+        self.broken = False
+        self._receiver = threading.Thread(target=self._receive_loop, name="icmp-receiver", daemon=True)
+        self._receiver.start()
+
+    @staticmethod
+    def _open_socket():
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            return sock, False
+        except OSError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            return sock, True
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def _packet(self, seq: int) -> bytes:
+        payload = struct.pack("!d", time.time()).ljust(PAYLOAD_SIZE, b"\x42")
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self._ident, seq)
+        csum = checksum(header + payload)
+        return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, self._ident, seq) + payload
+
+    def _receive_loop(self):
+        self._sock.settimeout(1.0)
+        errors = 0
+        while True:
+            try:
+                data, (address, _) = self._sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                # Разовая ошибка (ICMP error queue, ENOBUFS) не должна останавливать приём
+                errors += 1
+                if errors < RECEIVE_ERROR_LIMIT:
+                    logger.warning(f"⚠️ ICMP receive failed ({errors}/{RECEIVE_ERROR_LIMIT}): {e}")
+                    time.sleep(RECEIVE_RETRY_SECONDS)
+                    continue
+                logger.error(f"❌ ICMP receiver stopped after {errors} errors: {e}")
+                with self._lock:
+                    self.broken = True
+                    self._replied.notify_all()
+                return
+            errors = 0
+            received_at = time.monotonic()
+            if self._raw:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+            # Для datagram-сокета ядро само подменяет и фильтрует identifier
+            if icmp_type != ICMP_ECHO_REPLY or (self._raw and ident != self._ident):
+                continue
+            with self._lock:
+                probe = self._pending.get(seq)
+                if probe is None or probe.address != address or probe.rtt is not None:
+                    continue
+                probe.rtt = (received_at - probe.sent_at) * 1000
+                self._replied.notify_all()
+
+    def ping_many(self, targets: List[str], count: int = 3, interval: float = 0.2,
+                  timeout: float = 5.0) -> Dict[str, Dict]:
+        """Ping every target `count` times, interleaving requests across targets.
+
+        Raises OSError when the receiver has stopped, so the caller can fall back
+        to the ping subprocess.
+        """
+        if self.broken:
+            raise OSError("ICMP receiver stopped")
+        results: Dict[str, Dict] = {}
+        addresses: Dict[str, str] = {}
+        for target in targets:
+            try:
+                addresses[target] = socket.getaddrinfo(target, None, socket.AF_INET)[0][4][0]
+            except socket.gaierror as e:
+                results[target] = {"success": False, "error": f"Cannot resolve {target}: {e}"}
+
+        probes: Dict[str, List[_Probe]] = {target: [] for target in addresses}
+        sent: List[int] = []
+        try:
+            for round_no in range(count):
+                if round_no:
+                    time.sleep(interval)
+                for target, address in addresses.items():
+                    probe = _Probe(target, address)
+                    with self._lock:
+                        seq = self._next_seq()
+                        self._pending[seq] = probe
+                    sent.append(seq)
+                    probes[target].append(probe)
+                    probe.sent_at = time.monotonic()
+                    self._sock.sendto(self._packet(seq), (address, 0))
+
+            deadline = time.monotonic() + timeout
+            all_probes = [p for target_probes in probes.values() for p in target_probes]
+            with self._lock:
+                while any(p.rtt is None for p in all_probes) and not self.broken:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._replied.wait(remaining)
+        finally:
+            # Только свои зонды: параллельный ping той же цели ещё ждёт ответов
+            with self._lock:
+                for seq in sent:
+                    self._pending.pop(seq, None)
+        if self.broken:
+            raise OSError("ICMP receiver stopped")
+
+        for target, target_probes in probes.items():
+            results[target] = self.summarize(address=addresses[target], sent=len(target_probes),
+                                             rtts=[p.rtt for p in target_probes if p.rtt is not None])
+        return results
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def ping(self, target: str, count: int = 3, interval: float = 0.2, timeout: float = 5.0) -> Dict:
+        return self.ping_many([target], count=count, interval=interval, timeout=timeout)[target]
+
+    @staticmethod
+    def summarize(address: str, sent: int, rtts: List[float]) -> Dict:
+        received = len(rtts)
+        result = {
+            "success": received > 0,
+            "address": address,
+            "packets_sent": sent,
+            "packets_received": received,
+            "packet_loss": round(100.0 * (sent - received) / sent, 1) if sent else 100.0,
+            "min_rtt": None,
+            "avg_rtt": None,
+            "max_rtt": None,
+            "jitter": None,
+            "response_time": None,
+        }
+        if rtts:
+            avg = sum(rtts) / received
+            result.update({
+                "min_rtt": round(min(rtts), 2),
+                "avg_rtt": round(avg, 2),
+                "max_rtt": round(max(rtts), 2),
+                "jitter": round(sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (received - 1), 2)
+                if received > 1 else 0.0,
+                "response_time": int(avg),
+            })
+        else:
+            result["error"] = "No ICMP echo replies received"
+        return result
+
+
+_pinger: Optional[IcmpPinger] = None
+_pinger_failed = False
+_pinger_lock = threading.Lock()
+
+
+def get_pinger() -> Optional[IcmpPinger]:
+    """Shared pinger instance, or None when no ICMP socket can be opened.
+
+    A pinger whose receiver stopped is replaced with a fresh socket; when
+    none can be opened, pings go to the ping subprocess from then on.
+    """
+    global _pinger, _pinger_failed
+    with _pinger_lock:
+        if _pinger is not None and _pinger.broken:
+            _pinger.close()
+            _pinger = None
+        if _pinger is None and not _pinger_failed:
+            try:
+                _pinger = IcmpPinger()
+            except OSError as e:
+                _pinger_failed = True
+                logger.warning(f"⚠️ ICMP socket unavailable, falling back to ping subprocess: {e}")
+        return _pinger
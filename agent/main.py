@@ -3,10 +3,20 @@ import requests
 import os
 import logging
 import subprocess
-import socket
-import json
-from typing import Dict, Any, List
-from datetime import datetime
+import threading
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timezone
+
+from dnsprobe import get_dns_engine
+from executor import CheckExecutor
+from httpprobe import get_http_prober
+from icmp import get_pinger
+import metrics
+from probecache import ProbeCache, mark_cached
+from spool import ResultSpool, ResultUploader
+from tcpscan import get_tcp_scanner
+from tracer import get_tracer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,11 +25,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Ключ задания, в котором все DNS-проверки одной цели выполняются одним пакетом
+DNS_BATCH = "dns"
+
 
 class NetworkChecker:
     @staticmethod
     def ping_check(target: str) -> Dict[str, Any]:
         """ICMP ping check"""
+        pinger = get_pinger()
+        if pinger:
+            try:
+                result = pinger.ping(target, count=3, timeout=5)
+                # Без IPv4-адреса (например, IPv6-only хост) отдаём проверку системному ping
+                if "address" in result:
+                    result["method"] = "icmp_socket"
+                    return result
+            except OSError as e:
+                logger.warning(f"⚠️ ICMP socket ping failed for {target}, using subprocess: {e}")
+        return NetworkChecker.ping_subprocess(target)
+
+    @staticmethod
+    def ping_subprocess(target: str) -> Dict[str, Any]:
+        """ICMP ping via the system ping binary"""
         try:
             result = subprocess.run(
                 ["ping", "-c", "3", "-W", "5", target],
@@ -28,24 +56,34 @@ class NetworkChecker:
                 timeout=10
             )
             success = result.returncode == 0
-            response_time = None
-            if success:
-                for line in result.stdout.splitlines():
-                    if "avg" in line:
-                        parts = line.split("/")
-                        if len(parts) >= 5:
+            min_rtt = avg_rtt = max_rtt = jitter = packet_loss = None
+            for line in result.stdout.splitlines():
+                if "packet loss" in line:
+                    for part in line.split(","):
+                        if "packet loss" in part:
                             try:
-                                response_time = round(float(parts[4].split()[0]), 2)
-                            except (ValueError, IndexError):
+                                packet_loss = float(part.split("%")[0].strip())
+                            except ValueError:
                                 pass
-                        break
+                elif "min/avg/max" in line:
+                    # rtt min/avg/max/mdev = 9.1/10.2/11.3/0.8 ms
+                    try:
+                        values = line.split("=")[1].split()[0].split("/")
+                        min_rtt, avg_rtt, max_rtt = (round(float(v), 2) for v in values[:3])
+                        if len(values) > 3:
+                            jitter = round(float(values[3]), 2)
+                    except (ValueError, IndexError):
+                        pass
             return {
                 "success": success,
-                "response_time": int(response_time) if response_time else None,
+                "response_time": int(avg_rtt) if avg_rtt else None,
                 "stdout": result.stdout if not success else None,
-                "avg_rtt": response_time,
-                "min_rtt": None,
-                "max_rtt": None
+                "avg_rtt": avg_rtt,
+                "min_rtt": min_rtt,
+                "max_rtt": max_rtt,
+                "jitter": jitter,
+                "packet_loss": packet_loss,
+                "method": "subprocess"
             }
         except subprocess.TimeoutExpired:
             return {"success": False, "error": "Ping timeout"}
@@ -54,69 +92,45 @@ class NetworkChecker:
 
     @staticmethod
     def http_check(target: str) -> Dict[str, Any]:
-        """HTTP check"""
+        """HTTP check with DNS/connect/TLS/TTFB/transfer timings; the body is counted, not kept"""
+        if not target.startswith(('http://', 'https://')):
+            url = f"http://{target}"
+        else:
+            url = target
         try:
-            start_time = time.time()
-            if not target.startswith(('http://', 'https://')):
-                url = f"http://{target}"
-            else:
-                url = target
-            response = requests.get(url, timeout=10, allow_redirects=True)
-            response_time = round((time.time() - start_time) * 1000, 2)
-            return {
-                "success": 200 <= response.status_code < 400,
-                "status_code": response.status_code,
-                "response_time": int(response_time),
-                "url": response.url,
-                "content_length": len(response.content),
-                "final_url": response.url
-            }
-        except requests.exceptions.Timeout:
-            return {"success": False, "error": "HTTP request timeout"}
-        except requests.exceptions.ConnectionError:
-            return {"success": False, "error": "Connection failed"}
+            return get_http_prober().check(url)
         except Exception as e:
             return {"success": False, "error": str(e)}
 
     @staticmethod
-    def tcp_check(target: str, port: int = 80) -> Dict[str, Any]:
-        """TCP port check"""
+    def tcp_check(target: str, ports: Optional[List[int]] = None) -> Dict[str, Any]:
+        """TCP connect check of one or many ports (default 80), all ports in one timeout window"""
         try:
-            start_time = time.time()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((target, port))
-            response_time = round((time.time() - start_time) * 1000, 2)
-            sock.close()
-            return {
-                "success": result == 0,
-                "port": port,
-                "response_time": int(response_time),
-                "status": "open" if result == 0 else "closed"
-            }
+            return get_tcp_scanner().check(target, ports or [80])
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    @staticmethod
+    def traceroute_check(target: str) -> Dict[str, Any]:
+        """Traceroute with every TTL probed at once: about one timeout per trace"""
+        try:
+            return get_tracer().trace(target)
         except Exception as e:
             return {"success": False, "error": str(e)}
 
     @staticmethod
     def dns_check(target: str, record_type: str = "A") -> Dict[str, Any]:
         """DNS record check"""
+        return NetworkChecker.dns_checks(target, [record_type])[record_type]
+
+    @staticmethod
+    def dns_checks(target: str, record_types: List[str]) -> Dict[str, Dict[str, Any]]:
+        """All record types of one target, queried concurrently by the shared DNS engine"""
         try:
-            import dns.resolver
-            start_time = time.time()
-            resolver = dns.resolver.Resolver()
-            resolver.timeout = 5
-            resolver.lifetime = 5
-            answers = resolver.resolve(target, record_type)
-            response_time = round((time.time() - start_time) * 1000, 2)
-            records = [str(rdata) for rdata in answers]
-            return {
-                "success": True,
-                "records": records,
-                "response_time": int(response_time),
-                "record_type": record_type
-            }
+            return get_dns_engine().resolve_many(target, record_types)
         except Exception as e:
-            return {"success": False, "error": str(e), "record_type": record_type}
+            return {rt: {"success": False, "error": str(e) or type(e).__name__, "record_type": rt}
+                    for rt in record_types}
 
 
 class Agent:
@@ -124,10 +138,33 @@ class Agent:
         self.backend_url = os.getenv("BACKEND_URL", "http://backend:8000")
         self.token = os.getenv("AGENT_TOKEN", "secret123")
         self.name = os.getenv("AGENT_NAME", "docker-agent-1")
+        # Верхняя граница одного claim; обычно агент просит столько проверок, сколько у него свободных слотов
+        self.claim_batch = int(os.getenv("AGENT_CLAIM_BATCH", "100"))
+        # Агент, выделенный под одну пачку проверок: берёт только её проверки
+        self.batch_id = os.getenv("AGENT_BATCH_ID") or None
+        self.long_poll_timeout = float(os.getenv("AGENT_LONG_POLL_TIMEOUT", "25"))
+        self.max_idle_delay = float(os.getenv("AGENT_MAX_IDLE_DELAY", "15"))
+        self.heartbeat_interval = float(os.getenv("AGENT_HEARTBEAT_INTERVAL", "15"))
         self.agent_id = None
         self.checker = NetworkChecker()
+        self.executor = CheckExecutor(
+            max_concurrency=int(os.getenv("AGENT_MAX_CONCURRENCY", "32")),
+            per_target_concurrency=int(os.getenv("AGENT_PER_TARGET_CONCURRENCY", "4"))
+        )
+        # Будит цикл claim, когда проба освобождает слот исполнителя
+        self._capacity = threading.Condition()
+        # Одинаковые пробы одной цели в течение нескольких секунд выполняются один раз
+        self.probe_cache = ProbeCache()
+        # Результаты сначала пишутся на диск, отдельный поток выгружает их пачками
+        self.spool = ResultSpool(os.getenv("AGENT_SPOOL_PATH", f"spool/{self.name}.db"))
+        self.uploader = ResultUploader(self.spool, self.backend_url, self.name)
+        metrics.SPOOLED_RESULTS.set_function(lambda: len(self.spool))
 
     def get_location(self):
+        # Метка для выбора агентов по location, например "Frankfurt, DE, EU"
+        configured = os.getenv("AGENT_LOCATION")
+        if configured:
+            return configured
         try:
             resp = requests.get("https://ipinfo.io/json", timeout=3)
             data = resp.json()
@@ -160,9 +197,11 @@ class Agent:
             return False
 
     def send_heartbeat(self):
+        """Heartbeat with the load the backend dispatcher balances on"""
         try:
             response = requests.post(
                 f"{self.backend_url}/agents/{self.name}/heartbeat",
+                json={"capacity": self.executor.max_concurrency, "in_flight": self.executor.in_flight},
                 timeout=5
             )
             logger.debug(f"💓 Heartbeat: {response.status_code}")
@@ -171,26 +210,52 @@ class Agent:
             logger.error(f"❌ Heartbeat failed: {e}")
             return False
 
-    def get_pending_checks(self):
+    def start_heartbeats(self):
+        """Heartbeats from their own thread: they keep coming, with current load, during long cycles"""
+        def run():
+            while True:
+                self.send_heartbeat()
+                time.sleep(self.heartbeat_interval)
+
+        threading.Thread(target=run, name="heartbeat", daemon=True).start()
+
+    def get_pending_checks(self, limit: int):
+        """Claim up to limit pending checks, long-polling while the queue is empty"""
         try:
-            response = requests.get(f"{self.backend_url}/checks/", timeout=10)
+            response = requests.post(
+                f"{self.backend_url}/agents/{self.name}/claim",
+                params={"max": limit, "wait": self.long_poll_timeout,
+                        **({"batch_id": self.batch_id} if self.batch_id else {})},
+                timeout=self.long_poll_timeout + 10
+            )
             if response.status_code == 200:
-                all_checks = response.json()
-                pending_checks = [
-                    check for check in all_checks
-                    if check.get('status') == 'pending'
-                ]
-                logger.info(f"📋 Found {len(pending_checks)} pending checks")
+                pending_checks = response.json()
+                metrics.CHECKS_CLAIMED.inc(len(pending_checks))
+                logger.info(f"📋 Claimed {len(pending_checks)} pending checks")
                 return pending_checks
             else:
-                logger.error(f"❌ Failed to get checks: {response.status_code}")
+                logger.error(f"❌ Failed to claim checks: {response.status_code}")
                 return []
         except Exception as e:
-            logger.error(f"❌ Error getting checks: {e}")
+            logger.error(f"❌ Error claiming checks: {e}")
             return []
 
-    def perform_single_check(self, check_type: str, target: str) -> Dict[str, Any]:
-        logger.info(f"   Performing {check_type} check for {target}...")
+    def perform_single_check(self, check_type: str, target: str, params: Optional[dict] = None) -> Dict[str, Any]:
+        # В ключ входят только параметры, от которых зависит проба
+        ports = (params or {}).get('ports') if check_type == 'tcp' else None
+        result, age = self.probe_cache.get_or_probe(
+            check_type.split('_')[0], (check_type, target, tuple(ports) if ports else None),
+            lambda: self.run_probe(check_type, target, params)
+        )
+        if age is None:
+            return result
+        logger.debug("     %s: cached result for %s, %.1fs old", check_type, target, age)
+        return mark_cached(result, age)
+
+    def run_probe(self, check_type: str, target: str, params: Optional[dict] = None) -> Dict[str, Any]:
+        logger.debug("   Performing %s check for %s...", check_type, target)
+        started = time.monotonic()
+        metrics.PROBES_IN_FLIGHT.inc()
         try:
             if check_type == 'ping':
                 result = self.checker.ping_check(target)
@@ -199,41 +264,130 @@ class Agent:
             elif check_type == 'https':
                 result = self.checker.http_check(f"https://{target}")
             elif check_type == 'tcp':
-                result = self.checker.tcp_check(target, 80)
+                result = self.checker.tcp_check(target, (params or {}).get('ports'))
+            elif check_type == 'traceroute':
+                result = self.checker.traceroute_check(target)
             elif check_type.startswith('dns_'):
                 record_type = check_type.split('_')[1].upper()
                 result = self.checker.dns_check(target, record_type)
             else:
                 result = {"success": False, "error": f"Unknown check type: {check_type}"}
-            status_icon = "✅" if result.get("success") else "❌"
-            error_msg = result.get("error", "")
-            logger.info(f"     {check_type}: {status_icon} {error_msg}")
-            return result
         except Exception as e:
             logger.error(f"     ❌ Error in {check_type}: {e}")
-            return {"success": False, "error": str(e)}
+            result = {"success": False, "error": str(e)}
+        finally:
+            metrics.PROBES_IN_FLIGHT.dec()
+        metrics.observe_probe(check_type, time.monotonic() - started, result.get("success"))
+        logger.debug("     %s: %s %s", check_type, "✅" if result.get("success") else "❌", result.get("error", ""))
+        return result
+
+    def perform_dns_checks(self, check_types: List[str], target: str) -> Dict[str, Dict[str, Any]]:
+        record_types = {ct: ct.split('_')[1].upper() for ct in check_types}
+        wanted = tuple(sorted(set(record_types.values())))
+        results, age = self.probe_cache.get_or_probe(
+            DNS_BATCH, (target, wanted), lambda: self.run_dns_probe(target, wanted)
+        )
+        if age is None:
+            return {ct: results[rt] for ct, rt in record_types.items()}
+        logger.debug("     %s: cached results for %s, %.1fs old", ", ".join(check_types), target, age)
+        return {ct: mark_cached(results[rt], age) for ct, rt in record_types.items()}
+
+    def run_dns_probe(self, target: str, record_types: Tuple[str, ...]) -> Dict[str, Dict[str, Any]]:
+        logger.debug("   Performing DNS %s checks for %s...", ", ".join(record_types), target)
+        started = time.monotonic()
+        with metrics.PROBES_IN_FLIGHT.track_inprogress():
+            results = self.checker.dns_checks(target, list(record_types))
+        elapsed = time.monotonic() - started
+        for record_type, result in results.items():
+            # Типы записей опрашиваются параллельно: у каждого время всего пакета
+            metrics.observe_probe(f"dns_{record_type.lower()}", elapsed, result.get("success"))
+            logger.debug("     dns_%s: %s %s", record_type.lower(), "✅" if result.get("success") else "❌",
+                         result.get("error", ""))
+        return results
+
+    @staticmethod
+    def format_result(check_type: str, result_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "check_type": check_type,
+            "success": result_data.get("success", False),
+            "result_data": result_data,
+            "response_time": result_data.get("response_time"),
+            "error_message": result_data.get("error")
+        }
 
     def perform_check(self, check_data: dict):
-        target = check_data['target']
-        check_types = check_data['check_types']
-        check_id = check_data['id']
-        logger.info(f"🔍 Starting checks for {target}: {check_types}")
-        results = []
-        for check_type in check_types:
-            result_data = self.perform_single_check(check_type, target)
-            formatted_result = {
-                "check_type": check_type,
-                "success": result_data.get("success", False),
-                "result_data": result_data,
-                "response_time": result_data.get("response_time"),
-                "error_message": result_data.get("error")
-            }
-            results.append(formatted_result)
-        success = self.submit_results(check_id, results)
-        if success:
-            logger.info(f"🎉 Completed check {check_id}")
-        else:
-            logger.error(f"💥 Failed to submit results for {check_id}")
+        self.perform_checks([check_data])
+
+    def perform_checks(self, checks: List[dict]):
+        """Run checks and return once all their results are spooled"""
+        for done in self.submit_checks(checks):
+            done.wait()
+
+    def submit_checks(self, checks: List[dict]) -> List[threading.Event]:
+        """Start every check type of every check on the executor and return at once.
+
+        Each result is written to the spool from its job's done-callback the
+        moment the probe completes, and the uploader sends it on right away, so
+        fast probes are visible before slow ones finish and nothing is lost
+        while the backend is unreachable. Returns one event per check, set once
+        all its results are spooled.
+        """
+        claimed_at = time.monotonic()
+        events = []
+        for check in checks:
+            check_id = check['id']
+            target = check['target']
+            check_types = check['check_types']
+            params = check.get('params')
+            logger.debug("🔍 Starting checks for %s: %s", target, check_types)
+            done = threading.Event()
+            events.append(done)
+            if not check_types:
+                self.submit_results(check_id, [])
+                done.set()
+                continue
+            state = {"remaining": len(check_types), "claimed_at": claimed_at, "done": done}
+            dns_types = [ct for ct in check_types if ct.startswith('dns_')]
+            jobs = [([ct], self.perform_single_check, (ct, target, params)) for ct in check_types if ct not in dns_types]
+            if dns_types:
+                jobs.append((dns_types, self.perform_dns_checks, (dns_types, target)))
+            for job_types, fn, args in jobs:
+                future = self.executor.submit(target, fn, *args)
+                future.add_done_callback(
+                    lambda f, check_id=check_id, job_types=job_types, state=state:
+                        self.job_done(check_id, job_types, state, f)
+                )
+        return events
+
+    def job_done(self, check_id: str, job_types: List[str], state: dict, future):
+        """Spool the results of one finished job and wake the claim loop"""
+        try:
+            job_result = future.result()
+            results = (list(job_result.items()) if job_types[0].startswith('dns_')
+                       else [(job_types[0], job_result)])
+        except Exception as e:
+            # run_probe ловит ошибки проб сам; сюда попадает только сбой вокруг пробы
+            logger.error(f"❌ Job {', '.join(job_types)} of check {check_id} failed: {e}")
+            results = [(check_type, {"success": False, "error": str(e)}) for check_type in job_types]
+        try:
+            # result_uid и время фиксируются при записи: повторная выгрузка не создаст дублей
+            created_at = datetime.now(timezone.utc).isoformat()
+            self.spool.append([
+                {"check_id": check_id, "result_uid": uuid.uuid4().hex, "created_at": created_at,
+                 **self.format_result(check_type, result_data)}
+                for check_type, result_data in results
+            ])
+            self.uploader.notify()
+        except Exception as e:
+            logger.error(f"❌ Cannot spool results of check {check_id}: {e}")
+        with self._capacity:
+            state["remaining"] -= len(results)
+            finished = state["remaining"] <= 0
+            self._capacity.notify_all()
+        if finished:
+            metrics.CYCLE_SECONDS.observe(time.monotonic() - state["claimed_at"])
+            logger.debug("🎉 Completed check %s", check_id)
+            state["done"].set()
 
     def submit_results(self, check_id: str, results: List[dict]) -> bool:
         try:
@@ -258,34 +412,76 @@ class Agent:
             logger.error(f"❌ Error submitting results: {e}")
             return False
 
-    def process_checks(self):
-        pending_checks = self.get_pending_checks()
+    def free_slots(self) -> int:
+        """Block until the executor has a free slot; returns the number of free slots.
+
+        The claim long-poll goes out as soon as this returns, so whenever a
+        slot is free the agent is parked on the backend and a new check
+        reaches it in milliseconds, also while other checks are running.
+        """
+        with self._capacity:
+            while True:
+                free = self.executor.max_concurrency - self.executor.in_flight
+                if free > 0:
+                    return free
+                self._capacity.wait(1.0)
+
+    def process_checks(self, limit: Optional[int] = None) -> int:
+        """Claim up to limit checks (by default, as many as there are free slots) and start them.
+
+        Claiming is decoupled from execution: the checks are not waited for, so
+        a slow probe occupies one slot, not the whole agent, and the next claim
+        goes out as soon as a slot is free.
+        """
+        if limit is None:
+            limit = min(self.free_slots(), self.claim_batch)
+        pending_checks = self.get_pending_checks(limit)
         if not pending_checks:
             logger.info("😴 No pending checks")
-            return
+            return 0
         for check in pending_checks:
-            logger.info(f"  📝 Check ID: {check['id']}, Target: {check['target']}")
-            self.perform_check(check)
+            logger.debug("  📝 Check ID: %s, Target: %s", check['id'], check['target'])
+        self.submit_checks(pending_checks)
+        return len(pending_checks)
+
+    def next_idle_delay(self, idle_delay: float, processed: int, elapsed: float) -> float:
+        """Adaptive polling delay between claim requests.
+
+        No delay after work was found or when the backend held the long-poll
+        open; otherwise (errors, servers without long-poll) back off
+        exponentially up to max_idle_delay.
+        """
+        if processed or elapsed >= self.long_poll_timeout:
+            return 0
+        return min(max(idle_delay * 2, 1), self.max_idle_delay)
 
     def run(self):
         logger.info(f"🚀 Starting Host Checker Agent: {self.name}")
         logger.info(f"🔗 Backend URL: {self.backend_url}")
+        metrics.start_server()
         for attempt in range(3):
             if self.register_agent():
                 break
             logger.warning(f"⚠️ Registration attempt {attempt + 1} failed")
             time.sleep(2)
+        self.uploader.start()
+        self.start_heartbeats()
         cycle_count = 0
+        idle_delay = 0
         while True:
             cycle_count += 1
+            processed = 0
+            limit = min(self.free_slots(), self.claim_batch)
+            started = time.monotonic()
             try:
-                logger.info(f"🔄 Agent cycle #{cycle_count}")
-                self.send_heartbeat()
-                self.process_checks()
-                logger.info(f"💤 Cycle #{cycle_count} completed, waiting 15s...")
+                logger.debug(f"🔄 Agent cycle #{cycle_count}, {limit} free slots")
+                processed = self.process_checks(limit)
             except Exception as e:
                 logger.error(f"💥 Error in cycle #{cycle_count}: {e}")
-            time.sleep(15)
+            idle_delay = self.next_idle_delay(idle_delay, processed, time.monotonic() - started)
+            if idle_delay:
+                logger.info(f"💤 Cycle #{cycle_count} completed, waiting {idle_delay:.0f}s...")
+                time.sleep(idle_delay)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+import logging
+import os
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-сервера метрик Prometheus; 0 отключает
+METRICS_PORT = int(os.getenv("AGENT_METRICS_PORT", "9101"))
+
+PROBE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PROBE_SECONDS = Histogram(
+    "hostchecker_agent_probe_duration_seconds", "Probe latency by check type and outcome",
+    ["check_type", "result"], buckets=PROBE_BUCKETS
+)
+PROBES_IN_FLIGHT = Gauge("hostchecker_agent_probes_in_flight", "Probes running right now")
+CYCLE_SECONDS = Histogram(
+    "hostchecker_agent_cycle_duration_seconds", "Claim-to-done time of a check: from the claim to its last spooled result",
+    buckets=PROBE_BUCKETS + (60, 120)
+)
+CHECKS_CLAIMED = Counter("hostchecker_agent_checks_claimed", "Checks leased from the backend")
+RESULTS_UPLOADED = Counter("hostchecker_agent_results_uploaded", "Results confirmed by the backend")
+UPLOAD_FAILURES = Counter(
+    "hostchecker_agent_upload_failures", "Failed result uploads: network, server (retried) or rejected (dropped)",
+    ["reason"]
+)
+PROBE_CACHE_LOOKUPS = Counter(
+    "hostchecker_agent_probe_cache_lookups", "Probe cache lookups: hit, coalesced (waited for a running probe) or miss",
+    ["outcome"]
+)
+SPOOLED_RESULTS = Gauge("hostchecker_agent_spooled_results", "Results waiting in the spool for upload")
+
+
+def observe_probe(check_type: str, seconds: float, success: bool):
+    PROBE_SECONDS.labels(check_type, "success" if success else "failure").observe(seconds)
+
+
+def start_server(port: int = METRICS_PORT):
+    """Serve /metrics from a background thread"""
+    if not port:
+        return
+    try:
+        start_http_server(port)
+        logger.info(f"📈 Metrics on :{port}/metrics")
+    except OSError as e:
+        logger.warning(f"⚠️ Metrics server not started on :{port}: {e}")
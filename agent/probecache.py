@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Время жизни результата по виду пробы, секунды; 0 — не кэшировать.
+# Переопределяется списком "ping=5,http=0,dns=30"
+DEFAULT_TTLS = {"ping": 5, "http": 5, "https": 5, "tcp": 5, "dns": 10, "traceroute": 30}
+PROBE_CACHE_SIZE = int(os.getenv("AGENT_PROBE_CACHE_SIZE", "1024"))
+
+
+def parse_ttls(value: Optional[str]) -> Dict[str, float]:
+    ttls = dict(DEFAULT_TTLS)
+    for item in (value or "").split(","):
+        if "=" in item:
+            kind, seconds = item.split("=", 1)
+            ttls[kind.strip()] = float(seconds)
+    return ttls
+
+
+PROBE_CACHE_TTLS = parse_ttls(os.getenv("AGENT_PROBE_CACHE_TTL"))
+
+
+def mark_cached(result: Dict[str, Any], age: float) -> Dict[str, Any]:
+    """Copy of a probe result flagged as not measured for this check"""
+    return {**result, "cached": True, "cache_age": round(age, 3)}
+
+
+class ProbeCache:
+    """Short-lived probe results shared by identical checks.
+
+    Results are kept per key for the TTL of the probe kind, at most
+    max_entries of them, least recently used evicted first. While a probe
+    is running, callers with the same key wait for it instead of probing
+    the target again (single-flight). Exceptions are passed to every waiter
+    and never cached.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, max_entries: int = PROBE_CACHE_SIZE):
+        self.ttls = PROBE_CACHE_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        # key -> (expires, finished, result), по времени monotonic
+        self._entries: "OrderedDict[Hashable, Tuple[float, float, Any]]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_probe(self, kind: str, key: Hashable, probe: Callable[[], Any]) -> Tuple[Any, Optional[float]]:
+        """(result, age): age is None when the probe ran for this call, else seconds since it finished"""
+        ttl = self.ttls.get(kind, 0)
+        if ttl <= 0 or self.max_entries <= 0:
+            return probe(), None
+        key = (kind, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                metrics.PROBE_CACHE_LOOKUPS.labels("hit").inc()
+                return entry[2], now - entry[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            metrics.PROBE_CACHE_LOOKUPS.labels("coalesced").inc()
+            result, finished = future.result()
+            return result, time.monotonic() - finished
+
+        metrics.PROBE_CACHE_LOOKUPS.labels("miss").inc()
+        try:
+            result = probe()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        finished = time.monotonic()
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (finished + ttl, finished, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result((result, finished))
+        return result, None
+
+    def __len__(self):
+        return len(self._entries)
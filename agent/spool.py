@@ -0,0 +1,179 @@
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SPOOL_MAX_ROWS = int(os.getenv("AGENT_SPOOL_MAX_ROWS", "100000"))
+UPLOAD_BATCH_SIZE = int(os.getenv("AGENT_UPLOAD_BATCH_SIZE", "500"))
+UPLOAD_MAX_BACKOFF = float(os.getenv("AGENT_UPLOAD_MAX_BACKOFF", "60"))
+UPLOAD_TIMEOUT = 30
+# Небольшая задержка перед отправкой: результаты, готовые почти одновременно, уходят одной пачкой
+UPLOAD_LINGER_SECONDS = 0.05
+
+
+class ResultSpool:
+    """Durable FIFO of results waiting for upload, kept in a local SQLite file.
+
+    Every result is committed here before any network call, so a backend
+    outage or an agent restart loses nothing. Each row is the JSON body of
+    one result. Over max_rows the oldest results are dropped.
+    """
+
+    def __init__(self, path: str, max_rows: int = SPOOL_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)")
+        self._lock = threading.Lock()
+
+    def append(self, results: List[dict]):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT INTO results (body) VALUES (?)", [(json.dumps(r),) for r in results])
+                overflow = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_rows
+                if overflow > 0:
+                    self._db.execute("DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY id LIMIT ?)",
+                                     (overflow,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if overflow > 0:
+            logger.warning(f"⚠️ Result spool full, dropped {overflow} oldest results")
+
+    def peek(self, limit: int) -> List[Tuple[int, str]]:
+        """Oldest results as (id, JSON body)"""
+        with self._lock:
+            return self._db.execute("SELECT id, body FROM results ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def remove(self, last_id: int):
+        """Drop every result up to and including last_id"""
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE id <= ?", (last_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class UploadError(Exception):
+    pass
+
+
+class ResultUploader:
+    """Background thread draining the spool into POST /results/bulk.
+
+    Results go out in gzip-compressed batches of up to batch_size. A failed
+    upload is retried with exponential backoff and jitter; results leave the
+    spool only once the backend confirmed them. A batch re-sent after a lost
+    response is harmless: every result carries a result_uid and the backend
+    skips the ones it already stored.
+    """
+
+    def __init__(self, spool: ResultSpool, backend_url: str, agent_name: str,
+                 batch_size: int = UPLOAD_BATCH_SIZE, max_backoff: float = UPLOAD_MAX_BACKOFF):
+        self.spool = spool
+        self.url = f"{backend_url}/results/bulk"
+        self.agent_name = agent_name
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def notify(self):
+        """New results were spooled"""
+        self._wakeup.set()
+
+    def start(self):
+        pending = len(self.spool)
+        if pending:
+            logger.info(f"📦 Replaying {pending} spooled results")
+        self._stop.clear()
+        self._wakeup.set()
+        self._thread = threading.Thread(target=self._run, name="result-uploader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=UPLOAD_TIMEOUT + 5)
+            self._thread = None
+
+    def upload_once(self) -> int:
+        """Send one batch; returns the number of results that left the spool"""
+        rows = self.spool.peek(self.batch_size)
+        if not rows:
+            return 0
+        # Строки спула уже JSON: собираем тело запроса без повторной сериализации
+        payload = '{"agent_name": %s, "results": [%s]}' % (json.dumps(self.agent_name), ",".join(body for _, body in rows))
+        try:
+            response = self.session.post(
+                self.url,
+                data=gzip.compress(payload.encode(), compresslevel=6),
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                timeout=UPLOAD_TIMEOUT
+            )
+        except requests.RequestException as e:
+            metrics.UPLOAD_FAILURES.labels("network").inc()
+            raise UploadError(str(e)) from e
+        if response.status_code == 200:
+            data = response.json()
+            self.spool.remove(rows[-1][0])
+            metrics.RESULTS_UPLOADED.inc(data.get("results_saved") or 0)
+            logger.info(f"📤 Uploaded {data.get('results_saved')} results"
+                        + (f" ({data['duplicates']} already stored)" if data.get("duplicates") else ""))
+            if data.get("invalid_count"):
+                logger.error(f"❌ Backend rejected {data['invalid_count']} invalid results: {data.get('invalid_results', [])[:3]}")
+            return len(rows)
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            # Повтор не поможет: не даём одной испорченной пачке заблокировать очередь
+            self.spool.remove(rows[-1][0])
+            metrics.UPLOAD_FAILURES.labels("rejected").inc()
+            logger.error(f"❌ Backend rejected {len(rows)} results ({response.status_code}): {response.text[:200]}")
+            return len(rows)
+        metrics.UPLOAD_FAILURES.labels("server").inc()
+        raise UploadError(f"HTTP {response.status_code}")
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            if backoff:
+                # Во время паузы новые результаты только копятся в спуле
+                self._stop.wait(backoff)
+            else:
+                self._wakeup.wait()
+                self._stop.wait(UPLOAD_LINGER_SECONDS)
+            self._wakeup.clear()
+            try:
+                while self.upload_once() and not self._stop.is_set():
+                    pass
+                backoff = 0.0
+            except UploadError as e:
+                backoff = min(max(backoff * 2, 1.0), self.max_backoff) * random.uniform(0.8, 1.2)
+                logger.warning(f"⚠️ Result upload failed, {len(self.spool)} results spooled, retry in {backoff:.1f}s: {e}")
+            except Exception as e:
+                backoff = self.max_backoff
+                logger.error(f"❌ Result uploader error: {e}")
@@ -0,0 +1,183 @@
+import errno
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TCP_TIMEOUT = float(os.getenv("AGENT_TCP_TIMEOUT", "3"))
+TCP_MAX_SOCKETS = int(os.getenv("AGENT_TCP_MAX_SOCKETS", "256"))
+# Дескрипторы, оставляемые под спул, HTTP-сессии и прочие пробы
+FD_RESERVE = 256
+
+
+def default_socket_budget() -> int:
+    """Sockets all concurrent scans may hold together: RLIMIT_NOFILE minus FD_RESERVE"""
+    try:
+        import resource
+    except ImportError:
+        return 1024 - FD_RESERVE
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        soft = 65536
+    return max(16, soft - FD_RESERVE)
+
+
+TCP_SOCKET_BUDGET = int(os.getenv("AGENT_TCP_SOCKET_BUDGET", "0")) or default_socket_budget()
+
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, errno.EALREADY}
+_UNREACHABLE = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EADDRNOTAVAIL}
+_FAMILIES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+
+Endpoint = Tuple[int, str, int]  # (family, address, port)
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def connect_status(code: int) -> str:
+    if code == 0:
+        return "open"
+    if code == errno.ECONNREFUSED:
+        return "closed"
+    if code == errno.ETIMEDOUT:
+        return "filtered"
+    if code in _UNREACHABLE:
+        return "unreachable"
+    return "error"
+
+
+class TcpScanner:
+    """Non-blocking TCP connect scanner.
+
+    Every connect of a scan is started on a non-blocking socket and completed
+    through one selector, so a hundred ports cost one timeout window instead
+    of a hundred. At most max_sockets connects of a scan are in flight, and
+    all scans running in parallel share one budget of sockets so that
+    AGENT_MAX_CONCURRENCY scans cannot exhaust the descriptor limit (EMFILE);
+    the rest start as slots free up. Dual-stack targets are scanned on one
+    IPv4 and one IPv6 address.
+    """
+
+    def __init__(self, timeout: float = TCP_TIMEOUT, max_sockets: int = TCP_MAX_SOCKETS,
+                 budget: int = TCP_SOCKET_BUDGET):
+        self.timeout = timeout
+        self.max_sockets = max_sockets
+        self.budget = threading.BoundedSemaphore(budget)
+
+    @staticmethod
+    def resolve(target: str) -> List[Tuple[int, str]]:
+        """First address of every family the target resolves to"""
+        addresses: Dict[int, str] = {}
+        for family, _, _, _, sockaddr in socket.getaddrinfo(target, None, type=socket.SOCK_STREAM):
+            if family in _FAMILIES:
+                addresses.setdefault(family, sockaddr[0])
+        return list(addresses.items())
+
+    def check(self, target: str, ports: List[int]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            addresses = self.resolve(target)
+        except socket.gaierror as e:
+            return {"success": False, "error": f"Cannot resolve {target}: {e}", "ports": []}
+        entries = self.scan([(family, address, port) for family, address in addresses for port in ports])
+        open_ports = sorted({e["port"] for e in entries if e["status"] == "open"})
+        result = {
+            "success": bool(open_ports),
+            "open_ports": open_ports,
+            "ports": entries,
+            "addresses": [address for _, address in addresses],
+            "response_time": int(elapsed_ms(started))
+        }
+        if len(ports) == 1:
+            # Поля прежнего однопортового tcp_check
+            best = next((e for e in entries if e["status"] == "open"), entries[0] if entries else {})
+            result.update(port=ports[0], status=best.get("status", "error"))
+            if best.get("response_time") is not None:
+                result["response_time"] = int(best["response_time"])
+        if not open_ports:
+            result["error"] = f"No open ports among {len(ports)} scanned"
+        return result
+
+    def scan(self, endpoints: List[Endpoint]) -> List[Dict[str, Any]]:
+        """Connect to every (family, address, port) concurrently; results keep the input order"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(endpoints)
+        waiting = deque(enumerate(endpoints))
+        selector = selectors.DefaultSelector()
+        in_flight: Dict[socket.socket, Tuple[int, float]] = {}
+
+        def finish(index: int, status: str, started: float, code: int = 0, sock: Optional[socket.socket] = None):
+            family, address, port = endpoints[index]
+            entry = {"port": port, "address": address, "family": _FAMILIES[family], "status": status,
+                     "response_time": elapsed_ms(started) if status in ("open", "closed") else None}
+            if status in ("error", "unreachable") and code:
+                entry["error"] = os.strerror(code)
+            results[index] = entry
+            if sock is not None:
+                if sock in in_flight:
+                    selector.unregister(sock)
+                    del in_flight[sock]
+                sock.close()
+                self.budget.release()
+
+        try:
+            while waiting or in_flight:
+                while waiting and len(in_flight) < self.max_sockets:
+                    # Без своих соединений скан ждёт освободившийся сокет, иначе добирает то, что есть
+                    if not (self.budget.acquire(timeout=self.timeout) if not in_flight
+                            else self.budget.acquire(blocking=False)):
+                        break
+                    index, (family, address, port) = waiting.popleft()
+                    started = time.perf_counter()
+                    try:
+                        sock = socket.socket(family, socket.SOCK_STREAM)
+                    except OSError as e:
+                        self.budget.release()
+                        finish(index, "error", started, e.errno or 0)
+                        continue
+                    sock.setblocking(False)
+                    code = sock.connect_ex((address, port))
+                    if code in _IN_PROGRESS:
+                        selector.register(sock, selectors.EVENT_WRITE, index)
+                        in_flight[sock] = (index, started)
+                    else:
+                        finish(index, connect_status(code), started, code, sock)
+                if not in_flight:
+                    continue
+
+                oldest = min(started for _, started in in_flight.values())
+                for key, _ in selector.select(max(0.0, oldest + self.timeout - time.perf_counter())):
+                    sock = key.fileobj
+                    index, started = in_flight[sock]
+                    code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    finish(index, connect_status(code), started, code, sock)
+
+                now = time.perf_counter()
+                for sock, (index, started) in list(in_flight.items()):
+                    if now - started >= self.timeout:
+                        finish(index, "filtered", started, sock=sock)
+        finally:
+            for sock in list(in_flight):
+                sock.close()
+                self.budget.release()
+            selector.close()
+        return results
+
+
+_scanner: Optional[TcpScanner] = None
+_scanner_lock = threading.Lock()
+
+
+def get_tcp_scanner() -> TcpScanner:
+    """Process-wide TCP scanner, created on first use"""
+    global _scanner
+    with _scanner_lock:
+        if _scanner is None:
+            _scanner = TcpScanner()
+        return _scanner
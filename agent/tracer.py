@@ -0,0 +1,315 @@
+import errno
+import logging
+import os
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from icmp import ICMP_ECHO_REPLY, ICMP_ECHO_REQUEST, checksum
+
+logger = logging.getLogger(__name__)
+
+# udp — классический traceroute, icmp — echo-запросы, tcp — SYN на TRACE_TCP_PORT
+TRACE_MODE = os.getenv("AGENT_TRACE_MODE", "icmp").lower()
+TRACE_MAX_HOPS = int(os.getenv("AGENT_TRACE_MAX_HOPS", "30"))
+TRACE_QUERIES = int(os.getenv("AGENT_TRACE_QUERIES", "3"))
+TRACE_TIMEOUT = float(os.getenv("AGENT_TRACE_TIMEOUT", "3"))
+TRACE_TCP_PORT = int(os.getenv("AGENT_TRACE_TCP_PORT", "80"))
+TRACE_MODES = ("udp", "icmp", "tcp")
+UDP_BASE_PORT = 33434
+PAYLOAD_SIZE = 32
+
+ICMP_DEST_UNREACHABLE = 3
+ICMP_TIME_EXCEEDED = 11
+ICMP_PORT_UNREACHABLE = 3
+# Коды Destination Unreachable в нотации traceroute
+UNREACHABLE_FLAGS = {0: "!N", 1: "!H", 2: "!P", 4: "!F", 9: "!X", 10: "!X", 13: "!X"}
+
+
+class _Probe:
+    __slots__ = ("ttl", "sent_at", "rtt", "address", "outcome", "flag", "sock")
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.sent_at = 0.0
+        self.rtt: Optional[float] = None
+        self.address: Optional[str] = None
+        # hop — ответ промежуточного узла, reached — ответ цели, unreachable — узел сообщил о недоступности
+        self.outcome: Optional[str] = None
+        self.flag: Optional[str] = None
+        self.sock: Optional[socket.socket] = None
+
+
+class _Trace:
+    """One trace in flight: its probes, sockets and reply matching"""
+
+    def __init__(self, tracer: "Tracer", address: str):
+        self.tracer = tracer
+        self.mode = tracer.mode
+        self.address = address
+        self.probes: Dict[int, _Probe] = {}
+        self.ident = random.randrange(1, 0xFFFF)
+        self.source_port = 0
+        self.selector = selectors.DefaultSelector()
+        self.icmp = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self.icmp.setblocking(False)
+        self.selector.register(self.icmp, selectors.EVENT_READ)
+        self.udp: Optional[socket.socket] = None
+
+    def close(self):
+        for probe in self.probes.values():
+            if probe.sock is not None:
+                probe.sock.close()
+        if self.udp is not None:
+            self.udp.close()
+        self.icmp.close()
+        self.selector.close()
+
+    def send_all(self):
+        """Fire the probes of every TTL at once.
+
+        All queries of one TTL go out back to back: routers rate-limit the
+        ICMP errors they send to one host, so the destination must see the
+        probes of its own TTL before the surplus ones with higher TTLs.
+        """
+        if self.mode == "udp":
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind(("", 0))
+            self.source_port = self.udp.getsockname()[1]
+        index = 0
+        for ttl in range(1, self.tracer.max_hops + 1):
+            for _ in range(self.tracer.queries):
+                probe = _Probe(ttl)
+                if self.mode == "udp":
+                    self._send_udp(probe, UDP_BASE_PORT + index)
+                elif self.mode == "icmp":
+                    self._send_icmp(probe, index)
+                else:
+                    self._send_tcp(probe)
+                index += 1
+
+    def _send_udp(self, probe: _Probe, port: int):
+        self.udp.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, probe.ttl)
+        self.probes[port] = probe
+        probe.sent_at = time.perf_counter()
+        self.udp.sendto(b"\0" * PAYLOAD_SIZE, (self.address, port))
+
+    def _send_icmp(self, probe: _Probe, seq: int):
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        payload = b"\x42" * PAYLOAD_SIZE
+        packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + payload), self.ident, seq) + payload
+        self.icmp.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, probe.ttl)
+        self.probes[seq] = probe
+        probe.sent_at = time.perf_counter()
+        self.icmp.sendto(packet, (self.address, 0))
+
+    def _send_tcp(self, probe: _Probe):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.sock = sock
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, probe.ttl)
+        # Дошедшее соединение закрываем RST, не оставляя его цели
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        sock.bind(("", 0))
+        self.probes[sock.getsockname()[1]] = probe
+        probe.sent_at = time.perf_counter()
+        code = sock.connect_ex((self.address, self.tracer.tcp_port))
+        if code in (errno.EINPROGRESS, errno.EAGAIN):
+            self.selector.register(sock, selectors.EVENT_WRITE, probe)
+        else:
+            self._tcp_done(probe, code)
+
+    def collect(self):
+        """Read replies until every TTL up to the destination answered or the timeout ran out"""
+        deadline = time.perf_counter() + self.tracer.timeout
+        while not self.finished():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            for key, _ in self.selector.select(remaining):
+                if key.fileobj is self.icmp:
+                    self._read_icmp()
+                else:
+                    self.selector.unregister(key.fileobj)
+                    self._tcp_done(key.data, key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+
+    def finished(self) -> bool:
+        last = self.last_ttl()
+        return last is not None and all(p.outcome is not None for p in self.probes.values() if p.ttl <= last)
+
+    def last_ttl(self) -> Optional[int]:
+        """Lowest TTL at which the trace ended: destination reached or reported unreachable"""
+        ends = [p.ttl for p in self.probes.values() if p.outcome in ("reached", "unreachable")]
+        return min(ends) if ends else None
+
+    def _answer(self, probe: Optional[_Probe], address: str, outcome: str, flag: Optional[str] = None,
+                received_at: Optional[float] = None):
+        if probe is None or probe.outcome is not None:
+            return
+        probe.rtt = ((received_at or time.perf_counter()) - probe.sent_at) * 1000
+        probe.address = address
+        probe.outcome = outcome
+        probe.flag = flag
+
+    def _tcp_done(self, probe: _Probe, code: int):
+        # SYN-ACK или RST от цели: до неё дошли; прочие ошибки приходят и ICMP-сообщением
+        if code in (0, errno.ECONNREFUSED):
+            self._answer(probe, self.address, "reached")
+
+    def _read_icmp(self):
+        while True:
+            try:
+                data, (source, _) = self.icmp.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received_at = time.perf_counter()
+            reply = self._match(data)
+            if reply is None:
+                continue
+            key, icmp_type, code = reply
+            probe = self.probes.get(key)
+            if icmp_type == ICMP_TIME_EXCEEDED:
+                self._answer(probe, source, "hop", received_at=received_at)
+            elif icmp_type == ICMP_ECHO_REPLY or (code == ICMP_PORT_UNREACHABLE and source == self.address):
+                self._answer(probe, source, "reached", received_at=received_at)
+            else:
+                self._answer(probe, source, "unreachable", UNREACHABLE_FLAGS.get(code, f"!<{code}>"), received_at)
+
+    def _match(self, packet: bytes) -> Optional[Tuple[int, int, int]]:
+        """(probe key, ICMP type, code) of a reply to one of our probes, None for foreign traffic"""
+        message = packet[(packet[0] & 0x0F) * 4:]
+        if len(message) < 8:
+            return None
+        icmp_type, code = message[0], message[1]
+        if icmp_type == ICMP_ECHO_REPLY:
+            ident, seq = struct.unpack("!HH", message[4:8])
+            return (seq, icmp_type, code) if self.mode == "icmp" and ident == self.ident else None
+        if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+            return None
+        # В ошибке цитируется IP-заголовок зонда и первые 8 байт его полезной нагрузки
+        quoted = message[8:]
+        if len(quoted) < 20 or socket.inet_ntoa(quoted[16:20]) != self.address:
+            return None
+        protocol = quoted[9]
+        head = quoted[(quoted[0] & 0x0F) * 4:][:8]
+        if len(head) < 8:
+            return None
+        if self.mode == "udp" and protocol == socket.IPPROTO_UDP:
+            source_port, port = struct.unpack("!HH", head[:4])
+            return (port, icmp_type, code) if source_port == self.source_port else None
+        if self.mode == "tcp" and protocol == socket.IPPROTO_TCP:
+            source_port, port = struct.unpack("!HH", head[:4])
+            return (source_port, icmp_type, code) if port == self.tracer.tcp_port else None
+        if self.mode == "icmp" and protocol == socket.IPPROTO_ICMP and head[0] == ICMP_ECHO_REQUEST:
+            ident, seq = struct.unpack("!HH", head[4:8])
+            return (seq, icmp_type, code) if ident == self.ident else None
+        return None
+
+    def hops(self) -> List[Dict[str, Any]]:
+        by_ttl: Dict[int, List[_Probe]] = {}
+        for probe in self.probes.values():
+            by_ttl.setdefault(probe.ttl, []).append(probe)
+        last = self.last_ttl()
+        if last is None:
+            # Цель не ответила: хвост из молчащих TTL не показываем
+            answered = [p.ttl for p in self.probes.values() if p.outcome is not None]
+            last = max(answered) if answered else 0
+        return [self.summarize_hop(ttl, by_ttl[ttl]) for ttl in range(1, last + 1)]
+
+    @staticmethod
+    def summarize_hop(ttl: int, probes: List[_Probe]) -> Dict[str, Any]:
+        rtts = [p.rtt for p in probes if p.rtt is not None]
+        addresses = list(dict.fromkeys(p.address for p in probes if p.address))
+        hop = {
+            "ttl": ttl,
+            "address": addresses[0] if addresses else None,
+            "rtts": [round(rtt, 2) for rtt in rtts],
+            "sent": len(probes),
+            "received": len(rtts),
+            "loss": round(100.0 * (len(probes) - len(rtts)) / len(probes), 1),
+            "min_rtt": round(min(rtts), 2) if rtts else None,
+            "avg_rtt": round(sum(rtts) / len(rtts), 2) if rtts else None,
+            "max_rtt": round(max(rtts), 2) if rtts else None
+        }
+        if len(addresses) > 1:
+            # Балансировка по нескольким путям: на одном TTL ответили разные узлы
+            hop["addresses"] = addresses
+        flag = next((p.flag for p in probes if p.flag), None)
+        if flag:
+            hop["flag"] = flag
+        return hop
+
+
+class Tracer:
+    """In-process traceroute that probes every TTL at once.
+
+    The probes of all TTLs are sent in one burst and a single raw ICMP socket
+    collects the Time Exceeded / Unreachable replies, matching each to its
+    probe by the quoted header (UDP destination port, TCP source port or
+    ICMP echo sequence). A full trace therefore costs about one timeout
+    instead of hops x timeout, and ends as soon as every hop up to the
+    destination has answered. Needs CAP_NET_RAW; IPv4 only.
+    """
+
+    def __init__(self, mode: str = TRACE_MODE, max_hops: int = TRACE_MAX_HOPS, queries: int = TRACE_QUERIES,
+                 timeout: float = TRACE_TIMEOUT, tcp_port: int = TRACE_TCP_PORT):
+        if mode not in TRACE_MODES:
+            raise ValueError(f"Unknown traceroute mode {mode!r}, expected one of {', '.join(TRACE_MODES)}")
+        self.mode = mode
+        self.max_hops = max_hops
+        self.queries = queries
+        self.timeout = timeout
+        self.tcp_port = tcp_port
+
+    def trace(self, target: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(target, None, socket.AF_INET)[0][4][0]
+        except socket.gaierror as e:
+            return {"success": False, "error": f"Cannot resolve {target}: {e}", "hops": []}
+        try:
+            trace = _Trace(self, address)
+        except PermissionError as e:
+            return {"success": False, "error": f"Traceroute needs a raw ICMP socket (CAP_NET_RAW): {e}", "hops": []}
+        try:
+            trace.send_all()
+            trace.collect()
+            hops = trace.hops()
+        finally:
+            trace.close()
+
+        destination = hops[-1] if hops else None
+        reached = destination is not None and trace.last_ttl() is not None and "flag" not in destination
+        result = {
+            "success": reached,
+            "address": address,
+            "mode": self.mode,
+            "hops": hops,
+            "hop_count": len(hops),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "response_time": int(destination["avg_rtt"]) if reached and destination["avg_rtt"] is not None else None
+        }
+        if not reached:
+            if destination is not None and "flag" in destination:
+                result["error"] = f"Destination unreachable ({destination['flag']}) at hop {destination['ttl']}"
+            else:
+                result["error"] = f"Destination not reached within {self.max_hops} hops"
+        return result
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer, created on first use"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+            logger.info(f"🛰️ Tracer ready: mode={_tracer.mode}, max_hops={_tracer.max_hops}, queries={_tracer.queries}")
+        return _tracer
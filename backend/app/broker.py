@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import threading
+
+
+class CheckBroker:
+    """In-process notifier that wakes agents long-polling for new checks.
+
+    Every publish bumps a version counter. Waiters remember the version they
+    saw before querying the queue, so a check inserted between the query and
+    the wait is never missed. Both threads (sync endpoints) and coroutines
+    (async endpoints) can wait; publish may be called from either.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._async_waiters = set()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def publish(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """Block until something is published after `since` or timeout expires"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != since, timeout)
+
+    async def wait_async(self, since: int, timeout: float) -> bool:
+        """Coroutine version of wait()"""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._cond:
+            if self._version != since:
+                return True
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+broker = CheckBroker()
+
+
+class EventHub:
+    """Fan-out of backend events to asyncio subscribers such as SSE streams.
+
+    publish() may be called from any thread. Every subscriber owns a bounded
+    queue; a consumer that falls behind loses its own oldest events and
+    nobody else's.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        loop = asyncio.get_running_loop()
+        subscriber = (loop, asyncio.Queue(self.queue_size))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def publish(self, message: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                pass
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+def _offer(queue: asyncio.Queue, message: dict):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+event_hub = EventHub()
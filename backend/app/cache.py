@@ -0,0 +1,407 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "5"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "0.5"))
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "hostchecker")
+REDIS_RETRY_SECONDS = 10
+
+# Поля с TTL лежат в отдельном хэше: TTL в Redis действует на ключ целиком
+TTL_SUFFIX = ":ttl"
+
+CHECKS_NAMESPACE = "checks"
+AGENTS_NAMESPACE = "agents"
+_PENDING_KEY = "cache_pending"
+
+
+def check_namespace(check_id: str) -> str:
+    return f"check:{check_id}"
+
+
+class LocalCache:
+    """Thread-safe LRU of (namespace, field) -> value with an optional TTL per entry"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._namespaces: Dict[str, set] = {}
+        # Когда namespace последний раз инвалидировался: защита от записи устаревших данных
+        self._invalidated: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, field: str) -> Optional[str]:
+        key = (namespace, field)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, namespace: str, field: str, value: str, ttl: Optional[float]):
+        key = (namespace, field)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+            self._entries.move_to_end(key)
+            self._namespaces.setdefault(namespace, set()).add(field)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, namespaces: Iterable[str]):
+        now = time.monotonic()
+        with self._lock:
+            for namespace in namespaces:
+                for field in self._namespaces.pop(namespace, ()):
+                    self._entries.pop((namespace, field), None)
+                self._invalidated[namespace] = now
+                self._invalidated.move_to_end(namespace)
+            while len(self._invalidated) > self.max_entries:
+                self._invalidated.popitem(last=False)
+
+    def invalidated_since(self, namespace: str, since: float) -> bool:
+        with self._lock:
+            return self._invalidated.get(namespace, float("-inf")) >= since
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        fields = self._namespaces.get(key[0])
+        if fields is not None:
+            fields.discard(key[1])
+            if not fields:
+                del self._namespaces[key[0]]
+
+
+class Cache:
+    """Two-level read cache plus an event bus shared by all backend workers.
+
+    The first level is an in-process LRU, the second is Redis when REDIS_URL
+    is set. Each namespace (one check, the check list, the agent list) is a
+    pair of Redis hashes, permanent fields and fields with a TTL, so a write
+    drops a whole check with a single DEL. Writes invalidate after commit and
+    broadcast on the events channel, which also carries check_created /
+    check_completed events between workers. Any Redis failure degrades to the
+    local level instead of failing the request.
+
+    Redis writes, deletes and broadcasts are queued to a writer thread, so a
+    slow Redis never holds up a request or the event loop; async endpoints
+    read through get_async(). Until its delete reaches Redis, an invalidated
+    namespace is not read from Redis.
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl: float = CACHE_TTL_SECONDS):
+        self.local = LocalCache(max_entries)
+        self.ttl = ttl
+        self.worker_id = uuid.uuid4().hex
+        self.channel = f"{CACHE_PREFIX}:events"
+        self.hits = 0
+        self.misses = 0
+        self._redis_url = redis_url
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._listeners: Dict[str, List[Callable[[dict], None]]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._outbox: "queue.SimpleQueue[Callable[[], None]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        # namespace -> число инвалидаций, ещё не дошедших до Redis
+        self._unflushed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(
+                redis_url, decode_responses=True,
+                socket_timeout=CACHE_REDIS_TIMEOUT, socket_connect_timeout=CACHE_REDIS_TIMEOUT
+            )
+
+    # Чтение и запись
+    def get(self, namespace: str, field: str) -> Optional[str]:
+        value = self.local.get(namespace, field)
+        if value is None and self._redis_readable(namespace):
+            value = self._redis_get(namespace, field)
+        return self._count(value)
+
+    async def get_async(self, namespace: str, field: str) -> Optional[str]:
+        """get() for coroutines: the Redis lookup runs in a thread, not on the event loop"""
+        value = self.local.get(namespace, field)
+        if value is None and self._redis_readable(namespace):
+            value = await asyncio.to_thread(self._redis_get, namespace, field)
+        return self._count(value)
+
+    def set(self, namespace: str, field: str, value: str, ttl: Optional[float] = None,
+            since: Optional[float] = None):
+        """Store a value; ttl=None keeps it until invalidated.
+
+        `since` is the time.monotonic() taken before the value was loaded: if
+        the namespace was invalidated meanwhile the value may be stale and is
+        not stored.
+        """
+        if since is not None and self.local.invalidated_since(namespace, since):
+            return
+        if self._redis is None:
+            self.local.set(namespace, field, value, ttl)
+            return
+        # С Redis локальный уровень живёт не дольше TTL: сообщение об инвалидации может потеряться
+        self.local.set(namespace, field, value, self.ttl if ttl is None else min(ttl, self.ttl))
+        # Заполнение кэша можно потерять, а очередь при лежащем Redis — нет
+        if self._outbox.qsize() > self.local.max_entries:
+            return
+        key = self._key(namespace)
+        if ttl is None:
+            self._enqueue(lambda: self._call(lambda r: r.hset(key, field, value)))
+            return
+        # Срок хранится в самом значении: EXPIRE хэша продлевается записью любого его поля
+        expiring = f"{time.time() + ttl}\n{value}"
+
+        def write(r):
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(key + TTL_SUFFIX, field, expiring)
+            pipe.expire(key + TTL_SUFFIX, max(1, math.ceil(ttl)))
+            pipe.execute()
+        self._enqueue(lambda: self._call(write))
+
+    def invalidate(self, namespaces: Iterable[str]):
+        namespaces = sorted(set(namespaces))
+        if not namespaces:
+            return
+        self.local.invalidate(namespaces)
+        if self._redis is None:
+            return
+        with self._lock:
+            for namespace in namespaces:
+                self._unflushed[namespace] = self._unflushed.get(namespace, 0) + 1
+        keys = [key for ns in namespaces for key in (self._key(ns), self._key(ns) + TTL_SUFFIX)]
+        payload = self._payload({"type": "invalidate", "namespaces": namespaces})
+
+        def write(r):
+            pipe = r.pipeline(transaction=False)
+            pipe.delete(*keys)
+            pipe.publish(self.channel, payload)
+            pipe.execute()
+
+        def flush():
+            try:
+                self._call(write)
+            finally:
+                with self._lock:
+                    for namespace in namespaces:
+                        left = self._unflushed.pop(namespace) - 1
+                        if left:
+                            self._unflushed[namespace] = left
+        self._enqueue(flush)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> Dict[str, object]:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis" if self._redis is not None else "local",
+            "local_entries": len(self.local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+    # События между воркерами
+    def subscribe(self, event_type: str, callback: Callable[[dict], None]):
+        self._listeners.setdefault(event_type, []).append(callback)
+
+    def publish(self, event_type: str, **data):
+        """Deliver an event to local listeners now and to other workers through Redis (from the writer thread)"""
+        message = {"type": event_type, **data}
+        self._dispatch(message)
+        if self._redis is not None:
+            payload = self._payload(message)
+            self._enqueue(lambda: self._call(lambda r: r.publish(self.channel, payload)))
+
+    def start(self):
+        if self._redis is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="cache-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the writes queued so far have been sent to Redis"""
+        if self._redis is None:
+            return True
+        done = threading.Event()
+        self._enqueue(done.set)
+        return done.wait(timeout)
+
+    def _payload(self, message: dict) -> str:
+        return json.dumps({**message, "origin": self.worker_id})
+
+    def _enqueue(self, write: Callable[[], None]):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+                    self._writer.start()
+        self._outbox.put(write)
+
+    def _write_loop(self):
+        while True:
+            write = self._outbox.get()
+            try:
+                write()
+            except Exception as e:
+                logger.error(f"❌ Cache write failed: {e}")
+
+    def _redis_readable(self, namespace: str) -> bool:
+        return (self._redis is not None and time.monotonic() >= self._redis_down_until
+                and namespace not in self._unflushed)
+
+    def _redis_get(self, namespace: str, field: str) -> Optional[str]:
+        started = time.monotonic()
+        key = self._key(namespace)
+        values = self._call(lambda r: r.pipeline(transaction=False).hget(key, field).hget(key + TTL_SUFFIX, field).execute())
+        if not values:
+            return None
+        value, expiring = values
+        if value is None and expiring is not None:
+            expires_at, value = expiring.split("\n", 1)
+            if float(expires_at) <= time.time():
+                return None
+        # Пока шёл запрос, namespace мог быть инвалидирован
+        if value is not None and not self.local.invalidated_since(namespace, started):
+            self.local.set(namespace, field, value, self.ttl)
+        return value
+
+    def _count(self, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _dispatch(self, message: dict):
+        for callback in self._listeners.get(message["type"], ()):
+            try:
+                callback(message)
+            except Exception as e:
+                logger.error(f"❌ Cache event listener failed for {message['type']}: {e}")
+
+    def _receive(self, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.pop("origin", None) == self.worker_id:
+            return
+        if message["type"] == "invalidate":
+            self.local.invalidate(message.get("namespaces", []))
+        self._dispatch(message)
+
+    def _listen(self):
+        import redis
+        while not self._stop.is_set():
+            # Отдельное соединение без socket_timeout: подписка висит долго
+            client = redis.Redis.from_url(self._redis_url, decode_responses=True)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                logger.info(f"📡 Subscribed to {self.channel}")
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        self._receive(message["data"])
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Cache event subscription lost: {e}")
+                # Пока подписки нет, чужие инвалидации не доходят: сбрасываем локальный уровень
+                self.local.clear()
+                self._stop.wait(REDIS_RETRY_SECONDS)
+            finally:
+                pubsub.close()
+                client.close()
+
+    def _key(self, namespace: str) -> str:
+        return f"{CACHE_PREFIX}:{namespace}"
+
+    def _call(self, fn):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        import redis
+        try:
+            return fn(self._redis)
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Redis unavailable, using local cache only for {REDIS_RETRY_SECONDS}s: {e}")
+            self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            return None
+
+
+cache = Cache()
+
+
+# Инвалидация по факту коммита: CRUD помечает изменённое в сессии
+def _pending(db: Session) -> dict:
+    return db.info.setdefault(_PENDING_KEY, {"namespaces": set(), "events": []})
+
+
+def touch_checks(db: Session, check_ids: Iterable[str], list_changed: bool = True):
+    """Drop cached check entries and the check list once the session commits.
+
+    list_changed=False keeps the check list: a write that only adds results
+    does not change any row of GET /checks/.
+    """
+    namespaces = _pending(db)["namespaces"]
+    namespaces.update(check_namespace(check_id) for check_id in check_ids)
+    if list_changed:
+        namespaces.add(CHECKS_NAMESPACE)
+
+
+def touch_agents(db: Session):
+    _pending(db)["namespaces"].add(AGENTS_NAMESPACE)
+
+
+def emit(db: Session, event_type: str, **data):
+    """Publish an event once the session commits; dropped on rollback"""
+    _pending(db)["events"].append((event_type, data))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    cache.invalidate(pending["namespaces"])
+    for event_type, data in pending["events"]:
+        cache.publish(event_type, **data)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
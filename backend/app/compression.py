@@ -0,0 +1,49 @@
+import os
+import zlib
+
+from fastapi import HTTPException
+
+# Предел распакованного тела запроса: защита от gzip-бомб
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(64 * 1024 * 1024)))
+
+
+class GzipRequestMiddleware:
+    """Transparently decompresses request bodies sent with Content-Encoding: gzip.
+
+    Works on the ASGI receive channel chunk by chunk, so streamed uploads
+    (/results/stream) stay streamed. Endpoints see a plain body; a corrupt
+    stream answers 400 and a body over max_size 413.
+    """
+
+    def __init__(self, app, max_size: int = MAX_DECOMPRESSED_BODY):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or dict(scope["headers"]).get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+        # Длина и кодировка относились к сжатому телу
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        received = 0
+
+        async def receive_decompressed():
+            nonlocal received
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            try:
+                body = decompressor.decompress(message.get("body", b""), self.max_size - received + 1)
+                if not message.get("more_body", False) and not decompressor.unconsumed_tail:
+                    body += decompressor.flush()
+            except zlib.error as e:
+                raise HTTPException(status_code=400, detail=f"Invalid gzip body: {e}")
+            received += len(body)
+            if received > self.max_size or decompressor.unconsumed_tail:
+                raise HTTPException(status_code=413, detail=f"Decompressed body exceeds {self.max_size} bytes")
+            if not message.get("more_body", False) and not decompressor.eof:
+                raise HTTPException(status_code=400, detail="Truncated gzip body")
+            return {**message, "body": body}
+
+        await self.app({**scope, "headers": headers}, receive_decompressed, send)
@@ -1,23 +1,790 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, delete, distinct, func, insert, or_, select, tuple_, update
+from sqlalchemy.orm import Session, joinedload
+from pydantic import ValidationError
+from typing import Any, Dict, List, Optional, Tuple
 from . import models, schemas
-from datetime import datetime
+from .cache import emit, touch_agents, touch_checks
+from .retention import mark_late_results
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+
+logger = logging.getLogger(__name__)
+
+CHECK_LEASE_SECONDS = int(os.getenv("CHECK_LEASE_SECONDS", "120"))
+# Окно повторного использования результатов по умолчанию, секунды; 0 — выключено
+CHECK_REUSE_SECONDS = int(os.getenv("CHECK_REUSE_SECONDS", "0"))
+REUSE_CANDIDATES = 20
+# Назначений выбывших агентов, переназначаемых за один проход
+ORPHAN_BATCH = 1000
 
 # CRUD для проверок
-def create_check(db: Session, check: schemas.CheckCreate):
+def create_check(db: Session, check: schemas.CheckCreate, agents: Optional[List[models.Agent]] = None):
+    """New pending check; with agents (from select_agents) each of them gets an assignment to run it"""
+    check_types = [ct.value for ct in check.check_types]
+    params = check.params()
+    reuse_seconds = CHECK_REUSE_SECONDS if check.reuse_seconds is None else check.reuse_seconds
+    # Результаты выбранных агентов нельзя заменить чужими
+    if reuse_seconds and not agents:
+        source = find_reusable_check(db, check.target, check_types, params,
+                                     datetime.utcnow() - timedelta(seconds=reuse_seconds))
+        if source is not None:
+            return reuse_check(db, source)
     db_check = models.Check(
         target=check.target,
-        check_types=[ct.value for ct in check.check_types]
+        check_types=check_types,
+        params=params,
+        fanout=len(agents) if agents else None,
+        agent_selectors=agent_selectors(check.agents, check.locations) if agents else None
     )
     db.add(db_check)
+    db.flush()
+    if agents:
+        db.execute(insert(models.CheckAssignment), assignment_rows(db_check.id, agents, datetime.utcnow()))
+    touch_checks(db, [db_check.id])
+    emit(db, "check_created", check_id=db_check.id)
     db.commit()
     db.refresh(db_check)
     return db_check
 
+def find_reusable_check(db: Session, target: str, check_types: List[str], params: Optional[dict],
+                        since: datetime) -> Optional[models.Check]:
+    """Latest check of the same target, check types and parameters whose every result is newer than since.
+
+    Copies keep the measurement time, so the window applies to the oldest
+    result rather than to completed_at: a check that ran for long would
+    otherwise hand out results older than the window. Only checks that
+    probed themselves qualify, so reuse never chains past the window.
+    Candidates come from ix_checks_target_completed_at and are compared in
+    Python: JSON equality differs between the databases.
+    """
+    Check = models.Check
+    Result = models.CheckResult
+    stale = select(Result.id).where(Result.check_id == Check.id, Result.created_at < since).exists()
+    candidates = db.scalars(
+        select(Check)
+        .where(Check.target == target, Check.status == "completed", Check.reused_check_id.is_(None),
+               Check.completed_at >= since, Check.fanout.is_(None), ~stale)
+        .order_by(Check.completed_at.desc())
+        .limit(REUSE_CANDIDATES)
+    )
+    wanted = sorted(check_types)
+    for candidate in candidates:
+        if sorted(candidate.check_types or []) == wanted and (candidate.params or None) == params:
+            return candidate
+    return None
+
+def reuse_check(db: Session, source: models.Check) -> models.Check:
+    """Completed check carrying copies of source's results, flagged as cached in result_data"""
+    now = datetime.utcnow()
+    db_check = models.Check(
+        target=source.target,
+        check_types=source.check_types,
+        params=source.params,
+        status="completed",
+        created_at=now,
+        completed_at=now,
+        reused_check_id=source.id
+    )
+    db.add(db_check)
+    db.flush()
+    Result = models.CheckResult
+    source_results = db.execute(
+        select(Result.agent_id, Result.check_type, Result.success, Result.result_data, Result.response_time,
+               Result.error_message, Result.created_at)
+        .where(Result.check_id == source.id)
+        .order_by(Result.id)
+    ).all()
+    if source_results:
+        # created_at копии остаётся временем измерения
+        db.execute(insert(Result), [
+            {"check_id": db_check.id, "agent_id": agent_id, "check_type": check_type, "success": success,
+             "result_data": {**(result_data or {}), "cached": True,
+                             "cache_age": round((now - created_at).total_seconds(), 3)},
+             "response_time": response_time, "error_message": error_message, "created_at": created_at}
+            for agent_id, check_type, success, result_data, response_time, error_message, created_at in source_results
+        ])
+    touch_checks(db, [db_check.id])
+    # Проверка уже завершена: check_created разбудил бы агентов впустую
+    emit(db, "check_completed", check_id=db_check.id)
+    db.commit()
+    db.refresh(db_check)
+    return db_check
+
+def create_check_batch(db: Session, batch: schemas.CheckBatchCreate, targets: List[str]) -> models.CheckBatch:
+    """One check per target in a single executemany INSERT and one transaction.
+
+    New checks have nothing cached yet, so only the check list is invalidated,
+    and one batch_created event wakes the agents instead of an event per check.
+    """
+    now = datetime.utcnow()
+    check_types = [ct.value for ct in batch.check_types]
+    params = batch.params()
+    db_batch = models.CheckBatch(name=batch.name, check_types=check_types, params=params,
+                                 total=len(targets), created_at=now)
+    db.add(db_batch)
+    db.flush()
+    db.execute(insert(models.Check), [
+        {"id": models.generate_uuid(), "target": target, "check_types": check_types, "params": params,
+         "status": "pending", "created_at": now, "batch_id": db_batch.id}
+        for target in targets
+    ])
+    touch_checks(db, [])
+    emit(db, "batch_created", batch_id=db_batch.id, total=len(targets))
+    db.commit()
+    return db_batch
+
+def get_check_batch(db: Session, batch_id: str) -> Optional[schemas.CheckBatchResponse]:
+    """Batch with check counts per status, from one GROUP BY over ix_checks_batch_id_status"""
+    db_batch = db.get(models.CheckBatch, batch_id)
+    if not db_batch:
+        return None
+    counts = dict(db.execute(
+        select(models.Check.status, func.count())
+        .where(models.Check.batch_id == batch_id)
+        .group_by(models.Check.status)
+    ).all())
+    completed = counts.get("completed", 0)
+    if completed == db_batch.total:
+        status = "completed"
+    elif completed or counts.get("running"):
+        status = "running"
+    else:
+        status = "pending"
+    completed_at = None
+    if status == "completed":
+        completed_at = db.scalar(select(func.max(models.Check.completed_at)).where(models.Check.batch_id == batch_id))
+    return schemas.CheckBatchResponse(
+        id=db_batch.id,
+        name=db_batch.name,
+        check_types=db_batch.check_types,
+        params=db_batch.params,
+        created_at=db_batch.created_at,
+        status=status,
+        total=db_batch.total,
+        pending=counts.get("pending", 0),
+        running=counts.get("running", 0),
+        completed=completed,
+        completed_at=completed_at
+    )
+
 def get_check(db: Session, check_id: str):
     return db.query(models.Check).filter(models.Check.id == check_id).first()
 
-def get_checks(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Check).offset(skip).limit(limit).all()
+def get_check_with_results(db: Session, check_id: str):
+    """Load a check with its results and their agents in a single query"""
+    return (
+        db.query(models.Check)
+        .options(joinedload(models.Check.results).joinedload(models.CheckResult.agent))
+        .filter(models.Check.id == check_id)
+        .first()
+    )
+
+def check_etag(check_id: str, status: str, claimed_by, result_count: int, last_result_id) -> str:
+    version = f"{check_id}:{status}:{claimed_by}:{result_count}:{last_result_id}"
+    return '"' + hashlib.sha1(version.encode()).hexdigest()[:20] + '"'
+
+def get_checks(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Checks newest first; pass the cursor of the last row to fetch the next page.
+
+    Keyset pagination over (created_at, id) uses ix_checks_created_at_id and
+    stays constant-time however deep the page is; skip is kept for old clients.
+    """
+    query = db.query(models.Check).order_by(models.Check.created_at.desc(), models.Check.id.desc())
+    if cursor:
+        created_at, check_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(models.Check.created_at, models.Check.id)
+            < tuple_(datetime.fromisoformat(created_at), check_id)
+        )
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+def check_cursor(db_check: models.Check) -> str:
+    return encode_cursor(db_check.created_at.isoformat(), db_check.id)
+
+# Курсоры keyset-пагинации
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a pagination cursor; raises ValueError on malformed input"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+# Мониторы: планировщик узнаёт об изменениях из события monitors_updated
+def create_monitor(db: Session, monitor: schemas.MonitorCreate) -> models.Monitor:
+    now = datetime.utcnow()
+    db_monitor = models.Monitor(
+        name=monitor.name,
+        target=monitor.target,
+        check_types=[ct.value for ct in monitor.check_types],
+        params=monitor.params(),
+        interval_seconds=monitor.interval_seconds,
+        agent_names=monitor.agent_names or None,
+        locations=monitor.locations or None,
+        agent_count=monitor.agent_count,
+        enabled=monitor.enabled,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(db_monitor)
+    db.flush()
+    emit(db, "monitors_updated", monitor_ids=[db_monitor.id])
+    db.commit()
+    db.refresh(db_monitor)
+    return db_monitor
+
+def get_monitor(db: Session, monitor_id: str) -> Optional[models.Monitor]:
+    return db.get(models.Monitor, monitor_id)
+
+def get_monitors(db: Session, limit: int = 100, cursor: Optional[str] = None) -> List[models.Monitor]:
+    """Monitors by id; pass the id of the last row to fetch the next page"""
+    query = select(models.Monitor).order_by(models.Monitor.id).limit(limit)
+    if cursor:
+        query = query.where(models.Monitor.id > cursor)
+    return db.scalars(query).all()
+
+def update_monitor(db: Session, monitor_id: str, changes: schemas.MonitorUpdate) -> Optional[models.Monitor]:
+    db_monitor = db.get(models.Monitor, monitor_id)
+    if not db_monitor:
+        return None
+    fields = changes.model_dump(exclude_unset=True)
+    if "check_types" in fields:
+        fields["check_types"] = [ct.value for ct in changes.check_types]
+    if "ports" in fields:
+        fields["params"] = {"ports": fields.pop("ports")} if changes.ports else None
+    for field, value in fields.items():
+        setattr(db_monitor, field, value)
+    if "interval_seconds" in fields or fields.get("enabled"):
+        # Новая сетка запусков: планировщик выберет ближайшую точку сам
+        db_monitor.next_run_at = None
+    db_monitor.updated_at = datetime.utcnow()
+    emit(db, "monitors_updated", monitor_ids=[monitor_id])
+    db.commit()
+    db.refresh(db_monitor)
+    return db_monitor
+
+def delete_monitor(db: Session, monitor_id: str) -> bool:
+    """Delete a monitor; its past checks stay, detached from it"""
+    db.execute(
+        update(models.Check)
+        .where(models.Check.monitor_id == monitor_id)
+        .values(monitor_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    deleted = db.execute(delete(models.Monitor).where(models.Monitor.id == monitor_id)).rowcount
+    emit(db, "monitors_updated", monitor_ids=[monitor_id])
+    db.commit()
+    return bool(deleted)
+
+# Диспетчер: выбор агентов для проверки
+def location_parts(location: Optional[str]) -> set:
+    """"Frankfurt, DE, EU" -> {"frankfurt", "de", "eu"}"""
+    return {part.strip().lower() for part in (location or "").split(",") if part.strip()}
+
+class AgentPool:
+    """Active agents and their load, for choosing agents for one check or for many in a row.
+
+    Load is the probes an agent reported in flight plus the probes of checks
+    already assigned to it but not picked up yet, divided by its reported
+    capacity. Every pick adds the check's probes to the chosen agents, so
+    checks dispatched together (or back to back, through the pending
+    assignments) spread out before the next heartbeat arrives.
+    """
+
+    def __init__(self, db: Session, names: Optional[List[str]] = None):
+        Agent = models.Agent
+        query = select(Agent).where(Agent.is_active == True)
+        if names:
+            query = query.where(Agent.name.in_(names))
+        self.agents = db.scalars(query).all()
+        self.queued: Dict[str, int] = {}
+        if not self.agents:
+            return
+        Assignment = models.CheckAssignment
+        queued = (
+            select(Assignment.agent_id, func.sum(func.coalesce(func.json_array_length(models.Check.check_types), 1)))
+            .join(models.Check, models.Check.id == Assignment.check_id)
+            .where(Assignment.status == "pending")
+            .group_by(Assignment.agent_id)
+        )
+        if names:
+            queued = queued.where(Assignment.agent_id.in_([agent.id for agent in self.agents]))
+        self.queued = {agent_id: probes or 0 for agent_id, probes in db.execute(queued).all()}
+
+    def load(self, agent: models.Agent) -> float:
+        # Агент без отчёта о ёмкости считается однопоточным
+        return ((agent.in_flight or 0) + self.queued.get(agent.id, 0)) / (agent.capacity or 1)
+
+    def pick(self, names: Optional[List[str]] = None, locations: Optional[List[str]] = None,
+             count: Optional[int] = None, probes: int = 1, exclude=()) -> List[models.Agent]:
+        """Least loaded agents matching the selectors, at most count (default: every named agent, else one)"""
+        agents = [agent for agent in self.agents if agent.id not in exclude]
+        if names:
+            agents = [agent for agent in agents if agent.name in names]
+        if locations:
+            wanted = {location.strip().lower() for location in locations}
+            agents = [agent for agent in agents if location_parts(agent.location) & wanted]
+        # Равная нагрузка — случайный порядок, чтобы простаивающие агенты делили работу
+        ranked = sorted(agents, key=lambda agent: (self.load(agent), random.random()))
+        chosen = ranked[:count or (len(names) if names else 1)]
+        for agent in chosen:
+            self.queued[agent.id] = self.queued.get(agent.id, 0) + probes
+        return chosen
+
+def select_agents(db: Session, names: Optional[List[str]] = None, locations: Optional[List[str]] = None,
+                  count: Optional[int] = None) -> List[models.Agent]:
+    """Least loaded active agents matching the selectors, see AgentPool"""
+    return AgentPool(db, names).pick(names, locations, count)
+
+def agent_selectors(names: Optional[List[str]], locations: Optional[List[str]]) -> Optional[dict]:
+    """What a dispatched check stores to find a replacement agent later"""
+    if not names and not locations:
+        return None
+    return {"agents": names or None, "locations": locations or None}
+
+def assignment_rows(check_id: str, agents: List[models.Agent], now: datetime) -> List[dict]:
+    return [{"check_id": check_id, "agent_id": agent.id, "status": "pending", "created_at": now} for agent in agents]
+
+def reassign_orphaned_assignments(db: Session, now: Optional[datetime] = None,
+                                  limit: int = ORPHAN_BATCH) -> Dict[str, int]:
+    """Move open assignments of inactive agents to other matching agents, or close them as failed.
+
+    A pending assignment moves as soon as its agent is inactive, a running
+    one once its lease has expired as well. The replacement is the least
+    loaded active agent matching the check's selectors that the check was
+    never assigned to. Without one the assignment fails, so the check
+    completes with the results it has. Either way the old agent's running
+    tasks expire and no longer hold the check open.
+    """
+    now = now or datetime.utcnow()
+    Assignment = models.CheckAssignment
+    orphans = (
+        db.query(Assignment, models.Check)
+        .join(models.Agent, models.Agent.id == Assignment.agent_id)
+        .join(models.Check, models.Check.id == Assignment.check_id)
+        .filter(models.Agent.is_active == False,
+                Assignment.status.in_(("pending", "running")),
+                or_(Assignment.status == "pending",
+                    and_(Assignment.status == "running", Assignment.lease_expires_at < now)))
+        .order_by(Assignment.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=Assignment)
+        .all()
+    )
+    if not orphans:
+        return {"reassigned": 0, "failed": 0}
+    check_ids = {db_check.id for _, db_check in orphans}
+    used: Dict[str, set] = {}
+    for check_id, agent_id in db.execute(
+        select(Assignment.check_id, Assignment.agent_id).where(Assignment.check_id.in_(check_ids))
+    ):
+        used.setdefault(check_id, set()).add(agent_id)
+    pool = AgentPool(db)
+    replacements, failed = [], []
+    for assignment, db_check in orphans:
+        assignment.status = "failed"
+        assignment.lease_expires_at = None
+        selectors = db_check.agent_selectors or {}
+        agents = pool.pick(selectors.get("agents"), selectors.get("locations"), count=1,
+                           probes=len(db_check.check_types or ()), exclude=used[db_check.id])
+        if agents:
+            used[db_check.id].add(agents[0].id)
+            replacements += assignment_rows(db_check.id, agents, now)
+        else:
+            failed.append(db_check.id)
+    db.flush()
+    if replacements:
+        db.execute(insert(Assignment), replacements)
+    db.execute(
+        update(models.CheckTask)
+        .where(models.CheckTask.status == "running",
+               tuple_(models.CheckTask.check_id, models.CheckTask.agent_id).in_(
+                   [(assignment.check_id, assignment.agent_id) for assignment, _ in orphans]))
+        .values(status="expired", updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    completed = refresh_check_statuses(db, set(failed), now)
+    touch_checks(db, check_ids)
+    emit(db, "checks_updated", check_ids=sorted(check_ids))
+    if replacements:
+        # Будим агентов, ждущих в long-poll
+        emit(db, "checks_scheduled", count=len(replacements))
+    for check_id in completed:
+        emit(db, "check_completed", check_id=check_id)
+    db.commit()
+    return {"reassigned": len(replacements), "failed": len(failed)}
+
+# Очередь проверок для агентов
+def requeue_expired_checks(db: Session) -> int:
+    """Return checks whose lease has expired back to the pending queue"""
+    expired = (
+        select(models.Check.id)
+        .where(
+            models.Check.status == "running",
+            models.Check.lease_expires_at < datetime.utcnow()
+        )
+    )
+    db.execute(
+        update(models.CheckTask)
+        .where(models.CheckTask.status == "running", models.CheckTask.check_id.in_(expired))
+        .values(status="expired", updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    requeued = db.scalars(
+        update(models.Check)
+        .where(models.Check.id.in_(expired))
+        .values(status="pending", claimed_by=None, lease_expires_at=None)
+        .returning(models.Check.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if requeued:
+        touch_checks(db, requeued)
+        emit(db, "checks_updated", check_ids=requeued)
+    return len(requeued)
+
+def claim_assigned_checks(db: Session, agent: models.Agent, max_checks: int, lease_expires_at: datetime,
+                          now: datetime) -> List[models.Check]:
+    """Lease this agent's pending assignments and those whose lease expired; their checks become running.
+
+    An assignment belongs to its agent, so an expired one needs no requeue
+    step: the same query hands it out again.
+    """
+    Assignment = models.CheckAssignment
+    rows = (
+        db.query(Assignment, models.Check)
+        .join(models.Check, models.Check.id == Assignment.check_id)
+        .filter(Assignment.agent_id == agent.id,
+                # Повтор предиката ix_check_assignments_agent_open: без него индекс неприменим
+                Assignment.status.in_(("pending", "running")),
+                or_(Assignment.status == "pending",
+                    and_(Assignment.status == "running", Assignment.lease_expires_at < now)))
+        .order_by(Assignment.created_at)
+        .limit(max_checks)
+        .with_for_update(skip_locked=True, of=Assignment)
+        .all()
+    )
+    for assignment, db_check in rows:
+        assignment.status = "running"
+        assignment.lease_expires_at = lease_expires_at
+        if db_check.status == "pending":
+            db_check.status = "running"
+    return [db_check for _, db_check in rows]
+
+def claim_checks(db: Session, agent: models.Agent, max_checks: int = 10,
+                 lease_seconds: int = CHECK_LEASE_SECONDS, batch_id: Optional[str] = None):
+    """Atomically lease up to max_checks pending checks to an agent.
+
+    Rows are locked with FOR UPDATE SKIP LOCKED, so concurrent agents never
+    receive the same check. Checks the dispatcher assigned to this agent
+    (including monitor runs) go first, then single checks, and batch checks
+    fill the rest, so a large batch does not hold up checks created after
+    it; with batch_id only that batch's checks are leased. The
+    caller gets plain response objects because the ORM instances are
+    expired by the commit.
+    """
+    requeue_expired_checks(db)
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=lease_seconds)
+    Check = models.Check
+    pending = db.query(Check).filter(Check.status == "pending")
+    if batch_id:
+        assigned = []
+        queues = [pending.filter(Check.batch_id == batch_id)]
+    else:
+        # Проверки с несколькими агентами: аренда у каждого назначения своя, строка проверки не арендуется
+        assigned = claim_assigned_checks(db, agent, max_checks, lease_expires_at, now)
+        queues = [
+            pending.filter(Check.batch_id.is_(None), Check.fanout.is_(None)),
+            pending.filter(Check.batch_id.isnot(None)),
+        ]
+    leased = []
+    for queue in queues:
+        if len(assigned) + len(leased) >= max_checks:
+            break
+        leased += (
+            queue.order_by(Check.created_at)
+            .limit(max_checks - len(assigned) - len(leased))
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+    for db_check in leased:
+        db_check.status = "running"
+        db_check.claimed_by = agent.name
+        db_check.lease_expires_at = lease_expires_at
+    checks = assigned + leased
+    upsert_tasks(db, [
+        {"check_id": c.id, "agent_id": agent.id, "check_type": check_type}
+        for c in checks for check_type in (c.check_types or [])
+    ], status="running", now=now)
+    claimed = [schemas.CheckResponse.model_validate(c) for c in checks]
+    if checks:
+        touch_checks(db, [c.id for c in checks])
+        emit(db, "checks_updated", check_ids=[c.id for c in checks])
+    db.commit()
+    return claimed
+
+# Прогресс проверок по (check, agent, check_type)
+def upsert_tasks(db: Session, rows: List[dict], status: str, now: datetime):
+    """Insert or update check_tasks rows in one executemany statement"""
+    if not rows:
+        return
+    rows = [{**row, "status": status, "updated_at": now} for row in rows]
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        for row in rows:
+            db.merge(models.CheckTask(**row))
+        return
+    stmt = dialect_insert(models.CheckTask)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["check_id", "agent_id", "check_type"],
+        set_={"status": stmt.excluded.status, "updated_at": stmt.excluded.updated_at}
+    )
+    db.execute(stmt, rows)
+
+def refresh_check_statuses(db: Session, check_ids, now: datetime) -> List[str]:
+    """Complete checks where every check type has a result and no agent is still running or assigned.
+
+    A check dispatched to chosen agents completes once none of its
+    assignments is open: failed ones (no agent left to take them over) do
+    not hold it back even though their check types may be missing.
+
+    Runs as a single UPDATE ... RETURNING and returns the ids that changed status.
+    """
+    if not check_ids:
+        return []
+    Task = models.CheckTask
+    running = (
+        select(Task.id)
+        .where(Task.check_id == models.Check.id, Task.status == "running")
+        .exists()
+    )
+    completed_types = (
+        select(func.count(distinct(Task.check_type)))
+        .where(Task.check_id == models.Check.id, Task.status == "completed")
+        .scalar_subquery()
+    )
+    # Проверка с назначенными агентами ждёт всех
+    unfinished = (
+        select(models.CheckAssignment.id)
+        .where(models.CheckAssignment.check_id == models.Check.id,
+               models.CheckAssignment.status.in_(("pending", "running")))
+        .exists()
+    )
+    result = db.execute(
+        update(models.Check)
+        .where(
+            models.Check.id.in_(list(check_ids)),
+            models.Check.status != "completed",
+            ~running,
+            ~unfinished,
+            or_(models.Check.fanout.isnot(None),
+                completed_types >= func.coalesce(func.json_array_length(models.Check.check_types), 0))
+        )
+        .values(status="completed", completed_at=now, lease_expires_at=None)
+        .returning(models.Check.id)
+        .execution_options(synchronize_session=False)
+    )
+    return [row[0] for row in result]
+
+def refresh_check_status(db: Session, db_check: models.Check, now: datetime) -> bool:
+    return bool(refresh_check_statuses(db, [db_check.id], now))
+
+# Приём результатов
+def parse_result_time(value: Optional[str], default: datetime) -> datetime:
+    """Result timestamp reported by the agent as naive UTC; default when absent.
+
+    ResultItem has already rejected values that are not ISO 8601.
+    """
+    if not value:
+        return default
+    return naive_utc(datetime.fromisoformat(value))
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Aware datetime converted to naive UTC, the form every DateTime column stores; naive ones pass as is"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def insert_results(db: Session, rows: List[dict]) -> int:
+    """Insert result rows, skipping those already stored under the same result_uid; returns rows inserted.
+
+    Agents re-send a batch when they did not see the response, so the
+    (result_uid, created_at) unique index makes the upload idempotent.
+    Rows without result_uid are always inserted.
+    """
+    if not rows:
+        return 0
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        keys = [(row["result_uid"], row["created_at"]) for row in rows if row["result_uid"]]
+        if keys:
+            Result = models.CheckResult
+            stored = set(db.execute(
+                select(Result.result_uid, Result.created_at).where(tuple_(Result.result_uid, Result.created_at).in_(keys))
+            ).all())
+            rows = [row for row in rows if (row["result_uid"], row["created_at"]) not in stored]
+        if rows:
+            db.execute(insert(models.CheckResult), rows)
+        return len(rows)
+    stmt = dialect_insert(models.CheckResult).on_conflict_do_nothing(index_elements=["result_uid", "created_at"])
+    return len(db.execute(stmt.returning(models.CheckResult.id), rows).all())
+
+def ingest_results(db: Session, items: List[dict]) -> Dict[str, Any]:
+    """Store results of any number of checks and agents in a few set-based statements.
+
+    Each item carries check_id and agent_name next to the usual result fields.
+    Results are written with one executemany INSERT, task progress with one
+    upsert and check statuses with one UPDATE. Items that do not validate and
+    items whose check does not exist are reported back instead of failing the
+    whole batch: a retry would not fix them. Items whose result_uid is
+    already stored are counted as duplicates and skipped.
+    Items whose check_type the check did not ask for are counted as
+    unexpected and not stored: they would otherwise count towards completion.
+    """
+    now = datetime.utcnow()
+    results = []
+    invalid = []
+    for item in items:
+        try:
+            results.append(schemas.ResultItem.model_validate(item))
+        except ValidationError as e:
+            invalid.append({
+                "check_id": item.get("check_id") if isinstance(item, dict) else None,
+                "error": "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+            })
+    if invalid:
+        logger.warning(f"⚠️ Rejected {len(invalid)} invalid results, first: {invalid[0]['error']}")
+    check_ids = {result.check_id for result in results}
+    fanouts = {}
+    wanted_types = {}
+    for check_id, fanout, check_types in db.execute(
+        select(models.Check.id, models.Check.fanout, models.Check.check_types).where(models.Check.id.in_(check_ids))
+    ):
+        fanouts[check_id] = fanout
+        wanted_types[check_id] = set(check_types or [])
+    known = set(fanouts)
+    agent_ids = get_or_create_agent_ids(db, {result.agent_name for result in results if result.check_id in known})
+
+    rows = []
+    task_keys = set()
+    seen = set()
+    unexpected = 0
+    for result in results:
+        check_id = result.check_id
+        if check_id not in known:
+            continue
+        if result.check_type not in wanted_types[check_id]:
+            unexpected += 1
+            continue
+        created_at = parse_result_time(result.created_at, now)
+        if result.result_uid:
+            # Повтор внутри одной пачки
+            if (result.result_uid, created_at) in seen:
+                continue
+            seen.add((result.result_uid, created_at))
+        agent_id = agent_ids[result.agent_name]
+        rows.append({
+            "check_id": check_id,
+            "agent_id": agent_id,
+            "check_type": result.check_type,
+            "success": result.success,
+            "result_data": result.result_data or {},
+            "response_time": result.response_time,
+            "error_message": result.error_message,
+            "created_at": created_at,
+            "result_uid": result.result_uid
+        })
+        task_keys.add((check_id, agent_id, result.check_type))
+    saved = insert_results(db, rows)
+    if rows:
+        mark_late_results(db, [row["created_at"] for row in rows], now)
+        upsert_tasks(db, [
+            {"check_id": check_id, "agent_id": agent_id, "check_type": check_type}
+            for check_id, agent_id, check_type in task_keys
+        ], status="completed", now=now)
+        dispatched = {check_id for check_id, _, _ in task_keys if fanouts[check_id]}
+        if dispatched:
+            complete_assignments(db, dispatched, {agent_id for _, agent_id, _ in task_keys})
+    completed = refresh_check_statuses(db, {row["check_id"] for row in rows}, now)
+    updated = sorted({row["check_id"] for row in rows})
+    if updated:
+        # Список проверок меняется только при смене статуса
+        touch_checks(db, updated, list_changed=bool(completed))
+        emit(db, "checks_updated", check_ids=updated)
+    for check_id in completed:
+        emit(db, "check_completed", check_id=check_id)
+    db.commit()
+    return {
+        "results_saved": saved,
+        "duplicates": len(rows) - saved,
+        "unexpected_results": unexpected,
+        "completed_checks": completed,
+        "missing_checks": sorted(check_ids - known, key=str),
+        "invalid_count": len(invalid),
+        "invalid_results": invalid[:schemas.MAX_REPORTED_INVALID]
+    }
+
+def complete_assignments(db: Session, check_ids, agent_ids):
+    """Close assignments whose agent has now reported every check type of the check"""
+    Assignment = models.CheckAssignment
+    Task = models.CheckTask
+    reported = (
+        select(func.count(distinct(Task.check_type)))
+        .where(Task.check_id == Assignment.check_id, Task.agent_id == Assignment.agent_id,
+               Task.status == "completed")
+        .scalar_subquery()
+    )
+    wanted = (
+        select(func.coalesce(func.json_array_length(models.Check.check_types), 0))
+        .where(models.Check.id == Assignment.check_id)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Assignment)
+        .where(Assignment.check_id.in_(list(check_ids)), Assignment.agent_id.in_(list(agent_ids)),
+               Assignment.status.in_(("pending", "running")), reported >= wanted)
+        .values(status="completed", lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+
+def submit_check_results(db: Session, check_id: str, agent_name: str, results: List[dict]):
+    """Results of one check from one agent; None if the check does not exist"""
+    db_check = get_check(db, check_id=check_id)
+    if not db_check:
+        return None
+    if not results:
+        # Пустой набор результатов: регистрируем агента и пересчитываем статус
+        get_or_create_agent(db, agent_name)
+        if refresh_check_status(db, db_check, datetime.utcnow()):
+            touch_checks(db, [check_id])
+            emit(db, "checks_updated", check_ids=[check_id])
+            emit(db, "check_completed", check_id=check_id)
+        db.commit()
+        return {"results_saved": 0}
+    return ingest_results(db, [
+        {**result, "check_id": check_id, "agent_name": agent_name} if isinstance(result, dict) else result
+        for result in results
+    ])
 
 # CRUD для агентов
 def create_agent(db: Session, agent: schemas.AgentCreate):
@@ -27,22 +794,99 @@ def create_agent(db: Session, agent: schemas.AgentCreate):
         token=agent.token
     )
     db.add(db_agent)
+    touch_agents(db)
+    emit(db, "agents_updated")
     db.commit()
     db.refresh(db_agent)
     return db_agent
 
+def get_or_create_agent(db: Session, agent_name: str):
+    agent = db.query(models.Agent).filter(models.Agent.name == agent_name).first()
+    if not agent:
+        logger.warning(f"Agent {agent_name} not found, creating temporary agent")
+        agent = models.Agent(
+            name=agent_name,
+            location="unknown",
+            token="auto-generated"
+        )
+        db.add(agent)
+        db.flush()
+        touch_agents(db)
+        emit(db, "agents_updated")
+    return agent
+
+def get_or_create_agent_ids(db: Session, agent_names) -> Dict[str, str]:
+    """Map agent names to ids, creating temporary agents for unknown names"""
+    agent_ids = dict(db.execute(
+        select(models.Agent.name, models.Agent.id).where(models.Agent.name.in_(agent_names))
+    ).all())
+    for agent_name in agent_names:
+        if agent_name not in agent_ids:
+            agent_ids[agent_name] = get_or_create_agent(db, agent_name).id
+    return agent_ids
+
 def get_agent_by_token(db: Session, token: str):
     return db.query(models.Agent).filter(models.Agent.token == token).first()
 
 def get_active_agents(db: Session):
+    """Agents whose heartbeats are current; is_active is maintained by the heartbeat tracker"""
     return db.query(models.Agent).filter(models.Agent.is_active == True).all()
 
-def update_agent_heartbeat(db: Session, agent_id: str):
-    agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
-    if agent:
-        agent.last_heartbeat = datetime.utcnow()
-        db.commit()
-    return agent
+def get_agent_by_name(db: Session, agent_name: str):
+    return db.query(models.Agent).filter(models.Agent.name == agent_name).first()
+
+def flush_heartbeats(db: Session, heartbeats: Dict[str, datetime],
+                     loads: Optional[Dict[str, Tuple[int, int]]] = None) -> int:
+    """Write buffered heartbeats with one executemany UPDATE; silent agents become active again.
+
+    loads maps agent names to the (capacity, in_flight) their last heartbeat reported.
+    """
+    if not heartbeats:
+        return 0
+    agents = models.Agent.__table__
+    revived = db.scalars(
+        update(agents)
+        .where(agents.c.name.in_(list(heartbeats)), agents.c.is_active == False)
+        .values(is_active=True)
+        .returning(agents.c.name)
+    ).all()
+    db.execute(
+        update(agents)
+        .where(agents.c.name == bindparam("agent_name"))
+        .values(last_heartbeat=bindparam("heartbeat")),
+        [{"agent_name": name, "heartbeat": ts} for name, ts in heartbeats.items()]
+    )
+    if loads:
+        db.execute(
+            update(agents)
+            .where(agents.c.name == bindparam("agent_name"))
+            .values(capacity=bindparam("capacity"), in_flight=bindparam("in_flight")),
+            [{"agent_name": name, "capacity": capacity, "in_flight": in_flight}
+             for name, (capacity, in_flight) in loads.items()]
+        )
+    touch_agents(db)
+    if revived:
+        emit(db, "agents_updated", agents=revived, is_active=True)
+    db.commit()
+    return len(heartbeats)
+
+def deactivate_silent_agents(db: Session, cutoff: datetime) -> List[str]:
+    """Mark agents without a heartbeat since cutoff inactive; returns their names"""
+    silent = db.scalars(
+        update(models.Agent)
+        .where(
+            models.Agent.is_active == True,
+            func.coalesce(models.Agent.last_heartbeat, models.Agent.created_at) < cutoff
+        )
+        .values(is_active=False)
+        .returning(models.Agent.name)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if silent:
+        touch_agents(db)
+        emit(db, "agents_updated", agents=silent, is_active=False)
+    db.commit()
+    return silent
 
 # CRUD для результатов
 def create_check_result(db: Session, result_data: dict):
@@ -52,7 +896,38 @@ def create_check_result(db: Session, result_data: dict):
     db.refresh(db_result)
     return db_result
 
-def get_check_results(db: Session, check_id: str):
-    return db.query(models.CheckResult).filter(models.CheckResult.check_id == check_id).all()
-def get_checks(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Check).order_by(models.Check.created_at.desc()).offset(skip).limit(limit).all()
\ No newline at end of file
+def get_check_results(db: Session, check_id: str, after_id: Optional[int] = None, limit: Optional[int] = None):
+    """Results of a check in id order, optionally paged by the last seen id"""
+    query = (
+        db.query(models.CheckResult)
+        .options(joinedload(models.CheckResult.agent))
+        .filter(models.CheckResult.check_id == check_id)
+        .order_by(models.CheckResult.id)
+    )
+    if after_id is not None:
+        query = query.filter(models.CheckResult.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+# Статистика по агрегатам
+def get_rollups(db: Session, granularity: str, since: datetime, until: datetime,
+                target: Optional[str] = None, agent_name: Optional[str] = None,
+                check_type: Optional[str] = None, limit: int = 1000):
+    query = (
+        db.query(models.CheckResultRollup)
+        .options(joinedload(models.CheckResultRollup.agent))
+        .filter(
+            models.CheckResultRollup.granularity == granularity,
+            models.CheckResultRollup.bucket_start >= since,
+            models.CheckResultRollup.bucket_start < until
+        )
+    )
+    if target:
+        query = query.filter(models.CheckResultRollup.target == target)
+    if agent_name:
+        query = query.join(models.Agent).filter(models.Agent.name == agent_name)
+    if check_type:
+        query = query.filter(models.CheckResultRollup.check_type == check_type)
+    return query.order_by(models.CheckResultRollup.bucket_start).limit(limit).all()
@@ -1,12 +1,48 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:password@db:5432/hostchecker")
 
-engine = create_engine(DATABASE_URL)
+# Параметры пула соединений (на каждый движок, sync и async)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Ключ pg_advisory_lock, под которым воркеры по очереди применяют миграции
+MIGRATION_LOCK_KEY = 7261500
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+
+
+def async_database_url(url: str) -> str:
+    """Same database through an asyncio driver: asyncpg for PostgreSQL, aiosqlite for SQLite"""
+    scheme, _, rest = url.partition("://")
+    driver = {"postgresql": "postgresql+asyncpg", "postgresql+psycopg2": "postgresql+asyncpg",
+              "sqlite": "sqlite+aiosqlite"}.get(scheme, scheme)
+    return f"{driver}://{rest}"
+
+
+def pool_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 def get_db():
@@ -14,4 +50,40 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Async session; sync CRUD helpers run on it via `await db.run_sync(fn, ...)`"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def init_db():
+    """Bring the schema up to date by running Alembic migrations.
+
+    Every uvicorn worker calls this at startup; on PostgreSQL an advisory lock
+    lets one of them migrate while the others wait and then find nothing to do.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(backend_dir, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(backend_dir, "migrations"))
+    with engine.connect() as connection:
+        locked = connection.dialect.name == "postgresql"
+        if locked:
+            # Ждём без открытой транзакции: CREATE INDEX CONCURRENTLY у мигрирующего воркера ждёт
+            # все транзакции со старыми снимками, и ожидание в pg_advisory_lock дало бы взаимоблокировку.
+            # Блокировка сессии переживает commit каждой миграции
+            while not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}).scalar():
+                connection.commit()
+                time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+            connection.commit()
+        try:
+            config.attributes["connection"] = connection
+            command.upgrade(config, "head")
+        finally:
+            if locked:
+                connection.rollback()
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                connection.commit()
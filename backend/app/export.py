@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Iterator, List, Optional
+
+import anyio
+
+from sqlalchemy import Select, select
+
+from . import models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Строк на одну выборку из серверного курсора и на один фрагмент ответа (row group в Parquet)
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+
+COLUMNS = ["id", "check_id", "target", "agent_name", "check_type", "success", "response_time",
+           "error_message", "created_at", "result_data"]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8",
+               "parquet": "application/vnd.apache.parquet"}
+
+
+def results_query(since: datetime, until: datetime, target: Optional[str] = None,
+                  agent_name: Optional[str] = None, check_types: Optional[List[str]] = None) -> Select:
+    """Plain columns of results in [since, until) in time order; no ORM entities are built"""
+    Result = models.CheckResult
+    query = (
+        select(Result.id, Result.check_id, models.Check.target, models.Agent.name, Result.check_type,
+               Result.success, Result.response_time, Result.error_message, Result.created_at, Result.result_data)
+        .join(models.Check, models.Check.id == Result.check_id)
+        .outerjoin(models.Agent, models.Agent.id == Result.agent_id)
+        .where(Result.created_at >= since, Result.created_at < until)
+        .order_by(Result.created_at, Result.id)
+    )
+    if target:
+        query = query.where(models.Check.target == target)
+    if agent_name:
+        query = query.where(models.Agent.name == agent_name)
+    if check_types:
+        query = query.where(Result.check_type.in_(check_types))
+    return query
+
+
+def stream_rows(query: Select, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[list]:
+    """Lists of at most batch_rows rows from a server-side cursor: memory stays flat whatever the row count"""
+    db = SessionLocal()
+    try:
+        result = db.execute(query, execution_options={"stream_results": True, "yield_per": batch_rows})
+        for rows in result.partitions():
+            yield rows
+    finally:
+        db.close()
+
+
+def ndjson_chunks(batches: Iterator[list]) -> Iterator[bytes]:
+    dumps = json.dumps
+    for rows in batches:
+        yield "".join(
+            dumps({"id": id, "check_id": check_id, "target": target, "agent_name": agent_name,
+                   "check_type": check_type, "success": success, "response_time": response_time,
+                   "error_message": error_message, "created_at": created_at.isoformat(),
+                   "result_data": result_data}) + "\n"
+            for id, check_id, target, agent_name, check_type, success, response_time, error_message,
+            created_at, result_data in rows
+        ).encode()
+
+
+def csv_chunks(batches: Iterator[list]) -> Iterator[bytes]:
+    """CSV with a header row; result_data is a JSON string column"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(
+            (*row[:8], row[8].isoformat(), json.dumps(row[9]) if row[9] is not None else "")
+            for row in rows
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes out in pieces; tell() keeps counting for the Parquet footer"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()), ("check_id", pa.string()), ("target", pa.string()), ("agent_name", pa.string()),
+        ("check_type", pa.string()), ("success", pa.bool_()), ("response_time", pa.int32()),
+        ("error_message", pa.string()), ("created_at", pa.timestamp("us")), ("result_data", pa.string()),
+    ])
+
+
+def parquet_chunks(batches: Iterator[list]) -> Iterator[bytes]:
+    """One row group per batch, sent as soon as it is written; result_data is a JSON string column"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd") as writer:
+        for rows in batches:
+            columns = [list(column) for column in zip(*rows)]
+            columns[9] = [json.dumps(value) if value is not None else None for value in columns[9]]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+ENCODERS = {"ndjson": ndjson_chunks, "csv": csv_chunks, "parquet": parquet_chunks}
+
+
+async def export_results(query: Select, format: str) -> AsyncIterator[bytes]:
+    """Encoded chunks produced in a worker thread.
+
+    The encoder and the row stream are closed explicitly when the response
+    ends, also when the client disconnects mid-export: the session and its
+    server-side cursor do not wait for garbage collection.
+    """
+    batches = stream_rows(query)
+    chunks = ENCODERS[format](batches)
+    try:
+        while True:
+            chunk = await anyio.to_thread.run_sync(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Отмена при обрыве соединения не должна прервать закрытие курсора
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(_close, chunks, batches)
+
+
+def _close(*generators):
+    for generator in generators:
+        generator.close()
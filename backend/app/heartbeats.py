@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from . import crud
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FLUSH_SECONDS = float(os.getenv("HEARTBEAT_FLUSH_SECONDS", "5"))
+# Агент считается неактивным, если молчит дольше этого времени (три интервала агента)
+AGENT_TIMEOUT_SECONDS = int(os.getenv("AGENT_TIMEOUT_SECONDS", "90"))
+
+
+class HeartbeatTracker:
+    """Write-behind buffer for agent heartbeats plus the liveness sweep.
+
+    Heartbeats only update an in-memory table; a background thread writes the
+    latest heartbeat of every agent with one batched UPDATE per interval,
+    marks agents silent for AGENT_TIMEOUT_SECONDS inactive and hands their
+    check assignments to other agents. Each backend worker flushes its own
+    buffer, the UPDATEs are idempotent.
+    """
+
+    def __init__(self, interval: float = HEARTBEAT_FLUSH_SECONDS, timeout: int = AGENT_TIMEOUT_SECONDS):
+        self.interval = interval
+        self.timeout = timeout
+        self._pending: Dict[str, datetime] = {}
+        # (capacity, in_flight) из последнего heartbeat, который их сообщил
+        self._loads: Dict[str, Tuple[int, int]] = {}
+        self._known: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_known(self, agent_name: str) -> bool:
+        return agent_name in self._known
+
+    def add_known(self, agent_name: str):
+        self._known.add(agent_name)
+
+    def record(self, agent_name: str, at: Optional[datetime] = None, load: Optional[Tuple[int, int]] = None):
+        with self._lock:
+            self._pending[agent_name] = at or datetime.utcnow()
+            if load is not None:
+                self._loads[agent_name] = load
+
+    def flush(self) -> Dict[str, object]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            loads, self._loads = self._loads, {}
+        db = SessionLocal()
+        try:
+            flushed = crud.flush_heartbeats(db, pending, loads)
+            inactive = crud.deactivate_silent_agents(db, datetime.utcnow() - timedelta(seconds=self.timeout))
+            orphans = crud.reassign_orphaned_assignments(db)
+        except Exception:
+            db.rollback()
+            # Не теряем heartbeat'ы: более свежие из буфера важнее возвращаемых
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+                self._loads = {**loads, **self._loads}
+            raise
+        finally:
+            db.close()
+        for agent_name in inactive:
+            logger.warning(f"💤 Agent {agent_name} missed heartbeats, marked inactive")
+        if orphans["reassigned"] or orphans["failed"]:
+            logger.warning(f"🔀 Assignments of inactive agents: {orphans['reassigned']} reassigned, "
+                           f"{orphans['failed']} failed with no agent left")
+        return {"flushed": flushed, "inactive": inactive, **orphans}
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeats", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._flush_safely()
+        # Последний сброс при остановке воркера
+        self._flush_safely()
+
+    def _flush_safely(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"❌ Heartbeat flush failed: {e}")
+
+
+heartbeats = HeartbeatTracker()
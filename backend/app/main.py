@@ -1,69 +1,332 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, File, Form, HTTPException, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import json
 import logging
-from datetime import datetime
-from .database import engine, get_db, Base
-from . import models, schemas, crud
+import time
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter, ValidationError
+from .database import AsyncSessionLocal, get_async_db, get_db, init_db
+from . import models, schemas, crud, export, metrics
+from .broker import broker, event_hub
+from .compression import GzipRequestMiddleware
+from .cache import AGENTS_NAMESPACE, CHECKS_NAMESPACE, cache, check_namespace
+from .heartbeats import heartbeats
+from .retention import retention_worker
+from .scheduler import scheduler
 
-Base.metadata.create_all(bind=engine)
+init_db()
 
 app = FastAPI(title="Host Checker API", version="1.0.0")
 
+# Первым, то есть самым внутренним: видит эндпоинт, выбранный роутером
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Server-Timing"],
 )
+# Агенты присылают пачки результатов сжатыми (Content-Encoding: gzip)
+app.add_middleware(GzipRequestMiddleware)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CLAIM_RECHECK_SECONDS = 10
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Новые проверки из любого воркера будят агентов, ждущих в этом воркере
+cache.subscribe("check_created", lambda event: broker.publish())
+cache.subscribe("batch_created", lambda event: broker.publish())
+cache.subscribe("checks_scheduled", lambda event: broker.publish())
+# Изменения мониторов из любого воркера попадают в планировщик этого воркера
+cache.subscribe("monitors_updated", scheduler.on_event)
+# События всех воркеров уходят в SSE-потоки этого воркера
+for event_type in ("check_created", "batch_created", "checks_updated", "check_completed",
+                   "checks_scheduled", "agents_updated"):
+    cache.subscribe(event_type, event_hub.publish)
+
+CheckList = TypeAdapter(List[schemas.CheckResponse])
+# Предел размера загружаемого списка целей
+MAX_TARGET_FILE_BYTES = 8 * 1024 * 1024
+
+ResultList = TypeAdapter(List[schemas.CheckResultResponse])
+AgentList = TypeAdapter(List[schemas.AgentResponse])
+MonitorList = TypeAdapter(List[schemas.MonitorResponse])
+
+
+def cached_page(namespace: str, field: str, load: Callable[[], Tuple[bytes, Optional[str]]]) -> Response:
+    """Serve a JSON page from the cache; load() returns (body, next cursor or None)"""
+    started = time.monotonic()
+    cached = cache.get(namespace, field)
+    if cached is None:
+        body, next_cursor = load()
+        cached = f"{next_cursor or ''}\n{body.decode()}"
+        cache.set(namespace, field, cached, ttl=cache.ttl, since=started)
+    next_cursor, body = cached.split("\n", 1)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 @app.post("/checks/", response_model=schemas.CheckResponse)
 def create_check(check: schemas.CheckCreate, db: Session = Depends(get_db)):
-    logger.info(f"Creating check for target: {check.target}")
-    db_check = crud.create_check(db=db, check=check)
+    logger.debug("Creating check for target: %s", check.target)
+    agents = None
+    if check.dispatched():
+        agents = crud.select_agents(db, names=check.agents, locations=check.locations, count=check.agent_count)
+        if not agents:
+            raise HTTPException(status_code=409, detail="No active agent matches the selectors")
+        logger.debug("Dispatching %s to %s", check.target, [agent.name for agent in agents])
+    db_check = crud.create_check(db=db, check=check, agents=agents)
+    metrics.CHECKS_CREATED.inc()
+    if db_check.reused_check_id:
+        metrics.CHECKS_REUSED.inc()
     return db_check
 
 
+async def create_batch(batch: schemas.CheckBatchCreate, db: AsyncSession) -> schemas.CheckBatchCreated:
+    targets, invalid, duplicates = schemas.split_targets(batch.targets)
+    if not targets:
+        raise HTTPException(status_code=400, detail={"message": "No valid targets",
+                                                     "invalid": invalid[:schemas.MAX_REPORTED_INVALID]})
+    db_batch = await db.run_sync(crud.create_check_batch, batch, targets)
+    metrics.CHECKS_CREATED.inc(len(targets))
+    logger.info(f"📦 Batch {db_batch.id}: {len(targets)} checks, {duplicates} duplicates, {len(invalid)} invalid")
+    return schemas.CheckBatchCreated(
+        id=db_batch.id,
+        name=db_batch.name,
+        check_types=db_batch.check_types,
+        params=db_batch.params,
+        created_at=db_batch.created_at,
+        status="pending",
+        total=len(targets),
+        pending=len(targets),
+        running=0,
+        completed=0,
+        duplicates=duplicates,
+        invalid_count=len(invalid),
+        invalid=invalid[:schemas.MAX_REPORTED_INVALID]
+    )
+
+
+@app.post("/checks/batch", response_model=schemas.CheckBatchCreated)
+async def create_check_batch(batch: schemas.CheckBatchCreate, db: AsyncSession = Depends(get_async_db)):
+    """Create one check per target with shared check types, in one INSERT.
+
+    Targets are normalized (host names lowercased) and deduplicated; invalid
+    ones are skipped and reported. Progress: GET /checks/batch/{id}.
+    """
+    return await create_batch(batch, db)
+
+
+@app.post("/checks/batch/upload", response_model=schemas.CheckBatchCreated)
+async def upload_check_batch(file: UploadFile = File(...), check_types: str = Form(...),
+                             ports: Optional[str] = Form(None), name: Optional[str] = Form(None),
+                             db: AsyncSession = Depends(get_async_db)):
+    """Same as POST /checks/batch with targets from an uploaded text file.
+
+    One target per line or comma/space separated, `#` starts a comment;
+    check_types is a comma-separated list.
+    """
+    data = await file.read(MAX_TARGET_FILE_BYTES + 1)
+    if len(data) > MAX_TARGET_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Target file is larger than {MAX_TARGET_FILE_BYTES} bytes")
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Target file must be UTF-8 text")
+    try:
+        batch = schemas.CheckBatchCreate(
+            targets=schemas.parse_target_lines(text),
+            check_types=[ct.strip() for ct in check_types.split(",") if ct.strip()],
+            ports=ports or None,
+            name=name or file.filename
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    return await create_batch(batch, db)
+
+
+@app.get("/checks/batch/{batch_id}", response_model=schemas.CheckBatchResponse)
+async def get_check_batch(batch_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Batch with aggregate progress: check counts by status"""
+    batch = await db.run_sync(crud.get_check_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
 @app.get("/checks/{check_id}", response_model=schemas.CheckWithResults)
-def get_check(check_id: str, db: Session = Depends(get_db)):
-    db_check = crud.get_check(db, check_id=check_id)
-    if not db_check:
+async def get_check(check_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Check with results; served from the cache until the check changes, honours If-None-Match"""
+    snapshot = await check_snapshot(db, check_id)
+    if snapshot is None:
         raise HTTPException(status_code=404, detail="Check not found")
-    results = crud.get_check_results(db, check_id)
-    check_response = schemas.CheckWithResults(
-        id=db_check.id,
-        target=db_check.target,
-        check_types=db_check.check_types,
-        status=db_check.status,
-        created_at=db_check.created_at,
-        completed_at=db_check.completed_at,
-        results=[]
-    )
-    for result in results:
-        agent = db.query(models.Agent).filter(models.Agent.id == result.agent_id).first()
-        check_response.results.append(
-            schemas.CheckResultResponse(
-                id=result.id,
-                check_type=result.check_type,
-                success=result.success,
-                result_data=result.result_data,
-                response_time=result.response_time,
-                error_message=result.error_message,
-                created_at=result.created_at,
-                agent_name=agent.name if agent else "Unknown"
-            )
+    etag, _, body = snapshot
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Поле снимка в кэше; меняется вместе с форматом снимка, чтобы старые снимки из Redis не читались
+SNAPSHOT_FIELD = "snapshot:v2"
+
+
+async def check_snapshot(db: AsyncSession, check_id: str) -> Optional[Tuple[str, str, str]]:
+    """(etag, status, JSON body) of a check with results, through the cache; None if missing"""
+    namespace = check_namespace(check_id)
+    started = time.monotonic()
+    cached = await cache.get_async(namespace, SNAPSHOT_FIELD)
+    if cached is None:
+        db_check = await db.run_sync(crud.get_check_with_results, check_id)
+        if not db_check:
+            return None
+        results = db_check.results
+        etag = crud.check_etag(
+            db_check.id, db_check.status, db_check.claimed_by,
+            len(results), results[-1].id if results else None
         )
-    return check_response
+        # Поля проверки берутся из CheckResponse целиком: новое поле не потеряется в снимке
+        body = schemas.CheckWithResults(
+            **schemas.CheckResponse.model_validate(db_check).model_dump(),
+            results=[result_response(result) for result in results]
+        ).model_dump_json()
+        cached = f"{etag}\n{db_check.status}\n{body}"
+        # Завершённая проверка кэшируется без TTL: любая запись в неё всё равно инвалидирует кэш
+        ttl = None if db_check.status == "completed" else cache.ttl
+        cache.set(namespace, SNAPSHOT_FIELD, cached, ttl=ttl, since=started)
+    etag, status, body = cached.split("\n", 2)
+    return etag, status, body
+
+
+def sse(event: str, data: str, event_id: Optional[str] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+async def load_check_snapshot(check_id: str) -> Optional[Tuple[str, str, str]]:
+    # Короткая сессия на каждую загрузку: поток SSE не держит соединение с БД
+    async with AsyncSessionLocal() as db:
+        return await check_snapshot(db, check_id)
+
+
+async def wait_for_check_event(queue: asyncio.Queue, check_id: str, timeout: float = SSE_KEEPALIVE_SECONDS) -> bool:
+    """Wait for an event about check_id; False on timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            message = await asyncio.wait_for(queue.get(), max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            return False
+        if message.get("check_id") == check_id or check_id in message.get("check_ids", ()):
+            return True
+
+
+@app.get("/checks/{check_id}/events")
+async def check_events(check_id: str):
+    """Server-Sent Events for one check.
+
+    Sends a `check` event with the full check (same body as GET /checks/{id})
+    now and after every change, and ends the stream once the check completes.
+    """
+    if await load_check_snapshot(check_id) is None:
+        raise HTTPException(status_code=404, detail="Check not found")
+
+    async def stream():
+        with event_hub.subscribe() as queue:
+            etag = None
+            while True:
+                snapshot = await load_check_snapshot(check_id)
+                if snapshot is None:
+                    return
+                if snapshot[0] != etag:
+                    etag, status, body = snapshot
+                    yield sse("check", body, etag)
+                    if status == "completed":
+                        return
+                # По таймауту шлём keepalive и всё равно перечитываем проверку: событие могло потеряться
+                if not await wait_for_check_event(queue, check_id):
+                    yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def result_response(result: models.CheckResult) -> schemas.CheckResultResponse:
+    return schemas.CheckResultResponse(
+        id=result.id,
+        check_type=result.check_type,
+        success=result.success,
+        result_data=result.result_data,
+        response_time=result.response_time,
+        error_message=result.error_message,
+        created_at=result.created_at,
+        agent_name=result.agent.name if result.agent else "Unknown"
+    )
+
+
+@app.get("/checks/{check_id}/results", response_model=List[schemas.CheckResultResponse])
+def list_check_results(check_id: str, limit: int = Query(100, ge=1, le=1000),
+                       cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Results of a check, paged by id; X-Next-Cursor holds the cursor of the next page"""
+    try:
+        after_id = int(crud.decode_cursor(cursor)[0]) if cursor else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    def load():
+        results = crud.get_check_results(db, check_id, after_id=after_id, limit=limit)
+        next_cursor = crud.encode_cursor(results[-1].id) if len(results) == limit else None
+        return ResultList.dump_json([result_response(result) for result in results]), next_cursor
+
+    return cached_page(check_namespace(check_id), f"results:{after_id}:{limit}", load)
 
 
 @app.get("/checks/", response_model=List[schemas.CheckResponse])
-def list_checks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_checks(db, skip=skip, limit=limit)
+def list_checks(skip: int = 0, limit: int = Query(100, ge=1, le=1000),
+                cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Checks newest first; X-Next-Cursor holds the cursor of the next page"""
+    def load():
+        try:
+            checks = crud.get_checks(db, skip=skip, limit=limit, cursor=cursor)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        next_cursor = crud.check_cursor(checks[-1]) if len(checks) == limit else None
+        return CheckList.dump_json(CheckList.validate_python(checks, from_attributes=True)), next_cursor
+
+    return cached_page(CHECKS_NAMESPACE, f"{skip}:{limit}:{cursor}", load)
+
+
+@app.get("/events")
+async def events_feed():
+    """Server-Sent Events for every change: check_created, checks_updated, check_completed,
+    checks_scheduled, agents_updated.
+
+    Payloads carry ids only; clients fetch what they display (from the cache).
+    """
+    async def stream():
+        with event_hub.subscribe() as queue:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse(message["type"], json.dumps(message))
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.post("/agents/register", response_model=schemas.AgentResponse)
@@ -75,63 +338,276 @@ def register_agent(agent: schemas.AgentCreate, db: Session = Depends(get_db)):
 
 
 @app.post("/agents/{agent_name}/heartbeat")
-def agent_heartbeat(agent_name: str, db: Session = Depends(get_db)):
-    agent = db.query(models.Agent).filter(models.Agent.name == agent_name).first()
+async def agent_heartbeat(agent_name: str, load: Optional[schemas.AgentHeartbeat] = None,
+                          db: AsyncSession = Depends(get_async_db)):
+    """Buffer the heartbeat in memory; the tracker writes all of them in one batched UPDATE.
+
+    The optional body reports the agent's capacity and probes in flight for the dispatcher.
+    """
+    if not heartbeats.is_known(agent_name):
+        if not await db.run_sync(crud.get_agent_by_name, agent_name):
+            raise HTTPException(status_code=404, detail="Agent not found")
+        heartbeats.add_known(agent_name)
+    heartbeats.record(agent_name, load=(load.capacity, load.in_flight or 0) if load and load.capacity else None)
+    return {"status": "ok"}
+
+
+@app.post("/agents/{agent_name}/claim", response_model=List[schemas.CheckResponse])
+async def claim_checks(agent_name: str, max: int = Query(10, ge=1, le=100),
+                       wait: float = Query(0, ge=0, le=60), batch_id: Optional[str] = None,
+                       db: AsyncSession = Depends(get_async_db)):
+    """Lease pending checks to an agent, long-polling up to `wait` seconds if the queue is empty.
+
+    With batch_id only checks of that batch are leased, in chunks of `max`.
+    Waiting is a coroutine, so parked agents hold neither a worker thread nor
+    a database connection.
+    """
+    agent = await db.run_sync(crud.get_agent_by_name, agent_name)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
-    crud.update_agent_heartbeat(db, agent.id)
-    return {"status": "ok"}
+    # Опрос очереди тоже доказывает, что агент жив
+    heartbeats.record(agent_name)
+    deadline = time.monotonic() + wait
+    while True:
+        version = broker.version
+        claimed = await db.run_sync(crud.claim_checks, agent=agent, max_checks=max, batch_id=batch_id)
+        remaining = deadline - time.monotonic()
+        if claimed or remaining <= 0:
+            return claimed
+        # Периодически просыпаемся, чтобы подхватить проверки с истёкшей арендой
+        await broker.wait_async(version, min(remaining, CLAIM_RECHECK_SECONDS))
 
 
 @app.get("/agents/", response_model=List[schemas.AgentResponse])
-def list_agents(db: Session = Depends(get_db)):
-    return db.query(models.Agent).all()
+def list_agents(active_only: bool = False, db: Session = Depends(get_db)):
+    """All agents, or with active_only only those whose heartbeats are current"""
+    def load():
+        agents = crud.get_active_agents(db) if active_only else db.query(models.Agent).all()
+        return AgentList.dump_json(AgentList.validate_python(agents, from_attributes=True)), None
+
+    return cached_page(AGENTS_NAMESPACE, "active" if active_only else "all", load)
 
 
-# ЕДИНСТВЕННЫЙ эндпоинт /results/
 @app.post("/results/")
-def submit_results(results_data: dict, db: Session = Depends(get_db)):
+async def submit_results(results_data: dict, db: AsyncSession = Depends(get_async_db)):
     """Submit check results from agent"""
-    logger.info(f"📥 Received results for check: {results_data.get('check_id')}")
     check_id = results_data.get('check_id')
     agent_name = results_data.get('agent_name')
     results = results_data.get('results', [])
     if not check_id:
         raise HTTPException(status_code=400, detail="Missing check_id")
 
-    db_check = crud.get_check(db, check_id=check_id)
-    if not db_check:
+    outcome = await db.run_sync(crud.submit_check_results, check_id, agent_name, results)
+    if outcome is None:
         raise HTTPException(status_code=404, detail="Check not found")
+    metrics.RESULTS_INGESTED.labels("single").inc(outcome["results_saved"])
+    metrics.RESULTS_DUPLICATE.inc(outcome.get("duplicates", 0))
+    logger.debug("✅ Results saved for check %s: %d results from %s", check_id, len(results), agent_name)
+    return {"status": "success", "results_saved": outcome["results_saved"],
+            "invalid_results": outcome.get("invalid_results", [])}
 
-    agent = db.query(models.Agent).filter(models.Agent.name == agent_name).first()
-    if not agent:
-        logger.warning(f"Agent {agent_name} not found, creating temporary agent")
-        agent = models.Agent(
-            name=agent_name,
-            location="unknown",
-            token="auto-generated"
-        )
-        db.add(agent)
-        db.commit()
-        db.refresh(agent)
-
-    for result in results:
-        db_result = models.CheckResult(
-            check_id=check_id,
-            agent_id=agent.id,
-            check_type=result.get('check_type'),
-            success=result.get('success', False),
-            result_data=result.get('result_data', {}),
-            response_time=result.get('response_time'),
-            error_message=result.get('error_message')
+
+@app.post("/results/bulk")
+async def submit_results_bulk(payload: dict, db: AsyncSession = Depends(get_async_db)):
+    """Submit results for many checks in one request.
+
+    Body: {"agent_name": ..., "results": [{"check_id": ..., "check_type": ..., ...}]};
+    an item may override agent_name. Items that do not validate are reported
+    in invalid_results, the rest of the batch is stored.
+    """
+    agent_name = payload.get('agent_name')
+    items = [
+        {"agent_name": agent_name, **result} if isinstance(result, dict) else result
+        for result in payload.get('results', [])
+    ]
+    outcome = await db.run_sync(crud.ingest_results, items)
+    metrics.RESULTS_INGESTED.labels("bulk").inc(outcome["results_saved"])
+    metrics.RESULTS_DUPLICATE.inc(outcome["duplicates"])
+    logger.debug("✅ Bulk saved %d results, completed checks: %d", outcome["results_saved"], len(outcome["completed_checks"]))
+    return {"status": "success", **outcome}
+
+
+@app.post("/results/stream")
+async def stream_results(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Ingest NDJSON results incrementally as the agent produces them.
+
+    Every line is one result with check_id and agent_name. Lines are stored as
+    soon as their chunk arrives, so a check's fast probes are visible while its
+    slow probes are still running on the agent.
+    """
+    saved = 0
+    unexpected = 0
+    completed: List[str] = []
+    missing = set()
+    invalid_count = 0
+    invalid: List[dict] = []
+    buffer = b""
+    line_no = 0
+
+    async def flush(lines: List[bytes]):
+        nonlocal saved, unexpected, invalid_count, line_no
+        items = []
+        for line in lines:
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON on line {line_no}")
+        if not items:
+            return
+        outcome = await db.run_sync(crud.ingest_results, items)
+        saved += outcome["results_saved"]
+        unexpected += outcome["unexpected_results"]
+        metrics.RESULTS_INGESTED.labels("stream").inc(outcome["results_saved"])
+        metrics.RESULTS_DUPLICATE.inc(outcome["duplicates"])
+        completed.extend(outcome["completed_checks"])
+        missing.update(outcome["missing_checks"])
+        invalid_count += outcome["invalid_count"]
+        invalid.extend(outcome["invalid_results"][:schemas.MAX_REPORTED_INVALID - len(invalid)])
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        await flush(lines)
+    await flush([buffer])
+    logger.debug("✅ Streamed %d results, completed checks: %d", saved, len(completed))
+    return {
+        "status": "success",
+        "results_saved": saved,
+        "unexpected_results": unexpected,
+        "completed_checks": completed,
+        "missing_checks": sorted(missing, key=str),
+        "invalid_count": invalid_count,
+        "invalid_results": invalid
+    }
+
+
+@app.post("/monitors/", response_model=schemas.MonitorResponse)
+def create_monitor(monitor: schemas.MonitorCreate, db: Session = Depends(get_db)):
+    """Recurring check of a target every interval_seconds; agent_names/locations/agent_count choose agents per run"""
+    return crud.create_monitor(db, monitor)
+
+
+@app.get("/monitors/", response_model=List[schemas.MonitorResponse])
+def list_monitors(limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                  db: Session = Depends(get_db)):
+    """Monitors by id; X-Next-Cursor holds the cursor of the next page"""
+    monitors = crud.get_monitors(db, limit=limit, cursor=cursor)
+    body = MonitorList.dump_json(MonitorList.validate_python(monitors, from_attributes=True))
+    headers = {"X-Next-Cursor": monitors[-1].id} if len(monitors) == limit else {}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/monitors/{monitor_id}", response_model=schemas.MonitorResponse)
+def get_monitor(monitor_id: str, db: Session = Depends(get_db)):
+    monitor = crud.get_monitor(db, monitor_id)
+    if not monitor:
+        raise HTTPException(status_code=404, detail="Monitor not found")
+    return monitor
+
+
+@app.patch("/monitors/{monitor_id}", response_model=schemas.MonitorResponse)
+def update_monitor(monitor_id: str, changes: schemas.MonitorUpdate, db: Session = Depends(get_db)):
+    monitor = crud.update_monitor(db, monitor_id, changes)
+    if not monitor:
+        raise HTTPException(status_code=404, detail="Monitor not found")
+    return monitor
+
+
+@app.delete("/monitors/{monitor_id}")
+def delete_monitor(monitor_id: str, db: Session = Depends(get_db)):
+    if not crud.delete_monitor(db, monitor_id):
+        raise HTTPException(status_code=404, detail="Monitor not found")
+    return {"status": "deleted"}
+
+
+@app.get("/stats/rollups", response_model=List[schemas.RollupResponse])
+def get_rollups(granularity: schemas.RollupGranularity = schemas.RollupGranularity.HOUR,
+                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                target: Optional[str] = None, agent_name: Optional[str] = None,
+                check_type: Optional[str] = None, limit: int = Query(1000, ge=1, le=10000),
+                db: Session = Depends(get_db)):
+    """Hourly/daily success rate and response-time percentiles; never touches raw results"""
+    until = crud.naive_utc(until) or datetime.utcnow()
+    since = crud.naive_utc(since) or until - (timedelta(days=1) if granularity == schemas.RollupGranularity.HOUR else timedelta(days=30))
+    rollups = crud.get_rollups(db, granularity.value, since, until, target=target,
+                               agent_name=agent_name, check_type=check_type, limit=limit)
+    return [
+        schemas.RollupResponse(
+            granularity=r.granularity,
+            bucket_start=r.bucket_start,
+            target=r.target,
+            agent_name=r.agent.name if r.agent else None,
+            check_type=r.check_type,
+            total=r.total,
+            successes=r.successes,
+            success_rate=round(r.successes / r.total, 4) if r.total else 0.0,
+            avg_response_time=r.avg_response_time,
+            p50_response_time=r.p50_response_time,
+            p95_response_time=r.p95_response_time
         )
-        db.add(db_result)
+        for r in rollups
+    ]
+
+
+@app.get("/export/results")
+def export_results(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   target: Optional[str] = None, agent_name: Optional[str] = None,
+                   check_type: Optional[List[str]] = Query(None),
+                   format: schemas.ExportFormat = schemas.ExportFormat.NDJSON):
+    """Raw results in [since, until) oldest first, streamed as NDJSON, CSV or Parquet.
+
+    Rows come from a server-side cursor in batches of EXPORT_BATCH_ROWS and
+    are encoded straight from the row tuples, so memory use does not grow
+    with the size of the export. check_type may be repeated. Times with an
+    offset are converted to UTC; naive ones are taken as UTC.
+    """
+    until = crud.naive_utc(until) or datetime.utcnow()
+    since = crud.naive_utc(since) or until - timedelta(days=1)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if format == schemas.ExportFormat.PARQUET and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the backend")
+    query = export.results_query(since, until, target=target, agent_name=agent_name, check_types=check_type)
+    filename = f"results-{since:%Y%m%dT%H%M%S}-{until:%Y%m%dT%H%M%S}.{format.value}"
+    logger.info(f"📤 Exporting results {since} .. {until} as {format.value}")
+    return StreamingResponse(export.export_results(query, format.value), media_type=export.MEDIA_TYPES[format.value],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.on_event("startup")
+def start_background_workers():
+    cache.start()
+    heartbeats.start()
+    retention_worker.start()
+    scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    cache.stop()
+    heartbeats.stop()
+    retention_worker.stop()
+    scheduler.stop()
+
+
+@app.get("/stats/cache")
+def get_cache_stats():
+    return cache.stats()
+
+
+@app.get("/stats/scheduler")
+def get_scheduler_stats():
+    return scheduler.stats()
+
 
-    db_check.status = "completed"
-    db_check.completed_at = datetime.utcnow()
-    db.commit()
-    logger.info(f"✅ Results saved for check {check_id}: {len(results)} results from {agent_name}")
-    return {"status": "success", "results_saved": len(results)}
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus exposition of the backend metrics"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 
 @app.get("/health")
@@ -0,0 +1,204 @@
+import contextvars
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event, func, select
+
+from . import models
+from .cache import cache
+from .database import SessionLocal, async_engine, engine
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Разбивка времени запроса (Server-Timing + лог SQL): off, header (по заголовку X-Profile) или all
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "header")
+# С несколькими воркерами uvicorn prometheus_client собирает метрики через файлы в этом каталоге
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REQUEST_SECONDS = Histogram(
+    "hostchecker_http_request_duration_seconds",
+    "Time to response headers by route; long-polls include the wait",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUEST_DB_QUERIES = Histogram(
+    "hostchecker_http_request_db_queries", "SQL statements issued per request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+REQUEST_DB_SECONDS = Histogram(
+    "hostchecker_http_request_db_seconds", "Time spent in SQL per request",
+    ["route"], buckets=DB_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram("hostchecker_db_query_duration_seconds", "Duration of single SQL statements",
+                             buckets=DB_BUCKETS)
+CHECKS_CREATED = Counter("hostchecker_checks_created", "Checks created")
+CHECKS_REUSED = Counter("hostchecker_checks_reused", "Checks answered with the results of a recent identical check")
+RESULTS_INGESTED = Counter("hostchecker_results_ingested", "Results stored, by ingest endpoint", ["endpoint"])
+RESULTS_DUPLICATE = Counter("hostchecker_results_duplicate", "Re-sent results skipped by result_uid")
+
+PENDING_STATUSES = ("pending", "running")
+
+
+class RequestStats:
+    """SQL time and count of one request; shared by the request's threads and greenlets through a contextvar"""
+
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, profile: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Тексты запросов собираются только при профилировании
+        self.statements: Optional[List[Tuple[float, str]]] = [] if profile else None
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.statements is not None:
+            stats.statements.append((elapsed, statement))
+
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """Records latency and SQL time/count of every request by route template.
+
+    Register it innermost (before the other middlewares): the router stores
+    the matched endpoint in the scope, and only the innermost middleware sees
+    that same scope dict. With profiling requested the response carries a
+    Server-Timing header and the request's SQL statements are logged.
+    """
+
+    def __init__(self, app, profiling: str = REQUEST_PROFILING):
+        self.app = app
+        self.profiling = profiling
+        self._routes = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        profile = self.profiling == "all" or (
+            self.profiling == "header" and any(name == b"x-profile" for name, _ in scope["headers"])
+        )
+        stats = RequestStats(profile)
+        token = _current.set(stats)
+        responded = False
+
+        async def send_wrapper(message):
+            nonlocal responded
+            if message["type"] == "http.response.start" and not responded:
+                responded = True
+                elapsed = time.perf_counter() - started
+                route = self._observe(scope, message["status"], elapsed, stats)
+                if profile:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", server_timing(elapsed, stats))]
+                    log_profile(scope, route, elapsed, stats)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not responded:
+                self._observe(scope, 500, time.perf_counter() - started, stats)
+            raise
+        finally:
+            _current.reset(token)
+
+    def _observe(self, scope, status: int, elapsed: float, stats: RequestStats) -> str:
+        route = self._route(scope)
+        REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+        REQUEST_DB_QUERIES.labels(route).observe(stats.queries)
+        REQUEST_DB_SECONDS.labels(route).observe(stats.db_seconds)
+        return route
+
+    def _route(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        # Путь без совпавшего маршрута в метку не попадает: иначе каждый 404 плодил бы серии
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+
+def server_timing(elapsed: float, stats: RequestStats) -> bytes:
+    return (f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f'total;dur={elapsed * 1000:.1f}').encode()
+
+
+def log_profile(scope, route: str, elapsed: float, stats: RequestStats):
+    lines = [f"  {seconds * 1000:8.2f} ms  {' '.join(statement.split())[:200]}" for seconds, statement in stats.statements]
+    logger.info("🔬 %s %s: %.1f ms, %d queries in %.1f ms\n%s", scope["method"], route, elapsed * 1000,
+                stats.queries, stats.db_seconds * 1000, "\n".join(lines))
+
+
+class StateCollector:
+    """Gauges read at scrape time: check queue depth, cache and scheduler counters"""
+
+    def describe(self):
+        # Без describe() регистрация вызвала бы collect() с запросом к БД ещё до миграций
+        return []
+
+    def collect(self):
+        queue = GaugeMetricFamily("hostchecker_checks_queued", "Checks waiting for or leased to an agent",
+                                  labels=["status"])
+        db = SessionLocal()
+        try:
+            for status in PENDING_STATUSES:
+                # Частичные индексы по pending/running: подсчёт не читает всю таблицу
+                count = db.scalar(select(func.count()).select_from(models.Check).where(models.Check.status == status))
+                queue.add_metric([status], count)
+            yield queue
+        except Exception as e:
+            logger.warning(f"⚠️ Queue depth unavailable: {e}")
+        finally:
+            db.close()
+        yield CounterMetricFamily("hostchecker_cache_hits", "Cache reads served from a cache level", value=cache.hits)
+        yield CounterMetricFamily("hostchecker_cache_misses", "Cache reads that went to the database", value=cache.misses)
+        yield GaugeMetricFamily("hostchecker_cache_local_entries", "Entries in the in-process cache level",
+                                value=len(cache.local))
+        yield GaugeMetricFamily("hostchecker_scheduler_monitors", "Enabled monitors on the timing wheel",
+                                value=len(scheduler.monitors))
+        yield CounterMetricFamily("hostchecker_scheduler_runs", "Monitor runs started by this worker",
+                                  value=scheduler.runs)
+        yield CounterMetricFamily("hostchecker_scheduler_lost_runs", "Due runs already taken by another worker",
+                                  value=scheduler.lost_runs)
+        yield GaugeMetricFamily("hostchecker_scheduler_tick_seconds", "Duration of the last scheduler tick",
+                                value=scheduler.last_tick_seconds)
+
+
+_state = StateCollector()
+if not MULTIPROC_DIR:
+    REGISTRY.register(_state)
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition of all metrics: (body, content type)"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_state)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
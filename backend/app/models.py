@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, JSON, Integer, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, Boolean, JSON, Integer, Float, ForeignKey, Text, UniqueConstraint, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -19,25 +19,121 @@ class Agent(Base):
     is_active = Column(Boolean, default=True)
     last_heartbeat = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Из последнего heartbeat: сколько проб агент выполняет одновременно и сколько сейчас в работе
+    capacity = Column(Integer)
+    in_flight = Column(Integer)
     
     # Связь с проверками
     results = relationship("CheckResult", back_populates="agent")
 
 class Check(Base):
     __tablename__ = "checks"
+    __table_args__ = (
+        # Keyset-пагинация истории: ORDER BY created_at DESC, id DESC
+        Index("ix_checks_created_at_id", "created_at", "id"),
+        # Очередь: частичные индексы только по активным строкам
+        # Одиночные проверки идут из своей очереди: пачка на 20 тысяч целей их не задерживает
+        # Проверки с выбранными агентами идут через check_assignments
+        Index("ix_checks_pending", "created_at",
+              postgresql_where=text("status = 'pending' AND batch_id IS NULL AND fanout IS NULL"),
+              sqlite_where=text("status = 'pending' AND batch_id IS NULL AND fanout IS NULL")),
+        Index("ix_checks_batch_pending", "created_at",
+              postgresql_where=text("status = 'pending' AND batch_id IS NOT NULL"),
+              sqlite_where=text("status = 'pending' AND batch_id IS NOT NULL")),
+        Index("ix_checks_running_lease", "lease_expires_at",
+              postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'")),
+        # Прогресс пачки и выдача проверок одной пачки
+        Index("ix_checks_batch_id_status", "batch_id", "status", "created_at"),
+        Index("ix_checks_monitor_id_status", "monitor_id", "status"),
+        # Поиск недавно завершённой такой же проверки для повторного использования
+        Index("ix_checks_target_completed_at", "target", "completed_at",
+              postgresql_where=text("status = 'completed' AND reused_check_id IS NULL"),
+              sqlite_where=text("status = 'completed' AND reused_check_id IS NULL")),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     target = Column(String, nullable=False)
     check_types = Column(JSON)  # Список типов проверок
+    # Параметры проверок (например, порты для tcp)
+    params = Column(JSON)
     status = Column(String, default="pending")  # pending, running, completed, failed
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
+    # Аренда (lease) проверки агентом
+    claimed_by = Column(String)  # имя агента, взявшего проверку
+    lease_expires_at = Column(DateTime)
+    batch_id = Column(String, ForeignKey("check_batches.id"))
+    monitor_id = Column(String, ForeignKey("monitors.id"))
+    # Проверка, результаты которой скопированы вместо новых проб
+    reused_check_id = Column(String, ForeignKey("checks.id"))
+    # Число агентов, выбранных диспетчером (check_assignments); NULL — проверку берёт любой свободный агент
+    fanout = Column(Integer)
+    # Селекторы {"agents": [...], "locations": [...]}, по которым ищется замена выбывшему агенту
+    agent_selectors = Column(JSON)
     
     # Связь с результатами
-    results = relationship("CheckResult", back_populates="check")
+    results = relationship("CheckResult", back_populates="check", order_by="CheckResult.id")
+    tasks = relationship("CheckTask", back_populates="check")
+
+class CheckAssignment(Base):
+    """One agent's share of a check dispatched to chosen agents; leased like a check"""
+    __tablename__ = "check_assignments"
+    __table_args__ = (
+        UniqueConstraint("check_id", "agent_id", name="uq_check_assignments_check_agent"),
+        # Очередь агента (с истёкшими арендами) и его нагрузка для диспетчера: только незавершённые назначения
+        Index("ix_check_assignments_agent_open", "agent_id", "created_at",
+              postgresql_where=text("status IN ('pending', 'running')"),
+              sqlite_where=text("status IN ('pending', 'running')")),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    check_id = Column(String, ForeignKey("checks.id"), nullable=False)
+    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    status = Column(String, default="pending")  # pending, running, completed, failed
+    lease_expires_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class CheckBatch(Base):
+    """Checks created together from one target list, with shared check types and parameters"""
+    __tablename__ = "check_batches"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    name = Column(String)
+    check_types = Column(JSON)
+    params = Column(JSON)
+    total = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Monitor(Base):
+    """Recurring check of a target every interval_seconds, on any agent or on agents chosen by the dispatcher"""
+    __tablename__ = "monitors"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    name = Column(String)
+    target = Column(String, nullable=False)
+    check_types = Column(JSON)
+    params = Column(JSON)
+    interval_seconds = Column(Integer, nullable=False)
+    # Селекторы агентов, как у POST /checks/: каждый запуск выбирает агентов заново
+    agent_names = Column(JSON)
+    locations = Column(JSON)
+    agent_count = Column(Integer)
+    enabled = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    last_run_at = Column(DateTime)
+    # Ближайший запуск; планировщик сдвигает его атомарно, поэтому запуск не дублируется воркерами
+    next_run_at = Column(DateTime)
 
 class CheckResult(Base):
     __tablename__ = "check_results"
+    __table_args__ = (
+        Index("ix_check_results_check_id_id", "check_id", "id"),
+        Index("ix_check_results_agent_id_created_at", "agent_id", "created_at"),
+        # Выгрузка и агрегаты по интервалу времени
+        Index("ix_check_results_created_at_id", "created_at", "id"),
+        Index("uq_check_results_result_uid", "result_uid", "created_at", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     check_id = Column(String, ForeignKey("checks.id"))
@@ -48,7 +144,55 @@ class CheckResult(Base):
     response_time = Column(Integer)  # Время ответа в ms
     error_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    result_uid = Column(String)  # Идентификатор результата от агента: повторная отправка не дублирует строку
     
     # Связи
     check = relationship("Check", back_populates="results")
-    agent = relationship("Agent", back_populates="results")
\ No newline at end of file
+    agent = relationship("Agent", back_populates="results")
+
+class CheckTask(Base):
+    """Progress of one check type of a check on one agent"""
+    __tablename__ = "check_tasks"
+    __table_args__ = (UniqueConstraint("check_id", "agent_id", "check_type", name="uq_check_tasks_check_agent_type"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    check_id = Column(String, ForeignKey("checks.id"), nullable=False)
+    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    check_type = Column(String, nullable=False)
+    status = Column(String, default="running")  # running, completed, expired
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    check = relationship("Check", back_populates="tasks")
+
+
+class RollupDirtyHour(Base):
+    """Hour that received results after its rollup was computed; the next retention pass recomputes it"""
+    __tablename__ = "check_result_rollup_dirty"
+
+    bucket_start = Column(DateTime, primary_key=True)
+    marked_at = Column(DateTime)
+
+
+class CheckResultRollup(Base):
+    """Pre-aggregated results per target/agent/check type and hour or day"""
+    __tablename__ = "check_result_rollups"
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "target", "agent_id", "check_type",
+                         name="uq_check_result_rollups_bucket"),
+        Index("ix_check_result_rollups_granularity_bucket", "granularity", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    granularity = Column(String, nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)
+    target = Column(String, nullable=False)
+    agent_id = Column(String, ForeignKey("agents.id"), nullable=False)
+    check_type = Column(String, nullable=False)
+    total = Column(Integer, nullable=False)
+    successes = Column(Integer, nullable=False)
+    avg_response_time = Column(Float)
+    p50_response_time = Column(Float)
+    p95_response_time = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    agent = relationship("Agent")
@@ -0,0 +1,337 @@
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal_column, select, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+RESULTS_RETENTION_DAYS = int(os.getenv("RESULTS_RETENTION_DAYS", "30"))
+ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "400"))
+PARTITION_PREMAKE_DAYS = int(os.getenv("PARTITION_PREMAKE_DAYS", "7"))
+# true: старые партиции отсоединяются и переименовываются (для pg_dump), а не удаляются
+ARCHIVE_PARTITIONS = os.getenv("ARCHIVE_PARTITIONS", "false").lower() == "true"
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "300"))
+RETENTION_LOCK_ID = 7812009
+# Суточный агрегат текущего дня пересчитывается не чаще, чем раз в столько секунд
+ROLLUP_DAY_REFRESH_SECONDS = int(os.getenv("ROLLUP_DAY_REFRESH_SECONDS", "3600"))
+
+GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+PARTITION_PREFIX = "check_results_p"
+_BOUND_RE = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \('([^']+)'\)")
+
+
+def truncate(ts: datetime, granularity: str) -> datetime:
+    if granularity == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+# Партиции check_results (только PostgreSQL)
+def list_partitions(db: Session) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(name, lower, upper) of every check_results partition; bounds are None for open ends"""
+    rows = db.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'check_results'::regclass
+    """)).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or "")
+        if match:
+            lower = datetime.fromisoformat(match.group(1)) if match.group(1) else None
+            partitions.append((name, lower, datetime.fromisoformat(match.group(2))))
+        else:
+            partitions.append((name, None, None))  # DEFAULT
+    return partitions
+
+
+def ensure_partitions(db: Session, now: datetime) -> List[str]:
+    """Create daily partitions from the last existing one up to PARTITION_PREMAKE_DAYS ahead"""
+    uppers = [upper for _, _, upper in list_partitions(db) if upper]
+    day = max(uppers) if uppers else truncate(now, "day")
+    end = truncate(now, "day") + timedelta(days=PARTITION_PREMAKE_DAYS + 1)
+    created = []
+    while day < end:
+        name = f"{PARTITION_PREFIX}{day:%Y%m%d}"
+        bounds = {"start": day, "end": day + timedelta(days=1)}
+        # Строки, успевшие попасть в DEFAULT, переносим в новую партицию
+        db.execute(text("CREATE TEMP TABLE moved_results (LIKE check_results)"))
+        db.execute(text("""
+            WITH moved AS (
+                DELETE FROM check_results_default WHERE created_at >= :start AND created_at < :end RETURNING *
+            ) INSERT INTO moved_results SELECT * FROM moved
+        """), bounds)
+        db.execute(text(
+            f"CREATE TABLE {name} PARTITION OF check_results "
+            f"FOR VALUES FROM ('{bounds['start']:%Y-%m-%d %H:%M:%S}') TO ('{bounds['end']:%Y-%m-%d %H:%M:%S}')"
+        ))
+        db.execute(text("INSERT INTO check_results SELECT * FROM moved_results"))
+        db.execute(text("DROP TABLE moved_results"))
+        created.append(name)
+        day += timedelta(days=1)
+    return created
+
+
+def drop_expired_partitions(db: Session, now: datetime) -> List[str]:
+    """Drop (or detach and archive) partitions entirely older than the retention window"""
+    cutoff = truncate(now, "day") - timedelta(days=RESULTS_RETENTION_DAYS)
+    removed = []
+    for name, _, upper in list_partitions(db):
+        if upper is None or upper > cutoff:
+            continue
+        if ARCHIVE_PARTITIONS:
+            db.execute(text(f"ALTER TABLE check_results DETACH PARTITION {name}"))
+            db.execute(text(f"ALTER TABLE {name} RENAME TO check_results_archive_{name.rsplit('_', 1)[-1]}"))
+        else:
+            db.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+    return removed
+
+
+def purge_default_partition(db: Session, now: datetime) -> int:
+    """Delete expired rows from the DEFAULT partition, which is never dropped.
+
+    Rows land there when no daily partition covers their created_at: late
+    results of a day whose partition is already gone, or timestamps from
+    agents with a skewed clock. Future rows move out when their day's
+    partition is created.
+    """
+    cutoff = truncate(now, "day") - timedelta(days=RESULTS_RETENTION_DAYS)
+    return db.execute(text("DELETE FROM check_results_default WHERE created_at < :cutoff"), {"cutoff": cutoff}).rowcount
+
+
+def purge_expired_results(db: Session, now: datetime, batch_size: int = 10000) -> int:
+    """Row-by-row retention for databases without partitioning"""
+    cutoff = truncate(now, "day") - timedelta(days=RESULTS_RETENTION_DAYS)
+    purged = 0
+    while True:
+        ids = select(models.CheckResult.id).where(models.CheckResult.created_at < cutoff).limit(batch_size)
+        deleted = db.execute(
+            delete(models.CheckResult).where(models.CheckResult.id.in_(ids.scalar_subquery()))
+        ).rowcount
+        purged += deleted
+        if deleted < batch_size:
+            return purged
+
+
+# Агрегаты (rollups)
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile, same definition as percentile_cont"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def aggregate_results(db: Session, granularity: str, start: datetime, end: datetime) -> List[dict]:
+    R = models.CheckResult
+    # Копии из кэша агента или повторно использованной проверки — то же измерение, их не считаем
+    window = (R.created_at >= start, R.created_at < end, R.agent_id.isnot(None),
+              R.result_data["cached"].as_boolean().isnot(True))
+    if is_postgres(db):
+        bucket = func.date_trunc(literal_column(f"'{granularity}'"), R.created_at)
+        rows = db.execute(
+            select(
+                bucket, models.Check.target, R.agent_id, R.check_type,
+                func.count(),
+                func.count().filter(R.success.is_(True)),
+                func.avg(R.response_time),
+                func.percentile_cont(0.5).within_group(R.response_time),
+                func.percentile_cont(0.95).within_group(R.response_time),
+            )
+            .join(models.Check, models.Check.id == R.check_id)
+            .where(*window)
+            .group_by(bucket, models.Check.target, R.agent_id, R.check_type)
+        ).all()
+        return [
+            {"bucket_start": b, "target": t, "agent_id": a, "check_type": ct, "total": n, "successes": ok,
+             "avg_response_time": float(avg) if avg is not None else None,
+             "p50_response_time": p50, "p95_response_time": p95}
+            for b, t, a, ct, n, ok, avg, p50, p95 in rows
+        ]
+
+    groups: Dict[tuple, list] = defaultdict(lambda: [0, 0, []])
+    rows = db.execute(
+        select(R.created_at, models.Check.target, R.agent_id, R.check_type, R.success, R.response_time)
+        .join(models.Check, models.Check.id == R.check_id)
+        .where(*window)
+        .execution_options(yield_per=5000)
+    )
+    for created_at, target, agent_id, check_type, success, response_time in rows:
+        group = groups[(truncate(created_at, granularity), target, agent_id, check_type)]
+        group[0] += 1
+        group[1] += 1 if success else 0
+        if response_time is not None:
+            group[2].append(response_time)
+    return [
+        {"bucket_start": b, "target": t, "agent_id": a, "check_type": ct, "total": n, "successes": ok,
+         "avg_response_time": sum(times) / len(times) if times else None,
+         "p50_response_time": percentile(times, 0.5), "p95_response_time": percentile(times, 0.95)}
+        for (b, t, a, ct), (n, ok, times) in groups.items()
+    ]
+
+
+# Часы с опоздавшими результатами
+def mark_late_results(db: Session, created_ats: Iterable[datetime], now: datetime) -> int:
+    """Mark the hours of results older than the current hour for the next retention pass.
+
+    Every pass re-aggregates the current and previous hour anyway, so live
+    results cost nothing here; results replayed from an agent spool or
+    delayed in transit are rolled up through these marks. The upsert locks
+    an existing mark, so a pass that takes marks waits for this transaction
+    and then sees its results.
+    """
+    current = truncate(now, "hour")
+    hours = sorted({truncate(ts, "hour") for ts in created_ats if ts < current})
+    if not hours:
+        return 0
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        for hour in hours:
+            db.merge(models.RollupDirtyHour(bucket_start=hour, marked_at=now))
+        return len(hours)
+    stmt = dialect_insert(models.RollupDirtyHour)
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=["bucket_start"], set_={"marked_at": stmt.excluded.marked_at}),
+        [{"bucket_start": hour, "marked_at": now} for hour in hours]
+    )
+    return len(hours)
+
+
+def take_late_hours(db: Session) -> List[datetime]:
+    """Remove and return every marked hour"""
+    return sorted(db.scalars(
+        delete(models.RollupDirtyHour).returning(models.RollupDirtyHour.bucket_start)
+    ).all())
+
+
+def bucket_ranges(buckets: Iterable[datetime], granularity: str) -> List[Tuple[datetime, datetime]]:
+    """Merge bucket starts into [start, end) ranges of adjacent buckets"""
+    delta = GRANULARITIES[granularity]
+    ranges: List[List[datetime]] = []
+    for bucket in sorted(set(buckets)):
+        if ranges and ranges[-1][1] == bucket:
+            ranges[-1][1] = bucket + delta
+        else:
+            ranges.append([bucket, bucket + delta])
+    return [(start, end) for start, end in ranges]
+
+
+def stale_days(db: Session, days: Iterable[datetime], now: datetime) -> List[datetime]:
+    """Days of the live window whose rollup is older than ROLLUP_DAY_REFRESH_SECONDS or predates the day's end"""
+    Rollup = models.CheckResultRollup
+    stale = []
+    for day in days:
+        refreshed = db.scalar(
+            select(func.max(Rollup.updated_at)).where(Rollup.granularity == "day", Rollup.bucket_start == day)
+        )
+        due = min(day + GRANULARITIES["day"], now - timedelta(seconds=ROLLUP_DAY_REFRESH_SECONDS))
+        if refreshed is None or refreshed < due:
+            stale.append(day)
+    return stale
+
+
+def refresh_rollups(db: Session, granularity: str, start: datetime, end: datetime) -> int:
+    """Recompute rollup buckets in [start, end) from raw results"""
+    rows = aggregate_results(db, granularity, start, end)
+    db.execute(
+        delete(models.CheckResultRollup).where(
+            models.CheckResultRollup.granularity == granularity,
+            models.CheckResultRollup.bucket_start >= start,
+            models.CheckResultRollup.bucket_start < end
+        )
+    )
+    if rows:
+        now = datetime.utcnow()
+        db.execute(insert(models.CheckResultRollup),
+                   [{**row, "granularity": granularity, "updated_at": now} for row in rows])
+    return len(rows)
+
+
+def run_maintenance(db: Session, now: Optional[datetime] = None) -> Dict[str, object]:
+    """One retention pass: partitions, expiry and the rollup buckets that may have changed.
+
+    Hour rollups of the current and previous hour are always recomputed,
+    plus every hour marked by mark_late_results. Day rollups are recomputed
+    for the days of those late hours, and for the live days once per
+    ROLLUP_DAY_REFRESH_SECONDS and once more after the day has ended.
+    """
+    now = now or datetime.utcnow()
+    if is_postgres(db):
+        # Несколько воркеров бэкенда: работу выполняет тот, кто взял блокировку
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": RETENTION_LOCK_ID}).scalar():
+            return {"skipped": True}
+    report: Dict[str, object] = {}
+    current = truncate(now, "hour")
+    live = [current - GRANULARITIES["hour"], current]
+    late = take_late_hours(db)
+    days = {truncate(hour, "day") for hour in late}
+    days.update(stale_days(db, {truncate(hour, "day") for hour in live} - days, now))
+    report["late_hours"] = len(late)
+    for granularity, buckets in (("hour", live + late), ("day", days)):
+        report[f"rollups_{granularity}"] = sum(
+            refresh_rollups(db, granularity, start, end) for start, end in bucket_ranges(buckets, granularity)
+        )
+    db.execute(delete(models.CheckResultRollup).where(
+        models.CheckResultRollup.bucket_start < now - timedelta(days=ROLLUP_RETENTION_DAYS)
+    ))
+    if is_postgres(db):
+        report["partitions_created"] = ensure_partitions(db, now)
+        report["partitions_removed"] = drop_expired_partitions(db, now)
+        report["default_purged"] = purge_default_partition(db, now)
+    else:
+        report["results_purged"] = purge_expired_results(db, now)
+    db.commit()
+    return report
+
+
+class RetentionWorker:
+    """Background thread running run_maintenance every RETENTION_INTERVAL_SECONDS"""
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                report = run_maintenance(db)
+                logger.debug(f"🧹 Retention pass: {report}")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Retention pass failed: {e}")
+            finally:
+                db.close()
+            self._stop.wait(self.interval)
+
+
+retention_worker = RetentionWorker()
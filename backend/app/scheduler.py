@@ -0,0 +1,330 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .cache import emit, touch_checks
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "1"))
+# Пропущенные за время простоя запуски растягиваются на это окно, а не стартуют разом
+SCHEDULER_RECOVERY_SPREAD_SECONDS = float(os.getenv("SCHEDULER_RECOVERY_SPREAD_SECONDS", "60"))
+SCHEDULER_RETRY_SECONDS = 5
+# Мониторов на одну транзакцию запуска
+SCHEDULER_CHUNK = 1000
+WHEEL_SLOTS = 3600
+
+
+def to_epoch(value: datetime) -> float:
+    """Naive UTC datetime from the database as a Unix timestamp"""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+def from_epoch(value: float) -> datetime:
+    return datetime.utcfromtimestamp(value)
+
+
+class TimingWheel:
+    """Hashed timing wheel: schedule and cancel in O(1), a tick looks at one slot.
+
+    A key due at tick t lives in slot t % slots; keys due more than one
+    revolution ahead stay in their slot until their tick comes round.
+    """
+
+    def __init__(self, tick: float = SCHEDULER_TICK_SECONDS, slots: int = WHEEL_SLOTS, now: Optional[float] = None):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self.current = math.floor((time.time() if now is None else now) / tick)
+
+    def schedule(self, key: Hashable, due: float):
+        """(Re)schedule key at Unix time due; the past means the next tick"""
+        self.cancel(key)
+        due_tick = max(math.ceil(due / self.tick), self.current + 1)
+        slot = due_tick % len(self._slots)
+        self._slots[slot][key] = due_tick
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move to the tick of `now` and return the keys that became due"""
+        target = math.floor(now / self.tick)
+        due = []
+        # После долгой паузы достаточно одного оборота: каждый слот просматривается один раз
+        for tick in range(self.current + 1, min(target, self.current + len(self._slots)) + 1):
+            slot = self._slots[tick % len(self._slots)]
+            ready = [key for key, due_tick in slot.items() if due_tick <= target]
+            for key in ready:
+                del slot[key]
+                del self._where[key]
+            due.extend(ready)
+        self.current = max(self.current, target)
+        return due
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+
+class MonitorSpec:
+    """What the scheduler keeps in memory per enabled monitor"""
+
+    __slots__ = ("id", "target", "check_types", "params", "interval", "agent_names", "locations", "agent_count",
+                 "phase")
+
+    def __init__(self, monitor: models.Monitor):
+        self.id = monitor.id
+        self.target = monitor.target
+        self.check_types = monitor.check_types
+        self.params = monitor.params
+        self.interval = monitor.interval_seconds
+        self.agent_names = monitor.agent_names
+        self.locations = monitor.locations
+        self.agent_count = monitor.agent_count
+        # Постоянный сдвиг внутри интервала по id: запуски мониторов равномерно распределены
+        # и совпадают у всех воркеров и после перезапуска
+        self.phase = int(hashlib.md5(monitor.id.encode()).hexdigest()[:8], 16) / 2 ** 32
+
+    def next_run(self, after: float) -> float:
+        """First point of the monitor's grid (phase + k * interval) after `after`"""
+        offset = self.phase * self.interval
+        return (math.floor((after - offset) / self.interval) + 1) * self.interval + offset
+
+    def following_run(self, now: float) -> float:
+        """Run after the one started at `now`: at least half an interval later, back on the grid"""
+        return self.next_run(now + self.interval / 2)
+
+    def recovery_run(self, now: float) -> float:
+        """When to catch up a run missed while no scheduler was running"""
+        return now + self.phase * min(self.interval, SCHEDULER_RECOVERY_SPREAD_SECONDS)
+
+    @property
+    def dispatched(self) -> bool:
+        return bool(self.agent_names or self.locations or self.agent_count)
+
+
+def fire_monitors(db: Session, specs: List[MonitorSpec], now: float) -> Tuple[int, int, int]:
+    """Create the checks of due monitors in one transaction: (runs, checks created, runs lost to another worker).
+
+    A run is taken by moving next_run_at forward only where it is still due,
+    so with several backend workers each run happens once. A monitor whose
+    previous check is still pending gets no new one. Monitors with agent
+    selectors get agents from one AgentPool per chunk, least loaded first,
+    the same way POST /checks/ picks them.
+    """
+    Monitor = models.Monitor.__table__
+    Check = models.Check
+    started_at = from_epoch(now)
+    won = set(db.scalars(
+        update(Monitor)
+        .where(
+            Monitor.c.id.in_([spec.id for spec in specs]),
+            Monitor.c.enabled == True,
+            or_(Monitor.c.next_run_at.is_(None), Monitor.c.next_run_at <= started_at)
+        )
+        .values(last_run_at=started_at)
+        .returning(Monitor.c.id)
+    ).all())
+    if not won:
+        db.rollback()
+        return 0, 0, len(specs)
+    waiting = set(db.scalars(
+        select(Check.monitor_id).where(Check.monitor_id.in_(won), Check.status == "pending")
+    ).all())
+    runs = [spec for spec in specs if spec.id in won and spec.id not in waiting]
+    pool = crud.AgentPool(db) if any(spec.dispatched for spec in runs) else None
+    rows, assignments = [], []
+    for spec in runs:
+        check_id = models.generate_uuid()
+        agents = None
+        if spec.dispatched:
+            agents = pool.pick(spec.agent_names, spec.locations, spec.agent_count, probes=len(spec.check_types or ()))
+            if not agents:
+                logger.debug("No active agent matches monitor %s, run skipped", spec.id)
+                continue
+            assignments += crud.assignment_rows(check_id, agents, started_at)
+        rows.append({"id": check_id, "target": spec.target, "check_types": spec.check_types, "params": spec.params,
+                     "status": "pending", "created_at": started_at, "monitor_id": spec.id,
+                     "fanout": len(agents) if agents else None,
+                     "agent_selectors": crud.agent_selectors(spec.agent_names, spec.locations) if agents else None})
+    if rows:
+        db.execute(insert(Check), rows)
+        if assignments:
+            db.execute(insert(models.CheckAssignment), assignments)
+        touch_checks(db, [])
+        emit(db, "checks_scheduled", count=len(rows))
+    db.execute(
+        update(Monitor).where(Monitor.c.id == bindparam("monitor_id")).values(next_run_at=bindparam("next_run")),
+        [{"monitor_id": spec.id, "next_run": from_epoch(spec.following_run(now))} for spec in specs if spec.id in won]
+    )
+    db.commit()
+    return len(won), len(rows), len(specs) - len(won)
+
+
+class MonitorScheduler:
+    """Runs enabled monitors on schedule from an in-memory timing wheel.
+
+    Monitors are loaded once at start; changes made through the API arrive
+    as monitors_updated events (from every worker through the cache event
+    bus) and only those monitors are re-read, so no tick scans the table.
+    Each monitor runs on its own fixed grid inside its interval, which
+    spreads start times evenly. After a restart runs missed during the
+    downtime are caught up once, spread over SCHEDULER_RECOVERY_SPREAD_SECONDS.
+    """
+
+    def __init__(self, tick: float = SCHEDULER_TICK_SECONDS, enabled: bool = SCHEDULER_ENABLED):
+        self.tick = tick
+        self.enabled = enabled
+        self.wheel = TimingWheel(tick)
+        self.monitors: Dict[str, MonitorSpec] = {}
+        self.runs = 0
+        self.checks_created = 0
+        self.lost_runs = 0
+        self.last_tick_seconds = 0.0
+        # Опоздание запусков относительно расписания, последние значения
+        self.lags = deque(maxlen=10000)
+        self._due: Dict[str, float] = {}
+        self._reload: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_event(self, message: dict):
+        """monitors_updated listener: re-read these monitors on the next tick"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._reload.update(message.get("monitor_ids", ()))
+
+    def load(self, db: Session, now: Optional[float] = None):
+        """Schedule every enabled monitor"""
+        now = time.time() if now is None else now
+        self.wheel = TimingWheel(self.tick, now=now)
+        self.monitors.clear()
+        self._due.clear()
+        query = select(models.Monitor).where(models.Monitor.enabled == True).execution_options(yield_per=5000)
+        for monitor in db.scalars(query):
+            self._schedule(monitor, now)
+        logger.info(f"⏰ Scheduler loaded {len(self.monitors)} monitors")
+
+    def reload(self, db: Session, monitor_ids: Iterable[str], now: float):
+        monitor_ids = list(monitor_ids)
+        for monitor_id in monitor_ids:
+            self.monitors.pop(monitor_id, None)
+            self._due.pop(monitor_id, None)
+            self.wheel.cancel(monitor_id)
+        for monitor in db.scalars(select(models.Monitor).where(models.Monitor.id.in_(monitor_ids),
+                                                                 models.Monitor.enabled == True)):
+            self._schedule(monitor, now)
+
+    def run_due(self, db: Session, now: Optional[float] = None) -> int:
+        """One tick: apply reloads, fire due monitors and put them back on the wheel"""
+        now = time.time() if now is None else now
+        with self._lock:
+            reload, self._reload = self._reload, set()
+        if reload:
+            self.reload(db, reload, now)
+        due = [self.monitors[key] for key in self.wheel.advance(now) if key in self.monitors]
+        for start in range(0, len(due), SCHEDULER_CHUNK):
+            chunk = due[start:start + SCHEDULER_CHUNK]
+            try:
+                runs, created, lost = fire_monitors(db, chunk, now)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Failed to start {len(chunk)} monitor runs, retrying in {SCHEDULER_RETRY_SECONDS}s: {e}")
+                for spec in chunk:
+                    self._put(spec, now + SCHEDULER_RETRY_SECONDS)
+                continue
+            self.runs += runs
+            self.checks_created += created
+            self.lost_runs += lost
+            for spec in chunk:
+                self.lags.append(now - self._due.get(spec.id, now))
+                self._put(spec, spec.following_run(now))
+        return len(due)
+
+    def stats(self) -> Dict[str, object]:
+        lags = sorted(self.lags)
+        pick = lambda q: round(lags[min(len(lags) - 1, int(q * len(lags)))], 3) if lags else None
+        return {
+            "enabled": self.enabled,
+            "monitors": len(self.monitors),
+            "runs": self.runs,
+            "checks_created": self.checks_created,
+            "lost_runs": self.lost_runs,
+            "last_tick_seconds": round(self.last_tick_seconds, 4),
+            "lag_p50_seconds": pick(0.5),
+            "lag_p99_seconds": pick(0.99),
+        }
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.tick + 5)
+            self._thread = None
+
+    def _schedule(self, monitor: models.Monitor, now: float):
+        spec = MonitorSpec(monitor)
+        self.monitors[spec.id] = spec
+        if monitor.next_run_at is None:
+            due = spec.next_run(now)
+        elif to_epoch(monitor.next_run_at) <= now:
+            due = spec.recovery_run(now)
+        else:
+            due = to_epoch(monitor.next_run_at)
+        self._put(spec, due)
+
+    def _put(self, spec: MonitorSpec, due: float):
+        self._due[spec.id] = due
+        self.wheel.schedule(spec.id, due)
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                self.load(db)
+                break
+            except Exception as e:
+                logger.error(f"❌ Scheduler failed to load monitors: {e}")
+            finally:
+                db.close()
+            self._stop.wait(SCHEDULER_RETRY_SECONDS)
+        while not self._stop.wait(self.tick - time.time() % self.tick):
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                self.run_due(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"❌ Scheduler tick failed: {e}")
+            finally:
+                db.close()
+            self.last_tick_seconds = time.perf_counter() - started
+
+
+scheduler = MonitorScheduler()
@@ -1,7 +1,10 @@
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Iterable, List, Optional, Dict, Any, Tuple, Union
 from datetime import datetime
 from enum import Enum
+from urllib.parse import urlsplit
+import ipaddress
+import re
 
 class CheckType(str, Enum):
     PING = "ping"
@@ -16,9 +19,203 @@ class CheckType(str, Enum):
     DNS_TXT = "dns_txt"
     DNS_CNAME = "dns_cname"
 
-class CheckCreate(BaseModel):
+MAX_TCP_PORTS = 1024
+MAX_BATCH_TARGETS = 50000
+MIN_MONITOR_INTERVAL = 10
+MAX_MONITOR_INTERVAL = 86400
+# Больше агентов одной проверке не назначается
+MAX_FANOUT = 50
+# Некорректные цели возвращаются в ответе не все, а первые столько
+MAX_REPORTED_INVALID = 100
+
+_HOSTNAME_LABEL = re.compile(r"^(?!-)[a-z0-9_-]{1,63}(?<!-)$")
+
+def parse_ports(value) -> List[int]:
+    """Expand 443, "22,80,8000-8010" or [22, "8000-8010"] into a sorted list of unique ports"""
+    items = value.split(",") if isinstance(value, str) else value if isinstance(value, list) else [value]
+    ports = set()
+    for item in items:
+        text = str(item).strip()
+        low, _, high = text.partition("-")
+        try:
+            low, high = int(low), int(high or low)
+        except ValueError:
+            raise ValueError(f"Invalid port or range: {item!r}")
+        if not 1 <= low <= high <= 65535:
+            raise ValueError(f"Port out of range 1-65535: {item!r}")
+        ports.update(range(low, high + 1))
+        if len(ports) > MAX_TCP_PORTS:
+            raise ValueError(f"At most {MAX_TCP_PORTS} ports per check")
+    return sorted(ports)
+
+def normalize_target(value: str) -> str:
+    """Host name, IP address or http(s) URL in canonical form; ValueError if malformed"""
+    target = value.strip()
+    if not target or len(target) > 2048 or any(ch.isspace() for ch in target):
+        raise ValueError("empty, too long or contains whitespace")
+    if "://" in target:
+        parts = urlsplit(target)
+        if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+            raise ValueError("only http(s) URLs with a host are supported")
+        normalize_target(parts.hostname)
+        return target
+    try:
+        return str(ipaddress.ip_address(target.strip("[]")))
+    except ValueError:
+        pass
+    host = target.lower().rstrip(".")
+    if len(host) > 253 or not all(_HOSTNAME_LABEL.match(label) for label in host.split(".")):
+        raise ValueError("not a valid host name, IP address or URL")
+    return host
+
+def split_targets(values: Iterable[str]) -> Tuple[List[str], List[Dict[str, str]], int]:
+    """Normalize and dedupe targets keeping their order: (targets, invalid, duplicate count)"""
+    targets: Dict[str, None] = {}
+    invalid = []
+    duplicates = 0
+    for value in values:
+        try:
+            target = normalize_target(value)
+        except ValueError as e:
+            invalid.append({"target": value[:200], "error": str(e)})
+            continue
+        if target in targets:
+            duplicates += 1
+        else:
+            targets[target] = None
+    return list(targets), invalid, duplicates
+
+def parse_target_lines(text: str) -> List[str]:
+    """Targets of an uploaded list: one per line or comma/space separated, # starts a comment"""
+    return [item for line in text.splitlines()
+            for item in re.split(r"[\s,;]+", line.split("#", 1)[0]) if item]
+
+class CheckOptions(BaseModel):
+    """Check types and probe parameters shared by single and batch creation"""
+    check_types: List[CheckType]
+    # Порты для tcp: список, диапазоны "8000-8010" или строка "22,80,443"; по умолчанию 80
+    ports: Optional[Union[str, int, List[Union[int, str]]]] = None
+
+    @field_validator("ports")
+    @classmethod
+    def expand_ports(cls, value):
+        return parse_ports(value) if value is not None else None
+
+    def params(self) -> Optional[Dict[str, Any]]:
+        """Probe parameters stored with the check and handed to agents"""
+        return {"ports": self.ports} if self.ports else None
+
+class CheckCreate(CheckOptions):
     target: str
+    # Вернуть результаты такой же проверки, завершённой не раньше стольких секунд назад,
+    # вместо новых проб; по умолчанию CHECK_REUSE_SECONDS, 0 — всегда проверять заново
+    reuse_seconds: Optional[int] = Field(None, ge=0, le=3600)
+    # Выбор агентов: по именам и/или по части location ("EU", "DE", "Frankfurt"),
+    # agent_count — сколько наименее загруженных из подходящих выполнят проверку
+    agents: Optional[List[str]] = None
+    locations: Optional[List[str]] = None
+    agent_count: Optional[int] = Field(None, ge=1, le=MAX_FANOUT)
+
+    def dispatched(self) -> bool:
+        """Whether the dispatcher picks the agents instead of the first free agent taking the check"""
+        return bool(self.agents or self.locations or self.agent_count)
+
+class CheckBatchCreate(CheckOptions):
+    targets: List[str]
+    name: Optional[str] = None
+
+    @field_validator("targets")
+    @classmethod
+    def limit_targets(cls, value):
+        if len(value) > MAX_BATCH_TARGETS:
+            raise ValueError(f"At most {MAX_BATCH_TARGETS} targets per batch")
+        return value
+
+class CheckBatchResponse(BaseModel):
+    id: str
+    name: Optional[str]
     check_types: List[CheckType]
+    params: Optional[Dict[str, Any]] = None
+    created_at: datetime
+    # pending, running или completed: по состоянию всех проверок пачки
+    status: str
+    total: int
+    pending: int
+    running: int
+    completed: int
+    completed_at: Optional[datetime] = None
+
+class InvalidTarget(BaseModel):
+    target: str
+    error: str
+
+class CheckBatchCreated(CheckBatchResponse):
+    duplicates: int = 0
+    invalid_count: int = 0
+    invalid: List[InvalidTarget] = []
+
+class MonitorCreate(CheckOptions):
+    target: str
+    name: Optional[str] = None
+    interval_seconds: int = Field(ge=MIN_MONITOR_INTERVAL, le=MAX_MONITOR_INTERVAL)
+    # Селекторы агентов, как agents/locations/agent_count у POST /checks/; без них — любой один агент
+    agent_names: Optional[List[str]] = None
+    locations: Optional[List[str]] = None
+    agent_count: Optional[int] = Field(None, ge=1, le=MAX_FANOUT)
+    enabled: bool = True
+
+    @field_validator("target")
+    @classmethod
+    def check_target(cls, value):
+        return normalize_target(value)
+
+class MonitorUpdate(BaseModel):
+    name: Optional[str] = None
+    target: Optional[str] = None
+    check_types: Optional[List[CheckType]] = None
+    ports: Optional[Union[str, int, List[Union[int, str]]]] = None
+    interval_seconds: Optional[int] = Field(None, ge=MIN_MONITOR_INTERVAL, le=MAX_MONITOR_INTERVAL)
+    agent_names: Optional[List[str]] = None
+    locations: Optional[List[str]] = None
+    agent_count: Optional[int] = Field(None, ge=1, le=MAX_FANOUT)
+    enabled: Optional[bool] = None
+
+    # Явный null допустим только для полей, которые можно очистить (name, ports, селекторы агентов)
+    @field_validator("target", "check_types", "interval_seconds", "enabled")
+    @classmethod
+    def reject_null(cls, value):
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
+    @field_validator("target")
+    @classmethod
+    def check_target(cls, value):
+        return normalize_target(value)
+
+    @field_validator("ports")
+    @classmethod
+    def expand_ports(cls, value):
+        return parse_ports(value) if value is not None else None
+
+class MonitorResponse(BaseModel):
+    id: str
+    name: Optional[str]
+    target: str
+    check_types: List[CheckType]
+    params: Optional[Dict[str, Any]] = None
+    interval_seconds: int
+    agent_names: Optional[List[str]] = None
+    locations: Optional[List[str]] = None
+    agent_count: Optional[int] = None
+    enabled: bool
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    last_run_at: Optional[datetime] = None
+    next_run_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
 
 class CheckResponse(BaseModel):
     id: str
@@ -27,6 +224,12 @@ class CheckResponse(BaseModel):
     status: str
     created_at: datetime
     completed_at: Optional[datetime]
+    claimed_by: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+    batch_id: Optional[str] = None
+    monitor_id: Optional[str] = None
+    reused_check_id: Optional[str] = None
+    fanout: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -44,6 +247,37 @@ class CheckResultResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ResultItem(BaseModel):
+    """One result uploaded by an agent to the ingest endpoints"""
+    model_config = ConfigDict(use_enum_values=True)
+
+    check_id: str
+    agent_name: str
+    check_type: CheckType
+    success: bool = False
+    result_data: Optional[Dict[str, Any]] = None
+    response_time: Optional[int] = None
+    error_message: Optional[str] = None
+    # Время и идентификатор результата, назначенные агентом
+    created_at: Optional[str] = None
+    result_uid: Optional[str] = None
+
+    @field_validator("response_time", mode="before")
+    @classmethod
+    def round_response_time(cls, value):
+        return round(value) if isinstance(value, float) else value
+
+    @field_validator("created_at")
+    @classmethod
+    def validate_created_at(cls, value):
+        # Подставленное "сейчас" ломало бы дедупликацию по (result_uid, created_at) при повторе
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError("created_at must be an ISO 8601 timestamp")
+        return value
+
 class CheckWithResults(CheckResponse):
     results: List[CheckResultResponse] = []
 
@@ -52,6 +286,11 @@ class AgentCreate(BaseModel):
     location: Optional[str] = None
     token: str
 
+class AgentHeartbeat(BaseModel):
+    # Сколько проб агент выполняет одновременно и сколько у него сейчас в работе
+    capacity: Optional[int] = Field(None, ge=1)
+    in_flight: Optional[int] = Field(None, ge=0)
+
 class AgentResponse(BaseModel):
     id: str
     name: str
@@ -59,6 +298,30 @@ class AgentResponse(BaseModel):
     is_active: bool
     last_heartbeat: Optional[datetime]
     created_at: datetime
+    capacity: Optional[int] = None
+    in_flight: Optional[int] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class RollupGranularity(str, Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+    PARQUET = "parquet"
+
+class RollupResponse(BaseModel):
+    granularity: RollupGranularity
+    bucket_start: datetime
+    target: str
+    agent_name: Optional[str]
+    check_type: str
+    total: int
+    successes: int
+    success_rate: float
+    avg_response_time: Optional[float]
+    p50_response_time: Optional[float]
+    p95_response_time: Optional[float]
@@ -0,0 +1,41 @@
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from app.database import Base, DATABASE_URL
+from app import models  # noqa: F401  (регистрирует таблицы в Base.metadata)
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(url=DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # init_db() передаёт готовое соединение приложения
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        # Миграции с autocommit_block (CREATE INDEX CONCURRENTLY) фиксируют транзакцию посреди прогона
+        context.configure(connection=connection, target_metadata=target_metadata, transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+    engine = create_engine(DATABASE_URL)
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if config.attributes.get("connection") is None and config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
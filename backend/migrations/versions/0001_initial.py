@@ -0,0 +1,59 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Базы, созданные раньше через Base.metadata.create_all, уже содержат эти таблицы
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "agents" not in existing:
+        op.create_table(
+            "agents",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False, unique=True),
+            sa.Column("location", sa.String()),
+            sa.Column("token", sa.String(), nullable=False),
+            sa.Column("is_active", sa.Boolean()),
+            sa.Column("last_heartbeat", sa.DateTime()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+    if "checks" not in existing:
+        op.create_table(
+            "checks",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("target", sa.String(), nullable=False),
+            sa.Column("check_types", sa.JSON()),
+            sa.Column("status", sa.String()),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("completed_at", sa.DateTime()),
+        )
+    if "check_results" not in existing:
+        op.create_table(
+            "check_results",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("check_id", sa.String(), sa.ForeignKey("checks.id")),
+            sa.Column("agent_id", sa.String(), sa.ForeignKey("agents.id")),
+            sa.Column("check_type", sa.String(), nullable=False),
+            sa.Column("success", sa.Boolean()),
+            sa.Column("result_data", sa.JSON()),
+            sa.Column("response_time", sa.Integer()),
+            sa.Column("error_message", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+
+
+def downgrade():
+    op.drop_table("check_results")
+    op.drop_table("checks")
+    op.drop_table("agents")
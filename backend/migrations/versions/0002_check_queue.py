@@ -0,0 +1,40 @@
+"""check leases and per-type task progress
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {c["name"] for c in inspector.get_columns("checks")}
+    if "claimed_by" not in columns:
+        op.add_column("checks", sa.Column("claimed_by", sa.String()))
+    if "lease_expires_at" not in columns:
+        op.add_column("checks", sa.Column("lease_expires_at", sa.DateTime()))
+    if "check_tasks" not in inspector.get_table_names():
+        op.create_table(
+            "check_tasks",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("check_id", sa.String(), sa.ForeignKey("checks.id"), nullable=False),
+            sa.Column("agent_id", sa.String(), sa.ForeignKey("agents.id"), nullable=False),
+            sa.Column("check_type", sa.String(), nullable=False),
+            sa.Column("status", sa.String()),
+            sa.Column("updated_at", sa.DateTime()),
+            sa.UniqueConstraint("check_id", "agent_id", "check_type", name="uq_check_tasks_check_agent_type"),
+        )
+
+
+def downgrade():
+    op.drop_table("check_tasks")
+    op.drop_column("checks", "lease_expires_at")
+    op.drop_column("checks", "claimed_by")
@@ -0,0 +1,56 @@
+"""indexes for the check queue, history pagination and result lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+INDEXES = ["ix_checks_created_at_id", "ix_checks_pending", "ix_checks_running_lease",
+           "ix_check_results_check_id_id", "ix_check_results_agent_id_created_at"]
+
+
+def create_indexes(**kw):
+    # Базы, созданные через Base.metadata.create_all, уже содержат эти индексы
+    op.create_index("ix_checks_created_at_id", "checks", ["created_at", "id"], if_not_exists=True, **kw)
+    op.create_index("ix_checks_pending", "checks", ["created_at"], if_not_exists=True,
+                    postgresql_where=sa.text("status = 'pending'"),
+                    sqlite_where=sa.text("status = 'pending'"), **kw)
+    op.create_index("ix_checks_running_lease", "checks", ["lease_expires_at"], if_not_exists=True,
+                    postgresql_where=sa.text("status = 'running'"),
+                    sqlite_where=sa.text("status = 'running'"), **kw)
+    op.create_index("ix_check_results_check_id_id", "check_results", ["check_id", "id"], if_not_exists=True, **kw)
+    op.create_index("ix_check_results_agent_id_created_at", "check_results", ["agent_id", "created_at"],
+                    if_not_exists=True, **kw)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        create_indexes()
+        return
+    # На больших таблицах индексы строятся CONCURRENTLY, не блокируя запись; это возможно только вне транзакции
+    with op.get_context().autocommit_block():
+        # Прерванная сборка оставляет невалидный индекс, который IF NOT EXISTS пропустил бы
+        invalid = op.get_bind().execute(sa.text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+        ), {"names": INDEXES}).scalars().all()
+        for name in invalid:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+        create_indexes(postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index("ix_check_results_agent_id_created_at", table_name="check_results")
+    op.drop_index("ix_check_results_check_id_id", table_name="check_results")
+    op.drop_index("ix_checks_running_lease", table_name="checks")
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.drop_index("ix_checks_created_at_id", table_name="checks")
@@ -0,0 +1,104 @@
+"""partition check_results by day and add result rollups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "check_result_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("granularity", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("target", sa.String(), nullable=False),
+        sa.Column("agent_id", sa.String(), sa.ForeignKey("agents.id"), nullable=False),
+        sa.Column("check_type", sa.String(), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("successes", sa.Integer(), nullable=False),
+        sa.Column("avg_response_time", sa.Float()),
+        sa.Column("p50_response_time", sa.Float()),
+        sa.Column("p95_response_time", sa.Float()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.UniqueConstraint("granularity", "bucket_start", "target", "agent_id", "check_type",
+                            name="uq_check_result_rollups_bucket"),
+    )
+    op.create_index("ix_check_result_rollups_granularity_bucket", "check_result_rollups",
+                    ["granularity", "bucket_start"])
+
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Существующая таблица становится партицией "всё до завтрашнего дня" без копирования строк;
+    # дальше по партиции на сутки (см. app/retention.py)
+    op.execute("ALTER TABLE check_results RENAME TO check_results_legacy")
+    # Первичный ключ партиционированной таблицы обязан включать ключ партиционирования
+    op.execute("ALTER TABLE check_results_legacy DROP CONSTRAINT check_results_pkey")
+    op.execute("ALTER INDEX ix_check_results_check_id_id RENAME TO ix_check_results_legacy_check_id_id")
+    op.execute("ALTER INDEX ix_check_results_agent_id_created_at RENAME TO ix_check_results_legacy_agent_id_created_at")
+    op.execute("UPDATE check_results_legacy SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    op.execute("ALTER TABLE check_results_legacy ALTER COLUMN created_at SET NOT NULL")
+    op.execute("""
+        CREATE TABLE check_results (
+            id INTEGER NOT NULL DEFAULT nextval('check_results_id_seq'),
+            check_id VARCHAR REFERENCES checks (id),
+            agent_id VARCHAR REFERENCES agents (id),
+            check_type VARCHAR NOT NULL,
+            success BOOLEAN,
+            result_data JSON,
+            response_time INTEGER,
+            error_message TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE INDEX ix_check_results_check_id_id ON check_results (check_id, id)")
+    op.execute("CREATE INDEX ix_check_results_agent_id_created_at ON check_results (agent_id, created_at)")
+    op.execute("""
+        ALTER TABLE check_results ATTACH PARTITION check_results_legacy
+        FOR VALUES FROM (MINVALUE) TO ('{}')
+    """.format(_tomorrow()))
+    op.execute("ALTER SEQUENCE check_results_id_seq OWNED BY check_results.id")
+    op.execute("CREATE TABLE check_results_default PARTITION OF check_results DEFAULT")
+
+
+def _tomorrow() -> str:
+    from datetime import datetime, timedelta
+    return (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE check_results RENAME TO check_results_partitioned")
+        op.execute("ALTER TABLE check_results_partitioned RENAME CONSTRAINT check_results_pkey TO check_results_partitioned_pkey")
+        op.execute("ALTER INDEX ix_check_results_check_id_id RENAME TO ix_check_results_partitioned_check_id_id")
+        op.execute("ALTER INDEX ix_check_results_agent_id_created_at RENAME TO ix_check_results_partitioned_agent_id_created_at")
+        op.execute("ALTER SEQUENCE check_results_id_seq OWNED BY NONE")
+        op.execute("""
+            CREATE TABLE check_results (
+                id INTEGER NOT NULL DEFAULT nextval('check_results_id_seq') PRIMARY KEY,
+                check_id VARCHAR REFERENCES checks (id),
+                agent_id VARCHAR REFERENCES agents (id),
+                check_type VARCHAR NOT NULL,
+                success BOOLEAN,
+                result_data JSON,
+                response_time INTEGER,
+                error_message TEXT,
+                created_at TIMESTAMP WITHOUT TIME ZONE
+            )
+        """)
+        op.execute("INSERT INTO check_results SELECT * FROM check_results_partitioned")
+        op.execute("ALTER SEQUENCE check_results_id_seq OWNED BY check_results.id")
+        op.execute("DROP TABLE check_results_partitioned CASCADE")
+        op.execute("CREATE INDEX ix_check_results_check_id_id ON check_results (check_id, id)")
+        op.execute("CREATE INDEX ix_check_results_agent_id_created_at ON check_results (agent_id, created_at)")
+    op.drop_index("ix_check_result_rollups_granularity_bucket", table_name="check_result_rollups")
+    op.drop_table("check_result_rollups")
@@ -0,0 +1,22 @@
+"""per-check probe parameters
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("checks", sa.Column("params", sa.JSON()))
+
+
+def downgrade():
+    op.drop_column("checks", "params")
@@ -0,0 +1,25 @@
+"""idempotent result uploads
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("check_results", sa.Column("result_uid", sa.String()))
+    # Уникальный индекс партиционированной таблицы обязан включать ключ партиционирования
+    op.create_index("uq_check_results_result_uid", "check_results", ["result_uid", "created_at"], unique=True)
+
+
+def downgrade():
+    op.drop_index("uq_check_results_result_uid", table_name="check_results")
+    op.drop_column("check_results", "result_uid")
@@ -0,0 +1,51 @@
+"""check batches and a separate queue for batch checks
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "check_batches",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("check_types", sa.JSON()),
+        sa.Column("params", sa.JSON()),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.add_column("checks", sa.Column("batch_id", sa.String()))
+    # SQLite не добавляет ограничения через ALTER TABLE
+    if op.get_bind().dialect.name != "sqlite":
+        op.create_foreign_key("fk_checks_batch_id", "checks", "check_batches", ["batch_id"], ["id"])
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL"))
+    op.create_index("ix_checks_batch_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NOT NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NOT NULL"))
+    op.create_index("ix_checks_batch_id_status", "checks", ["batch_id", "status", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_checks_batch_id_status", table_name="checks")
+    op.drop_index("ix_checks_batch_pending", table_name="checks")
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending'"),
+                    sqlite_where=sa.text("status = 'pending'"))
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_constraint("fk_checks_batch_id", "checks", type_="foreignkey")
+    op.drop_column("checks", "batch_id")
+    op.drop_table("check_batches")
@@ -0,0 +1,59 @@
+"""recurring monitors and checks assigned to an agent
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "monitors",
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("target", sa.String(), nullable=False),
+        sa.Column("check_types", sa.JSON()),
+        sa.Column("params", sa.JSON()),
+        sa.Column("interval_seconds", sa.Integer(), nullable=False),
+        sa.Column("agent_names", sa.JSON()),
+        sa.Column("enabled", sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.Column("last_run_at", sa.DateTime()),
+        sa.Column("next_run_at", sa.DateTime()),
+    )
+    op.add_column("checks", sa.Column("monitor_id", sa.String()))
+    op.add_column("checks", sa.Column("assigned_agent", sa.String()))
+    # SQLite не добавляет ограничения через ALTER TABLE
+    if op.get_bind().dialect.name != "sqlite":
+        op.create_foreign_key("fk_checks_monitor_id", "checks", "monitors", ["monitor_id"], ["id"])
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL"))
+    op.create_index("ix_checks_assigned_pending", "checks", ["assigned_agent", "created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND assigned_agent IS NOT NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND assigned_agent IS NOT NULL"))
+    op.create_index("ix_checks_monitor_id_status", "checks", ["monitor_id", "status"])
+
+
+def downgrade():
+    op.drop_index("ix_checks_monitor_id_status", table_name="checks")
+    op.drop_index("ix_checks_assigned_pending", table_name="checks")
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL"))
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_constraint("fk_checks_monitor_id", "checks", type_="foreignkey")
+    op.drop_column("checks", "assigned_agent")
+    op.drop_column("checks", "monitor_id")
+    op.drop_table("monitors")
@@ -0,0 +1,31 @@
+"""checks answered with the results of a recent identical check
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("checks", sa.Column("reused_check_id", sa.String()))
+    # SQLite не добавляет ограничения через ALTER TABLE
+    if op.get_bind().dialect.name != "sqlite":
+        op.create_foreign_key("fk_checks_reused_check_id", "checks", "checks", ["reused_check_id"], ["id"])
+    op.create_index("ix_checks_target_completed_at", "checks", ["target", "completed_at"],
+                    postgresql_where=sa.text("status = 'completed' AND reused_check_id IS NULL"),
+                    sqlite_where=sa.text("status = 'completed' AND reused_check_id IS NULL"))
+
+
+def downgrade():
+    op.drop_index("ix_checks_target_completed_at", table_name="checks")
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_constraint("fk_checks_reused_check_id", "checks", type_="foreignkey")
+    op.drop_column("checks", "reused_check_id")
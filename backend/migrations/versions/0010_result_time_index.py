@@ -0,0 +1,22 @@
+"""results by time range for exports and rollups
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # На партиционированной таблице индекс создаётся и на каждой партиции
+    op.create_index("ix_check_results_created_at_id", "check_results", ["created_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_check_results_created_at_id", table_name="check_results")
@@ -0,0 +1,50 @@
+"""agent load in heartbeats and checks dispatched to chosen agents
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("agents", sa.Column("capacity", sa.Integer()))
+    op.add_column("agents", sa.Column("in_flight", sa.Integer()))
+    op.add_column("checks", sa.Column("fanout", sa.Integer()))
+    op.create_table(
+        "check_assignments",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("check_id", sa.String(), sa.ForeignKey("checks.id"), nullable=False),
+        sa.Column("agent_id", sa.String(), sa.ForeignKey("agents.id"), nullable=False),
+        sa.Column("status", sa.String()),
+        sa.Column("lease_expires_at", sa.DateTime()),
+        sa.Column("created_at", sa.DateTime()),
+        sa.UniqueConstraint("check_id", "agent_id", name="uq_check_assignments_check_agent"),
+    )
+    op.create_index("ix_check_assignments_agent_open", "check_assignments", ["agent_id", "created_at"],
+                    postgresql_where=sa.text("status IN ('pending', 'running')"),
+                    sqlite_where=sa.text("status IN ('pending', 'running')"))
+    # Проверки с назначенными агентами не попадают в общую очередь
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL AND fanout IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL AND fanout IS NULL"))
+
+
+def downgrade():
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL"))
+    op.drop_index("ix_check_assignments_agent_open", table_name="check_assignments")
+    op.drop_table("check_assignments")
+    op.drop_column("checks", "fanout")
+    op.drop_column("agents", "in_flight")
+    op.drop_column("agents", "capacity")
@@ -0,0 +1,49 @@
+"""monitors dispatch through check_assignments; checks.assigned_agent is dropped
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("monitors", sa.Column("locations", sa.JSON()))
+    op.add_column("monitors", sa.Column("agent_count", sa.Integer()))
+    # Незавершённые проверки, назначенные агенту, становятся назначениями с одним агентом
+    op.execute(
+        "INSERT INTO check_assignments (check_id, agent_id, status, lease_expires_at, created_at) "
+        "SELECT checks.id, agents.id, checks.status, checks.lease_expires_at, checks.created_at "
+        "FROM checks JOIN agents ON agents.name = checks.assigned_agent "
+        "WHERE checks.status IN ('pending', 'running')"
+    )
+    op.execute(
+        "UPDATE checks SET fanout = 1, claimed_by = NULL, lease_expires_at = NULL "
+        "WHERE assigned_agent IS NOT NULL AND status IN ('pending', 'running')"
+    )
+    op.drop_index("ix_checks_assigned_pending", table_name="checks")
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.drop_column("checks", "assigned_agent")
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL AND fanout IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL AND fanout IS NULL"))
+
+
+def downgrade():
+    op.drop_index("ix_checks_pending", table_name="checks")
+    op.add_column("checks", sa.Column("assigned_agent", sa.String()))
+    op.create_index("ix_checks_pending", "checks", ["created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL AND fanout IS NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND batch_id IS NULL AND assigned_agent IS NULL AND fanout IS NULL"))
+    op.create_index("ix_checks_assigned_pending", "checks", ["assigned_agent", "created_at"],
+                    postgresql_where=sa.text("status = 'pending' AND assigned_agent IS NOT NULL"),
+                    sqlite_where=sa.text("status = 'pending' AND assigned_agent IS NOT NULL"))
+    op.drop_column("monitors", "agent_count")
+    op.drop_column("monitors", "locations")
@@ -0,0 +1,22 @@
+"""agent selectors stored with dispatched checks
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("checks", sa.Column("agent_selectors", sa.JSON()))
+
+
+def downgrade():
+    op.drop_column("checks", "agent_selectors")
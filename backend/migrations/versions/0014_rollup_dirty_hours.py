@@ -0,0 +1,26 @@
+"""hours with late results awaiting a rollup refresh
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0014"
+down_revision = "0013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "check_result_rollup_dirty",
+        sa.Column("bucket_start", sa.DateTime(), primary_key=True),
+        sa.Column("marked_at", sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table("check_result_rollup_dirty")
@@ -0,0 +1,121 @@
+"""Agent probe benchmark: checks/sec and latency of every NetworkChecker method.
+
+Probes run against local stand-ins (HTTP server, TCP listener, stub DNS
+server on loopback), so numbers measure the agent, not the internet. Each
+method is called in rounds of --calls from --concurrency threads for at least
+--min-seconds; ping and traceroute need an ICMP socket and are reported as
+skipped without one.
+
+    python bench/bench_agent.py --calls 200 --concurrency 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import AGENT_DIR, percentiles
+from targets import LocalTargets
+
+DNS_TYPES = ["A", "AAAA", "MX", "NS", "TXT"]
+
+
+def load_checker(targets: LocalTargets):
+    """Agent's NetworkChecker with DNS pointed at the stub server"""
+    os.environ["AGENT_DNS_NAMESERVERS"] = targets.host
+    os.environ["AGENT_DNS_PORT"] = str(targets.dns_port)
+    os.environ.setdefault("AGENT_TRACE_TIMEOUT", "1")
+    os.environ.setdefault("AGENT_TRACE_MAX_HOPS", "4")
+    if AGENT_DIR not in sys.path:
+        sys.path.insert(0, AGENT_DIR)
+    import logging
+    from main import NetworkChecker
+    logging.disable(logging.WARNING)
+    return NetworkChecker
+
+
+def cases(checker, targets: LocalTargets):
+    """name -> (probe, expected success, share of --calls)"""
+    host = targets.host
+    many_ports = [targets.tcp_port] + [targets.closed_port + i for i in range(1, 100)]
+    return {
+        "http_check": (lambda: checker.http_check(targets.http_url), True, 1),
+        "tcp_check_open": (lambda: checker.tcp_check(host, [targets.tcp_port]), True, 1),
+        "tcp_check_closed": (lambda: checker.tcp_check(host, [targets.closed_port]), False, 1),
+        "tcp_check_100_ports": (lambda: checker.tcp_check(host, many_ports), True, 0.25),
+        "dns_check": (lambda: checker.dns_check("bench.test", "A"), True, 1),
+        "dns_checks_5_types": (lambda: checker.dns_checks("bench.test", DNS_TYPES), True, 1),
+        # Три echo-запроса с интервалом 0.2 с: вызов длится ~0.4 с
+        "ping_check": (lambda: checker.ping_check(host), True, 0.1),
+        "traceroute_check": (lambda: checker.traceroute_check(host), True, 0.1),
+    }
+
+
+def succeeded(result) -> bool:
+    if "success" in result:
+        return bool(result["success"])
+    # dns_checks: словарь результатов по типам записей
+    return all(r.get("success") for r in result.values())
+
+
+def measure(probe, expected: bool, calls: int, concurrency: int, min_seconds: float):
+    """Rounds of `calls` calls until min_seconds passed: sub-millisecond probes need many rounds for a stable rate"""
+    latencies = []
+    unexpected = []
+
+    def one(_):
+        started = time.perf_counter()
+        result = probe()
+        latencies.append(time.perf_counter() - started)
+        if succeeded(result) != expected:
+            unexpected.append(result.get("error") or result)
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        while True:
+            list(pool.map(one, range(calls)))
+            total += calls
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds:
+                break
+    report = {"calls": total, "checks_per_sec": round(total / elapsed, 1), **percentiles(latencies),
+              "unexpected": len(unexpected)}
+    if unexpected:
+        report["sample_error"] = str(unexpected[0])[:200]
+    return report
+
+
+def run(args):
+    with LocalTargets() as targets:
+        checker = load_checker(targets)
+        probes = cases(checker, targets)
+        report = {}
+        for name, (probe, expected, share) in probes.items():
+            if args.only and name not in args.only:
+                continue
+            # Пробный вызов: прогрев и проверка, что метод вообще доступен в этом окружении
+            first = probe()
+            if name in ("ping_check", "traceroute_check") and not succeeded(first):
+                report[name] = {"skipped": str(first.get("error"))[:200]}
+                continue
+            report[name] = measure(probe, expected, max(1, int(args.calls * share)), args.concurrency, args.min_seconds)
+    return {"benchmark": "agent", "concurrency": args.concurrency, "methods": report}
+
+
+def add_args(parser):
+    parser.add_argument("--calls", type=int, default=200, help="calls per method (fewer for slow methods)")
+    parser.add_argument("--concurrency", type=int, default=16, help="threads calling each method")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="keep calling each method at least this long")
+    parser.add_argument("--only", nargs="*", help="run only these methods")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_args(parser)
+    print(json.dumps(run(parser.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Concurrency load test for the async endpoints.
+
+Starts the backend under uvicorn on a local port, parks a crowd of agents on
+the long-poll claim endpoint, and meanwhile measures latency of the async
+GET /checks/{id} and of the threadpool-bound GET /checks/ route. Before the
+async conversion every parked poller held one of the 40 anyio worker threads;
+now pollers hold neither a thread nor a database connection.
+
+    python bench/bench_concurrency.py --pollers 200 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from common import ThrowawayDatabase, add_database_args, free_port, load_backend, percentiles
+
+
+def start_server(database_url: str, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(load_backend(database_url), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(client, path: str, requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {"requests": requests, "rps": round(requests / elapsed, 1), **percentiles(latencies)}
+
+
+async def measure_all(base_url: str, args):
+    import httpx
+    limits = httpx.Limits(max_connections=args.pollers + args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        for i in range(args.pollers):
+            await client.post("/agents/register", json={"name": f"poller-{i}", "token": "bench"})
+        check_types = ["ping", "http", "dns_a"]
+        check_id = (await client.post("/checks/", json={"target": "example.com", "check_types": check_types})).json()["id"]
+        await client.post("/results/", json={
+            "check_id": check_id, "agent_name": "poller-0",
+            "results": [{"check_type": ct, "success": True, "result_data": {}} for ct in check_types]
+        })
+
+        baseline = {
+            "async_get_check": await measure(client, f"/checks/{check_id}", args.requests, args.concurrency),
+            "sync_list_checks": await measure(client, "/checks/?limit=10", args.requests, args.concurrency),
+        }
+        pollers = [
+            asyncio.create_task(client.post(f"/agents/poller-{i}/claim", params={"max": 1, "wait": args.wait}))
+            for i in range(args.pollers)
+        ]
+        await asyncio.sleep(0.5)
+        parked = sum(1 for task in pollers if not task.done())
+        loaded = {
+            "async_get_check": await measure(client, f"/checks/{check_id}", args.requests, args.concurrency),
+            "sync_list_checks": await measure(client, "/checks/?limit=10", args.requests, args.concurrency),
+        }
+        still_parked = sum(1 for task in pollers if not task.done())
+        await asyncio.gather(*pollers)
+    return {"baseline": baseline, "with_parked_pollers": loaded, "pollers_parked": {"before": parked, "after": still_parked}}
+
+
+def run(args, database_url: str):
+    port = free_port()
+    server = start_server(database_url, port)
+    try:
+        report = asyncio.run(measure_all(f"http://127.0.0.1:{port}", args))
+    finally:
+        server.should_exit = True
+    return {"benchmark": "concurrency", "pollers": args.pollers, **report}
+
+
+def add_args(parser):
+    parser.add_argument("--pollers", type=int, default=200, help="agents long-polling the claim endpoint")
+    parser.add_argument("--wait", type=float, default=30, help="long-poll wait of each poller, seconds")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_args(parser)
+    add_database_args(parser)
+    args = parser.parse_args()
+    with ThrowawayDatabase(args) as database_url:
+        print(json.dumps(run(args, database_url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Result export benchmark: rows/sec and peak Python memory of GET /export/results per format.
+
+Seeds --results results into a throwaway database, then drains the export
+stream of every format twice: once for throughput, once under tracemalloc for
+the peak allocation. For comparison the same rows are loaded the way the list
+endpoints do it, as ORM objects validated into response models.
+
+    python bench/bench_export.py --results 200000
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from common import ThrowawayDatabase, add_database_args, load_backend
+
+CHECK_TYPES = ["ping", "http", "tcp", "dns_a"]
+RESULTS_PER_CHECK = len(CHECK_TYPES)
+SEED_BATCH = 10000
+
+
+def seed(count: int, started: datetime):
+    from sqlalchemy import insert
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    agent = models.Agent(name="bench-agent", token="bench", location="bench")
+    db.add(agent)
+    db.flush()
+    checks, results = [], []
+    for i in range(0, count, RESULTS_PER_CHECK):
+        check_id = str(uuid.uuid4())
+        created_at = started + timedelta(milliseconds=i)
+        checks.append({"id": check_id, "target": f"host-{i % 1000}.bench", "check_types": CHECK_TYPES,
+                       "status": "completed", "created_at": created_at, "completed_at": created_at})
+        for check_type in CHECK_TYPES[:count - i]:
+            results.append({"check_id": check_id, "agent_id": agent.id, "check_type": check_type, "success": True,
+                            "result_data": {"success": True, "response_time": 12, "avg_rtt": 12.3,
+                                            "addresses": ["192.0.2.1"]},
+                            "response_time": 12, "created_at": created_at, "result_uid": uuid.uuid4().hex})
+        if len(results) >= SEED_BATCH:
+            db.execute(insert(models.Check), checks)
+            db.execute(insert(models.CheckResult), results)
+            checks, results = [], []
+    if checks:
+        db.execute(insert(models.Check), checks)
+        db.execute(insert(models.CheckResult), results)
+    db.commit()
+    db.close()
+
+
+def drain(chunks) -> int:
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+    return size
+
+
+def orm_load(since: datetime, until: datetime) -> int:
+    """What paging through the list endpoints costs: ORM objects plus response models, all in memory"""
+    from sqlalchemy.orm import joinedload
+    from app import models
+    from app.database import SessionLocal
+    from app.main import result_response
+
+    db = SessionLocal()
+    try:
+        results = (
+            db.query(models.CheckResult).options(joinedload(models.CheckResult.agent))
+            .filter(models.CheckResult.created_at >= since, models.CheckResult.created_at < until).all()
+        )
+        return len([result_response(r) for r in results])
+    finally:
+        db.close()
+
+
+def measure(fn):
+    """(return value, seconds, peak traced bytes); the traced second run is not timed"""
+    started = time.perf_counter()
+    value = fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, elapsed, peak
+
+
+def run(args, database_url: str):
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    load_backend(database_url)
+    from app import export
+
+    since = datetime.utcnow() - timedelta(hours=1)
+    started = time.perf_counter()
+    seed(args.results, since)
+    seed_seconds = time.perf_counter() - started
+    until = since + timedelta(days=1)
+    query = export.results_query(since, until)
+
+    formats = ["ndjson", "csv"] + (["parquet"] if export.parquet_available() else [])
+    report = {}
+    for name in formats:
+        size, elapsed, peak = measure(lambda: drain(export.export_results(query, name)))
+        report[name] = {"rows_per_sec": round(args.results / elapsed), "output_mb": round(size / 2 ** 20, 1),
+                        "peak_memory_mb": round(peak / 2 ** 20, 1)}
+    if not args.skip_orm:
+        _, elapsed, peak = measure(lambda: orm_load(since, until))
+        report["orm_baseline"] = {"rows_per_sec": round(args.results / elapsed), "peak_memory_mb": round(peak / 2 ** 20, 1)}
+    return {"benchmark": "export", "results": args.results, "batch_rows": export.EXPORT_BATCH_ROWS,
+            "seed_seconds": round(seed_seconds, 1), "formats": report}
+
+
+def add_args(parser):
+    parser.add_argument("--results", type=int, default=200000, help="result rows to seed and export")
+    parser.add_argument("--skip-orm", action="store_true", help="skip the ORM comparison run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_args(parser)
+    add_database_args(parser)
+    args = parser.parse_args()
+    with ThrowawayDatabase(args) as database_url:
+        print(json.dumps(run(args, database_url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Result ingestion benchmark: POST /results/ per check vs POST /results/bulk, plain and gzip.
+
+Runs the backend in-process against a throwaway SQLite database (--postgres
+for a throwaway PostgreSQL, --database-url for an existing one) and prints
+rows/sec for every path as JSON.
+
+    python bench/bench_ingest.py --checks 500 --results-per-check 9
+"""
+import argparse
+import gzip
+import json
+import time
+import uuid
+
+from common import ThrowawayDatabase, add_database_args, load_backend
+
+CHECK_TYPES = ["ping", "http", "https", "tcp", "dns_a", "dns_aaaa", "dns_mx", "dns_ns", "dns_txt"]
+
+
+def create_checks(client, count: int, check_types):
+    return [
+        client.post("/checks/", json={"target": f"host-{i}.bench", "check_types": check_types}).json()["id"]
+        for i in range(count)
+    ]
+
+
+def result(check_type: str):
+    return {
+        "result_uid": uuid.uuid4().hex,
+        "check_type": check_type,
+        "success": True,
+        "result_data": {"success": True, "response_time": 12, "avg_rtt": 12.3},
+        "response_time": 12,
+        "error_message": None
+    }
+
+
+def bench_per_check(client, check_ids, check_types):
+    started = time.perf_counter()
+    for check_id in check_ids:
+        client.post("/results/", json={
+            "check_id": check_id,
+            "agent_name": "bench-agent",
+            "results": [result(ct) for ct in check_types]
+        })
+    return time.perf_counter() - started
+
+
+def bench_bulk(client, check_ids, check_types, batch_size: int, compress: bool = False):
+    """Agent upload path; compress=True sends the gzip bodies of the agent spool.
+
+    Bodies are encoded before the clock starts: only the backend is measured.
+    """
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    bodies = []
+    for i in range(0, len(check_ids), batch_size):
+        body = json.dumps({
+            "agent_name": "bench-agent",
+            "results": [
+                {"check_id": check_id, **result(ct)}
+                for check_id in check_ids[i:i + batch_size] for ct in check_types
+            ]
+        }).encode()
+        bodies.append(gzip.compress(body) if compress else body)
+    started = time.perf_counter()
+    for body in bodies:
+        client.post("/results/bulk", content=body, headers=headers)
+    return time.perf_counter() - started
+
+
+def run(args, database_url: str):
+    from fastapi.testclient import TestClient
+
+    with TestClient(load_backend(database_url)) as client:
+        client.post("/agents/register", json={"name": "bench-agent", "token": "bench"})
+        check_types = CHECK_TYPES[:args.results_per_check]
+        rows = args.checks * len(check_types)
+
+        per_check = bench_per_check(client, create_checks(client, args.checks, check_types), check_types)
+        bulk = bench_bulk(client, create_checks(client, args.checks, check_types), check_types, args.batch_size)
+        bulk_gzip = bench_bulk(client, create_checks(client, args.checks, check_types), check_types,
+                               args.batch_size, compress=True)
+
+    rate = lambda seconds: {"seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds, 1)}
+    return {
+        "benchmark": "ingest",
+        "rows": rows,
+        "batch_size": args.batch_size,
+        "per_check": rate(per_check),
+        "bulk": rate(bulk),
+        "bulk_gzip": rate(bulk_gzip),
+        "speedup": round(per_check / bulk, 2)
+    }
+
+
+def add_args(parser):
+    parser.add_argument("--checks", type=int, default=300)
+    parser.add_argument("--results-per-check", type=int, default=len(CHECK_TYPES))
+    parser.add_argument("--batch-size", type=int, default=200, help="checks per /results/bulk request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_args(parser)
+    add_database_args(parser)
+    args = parser.parse_args()
+    with ThrowawayDatabase(args) as database_url:
+        print(json.dumps(run(args, database_url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Monitor scheduler benchmark: timing-wheel overhead and end-to-end scheduling accuracy.
+
+The wheel part schedules --wheel-monitors synthetic monitors and advances
+through two of the longest intervals tick by tick, reporting the cost of a
+tick and how evenly runs spread over ticks (burst = busiest tick / average).
+The end-to-end part loads --monitors monitors from a throwaway database and
+runs the real scheduler for --seconds, reporting run lag behind schedule,
+tick duration and checks created.
+
+    python bench/bench_scheduler.py --wheel-monitors 100000 --monitors 10000 --seconds 30
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from common import ThrowawayDatabase, add_database_args, load_backend, percentiles
+
+INTERVALS = [10, 30, 60, 300]
+
+
+def synthetic_monitor(i: int):
+    return SimpleNamespace(id=str(uuid.uuid4()), target=f"host-{i}.bench", check_types=["ping"], params=None,
+                           interval_seconds=INTERVALS[i % len(INTERVALS)], agent_names=None, locations=None,
+                           agent_count=None)
+
+
+def bench_wheel(count: int):
+    from app.scheduler import MonitorSpec, TimingWheel
+
+    now = 1_700_000_000.0
+    specs = {}
+    started = time.perf_counter()
+    wheel = TimingWheel(1.0, now=now)
+    for i in range(count):
+        spec = MonitorSpec(synthetic_monitor(i))
+        specs[spec.id] = spec
+        wheel.schedule(spec.id, spec.next_run(now))
+    load_seconds = time.perf_counter() - started
+
+    tick_times, fired = [], []
+    for tick in range(1, 2 * max(INTERVALS) + 1):
+        t = now + tick
+        started = time.perf_counter()
+        due = wheel.advance(t)
+        for key in due:
+            wheel.schedule(key, specs[key].following_run(t))
+        tick_times.append(time.perf_counter() - started)
+        fired.append(len(due))
+    average = sum(fired) / len(fired)
+    return {
+        "monitors": count,
+        "load_seconds": round(load_seconds, 3),
+        "ticks": len(fired),
+        "runs": sum(fired),
+        "tick": percentiles(tick_times),
+        "runs_per_tick_avg": round(average, 1),
+        "runs_per_tick_max": max(fired),
+        "burst": round(max(fired) / average, 2) if average else None,
+    }
+
+
+def bench_end_to_end(args, database_url: str):
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    load_backend(database_url)
+    from sqlalchemy import func, insert, select
+    from app import models
+    from app.database import SessionLocal
+    from app.scheduler import MonitorScheduler
+
+    db = SessionLocal()
+    now = datetime.utcnow()
+    monitors = [synthetic_monitor(i) for i in range(args.monitors)]
+    db.execute(insert(models.Monitor), [
+        {"id": m.id, "target": m.target, "check_types": m.check_types, "interval_seconds": m.interval_seconds,
+         "enabled": True, "created_at": now, "updated_at": now}
+        for m in monitors
+    ])
+    db.commit()
+
+    scheduler = MonitorScheduler(tick=1.0, enabled=True)
+    started = time.perf_counter()
+    scheduler.load(db)
+    load_seconds = time.perf_counter() - started
+
+    tick_times = []
+    deadline = time.time() + args.seconds
+    while time.time() < deadline:
+        # Как в рабочем цикле: тик на границе секунды
+        time.sleep(1.0 - time.time() % 1.0)
+        started = time.perf_counter()
+        scheduler.run_due(db)
+        tick_times.append(time.perf_counter() - started)
+    stats = scheduler.stats()
+    checks = db.scalar(select(func.count()).select_from(models.Check))
+    db.close()
+    expected = sum(args.seconds / m.interval_seconds for m in monitors)
+    return {
+        "monitors": args.monitors,
+        "duration_seconds": args.seconds,
+        "load_seconds": round(load_seconds, 3),
+        "runs": stats["runs"],
+        "expected_runs": round(expected),
+        "checks_created": checks,
+        "lag_p50_ms": round(stats["lag_p50_seconds"] * 1000, 1) if stats["lag_p50_seconds"] is not None else None,
+        "lag_p99_ms": round(stats["lag_p99_seconds"] * 1000, 1) if stats["lag_p99_seconds"] is not None else None,
+        "tick": percentiles(tick_times),
+    }
+
+
+def run(args, database_url: str):
+    # Бэкенд (и модуль планировщика) импортируется один раз, уже с нужной БД
+    end_to_end = bench_end_to_end(args, database_url)
+    return {"benchmark": "scheduler", "wheel": bench_wheel(args.wheel_monitors), "end_to_end": end_to_end}
+
+
+def add_args(parser):
+    parser.add_argument("--wheel-monitors", type=int, default=100000, help="monitors in the wheel-only run")
+    parser.add_argument("--monitors", type=int, default=5000, help="monitors in the end-to-end run")
+    parser.add_argument("--seconds", type=int, default=30, help="duration of the end-to-end run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_args(parser)
+    add_database_args(parser)
+    args = parser.parse_args()
+    with ThrowawayDatabase(args) as database_url:
+        print(json.dumps(run(args, database_url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Shared helpers of the benchmark suite: throwaway databases, the in-process backend, latency stats."""
+import os
+import socket
+import sys
+import tempfile
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+AGENT_DIR = os.path.join(ROOT, "agent")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/max in milliseconds of latencies given in seconds"""
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(samples[-1] * 1000, 2)}
+
+
+def add_database_args(parser):
+    parser.add_argument("--database-url", help="benchmark against this database instead of a throwaway one")
+    parser.add_argument("--postgres", action="store_true",
+                        help="throwaway PostgreSQL via the pgserver package instead of SQLite")
+
+
+class ThrowawayDatabase:
+    """Temporary SQLite file or PostgreSQL cluster, removed on exit"""
+
+    def __init__(self, args):
+        self.args = args
+        self.tmp = None
+        self.server = None
+
+    def __enter__(self) -> str:
+        if self.args.database_url:
+            return self.args.database_url
+        self.tmp = tempfile.TemporaryDirectory()
+        if not self.args.postgres:
+            return f"sqlite:///{self.tmp.name}/bench.db"
+        try:
+            import pgserver
+        except ImportError:
+            sys.exit("--postgres needs the pgserver package (pip install pgserver) or use --database-url")
+        self.server = pgserver.get_server(self.tmp.name, cleanup_mode="stop")
+        # Unix-сокет кластера: psycopg2 и asyncpg принимают его в параметре host
+        return f"postgresql://postgres@/postgres?host={self.tmp.name}"
+
+    def __exit__(self, *exc):
+        if self.server is not None:
+            self.server.cleanup()
+        if self.tmp is not None:
+            self.tmp.cleanup()
+
+
+def load_backend(database_url: str):
+    """Import the backend app bound to database_url; migrations run on import"""
+    os.environ["DATABASE_URL"] = database_url
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import logging
+    logging.disable(logging.WARNING)
+    from app.main import app
+    return app
@@ -0,0 +1,110 @@
+"""Query-count regression check for the API endpoints.
+
+Counts SQL statements issued by each endpoint on a backend with a few checks,
+agents and results: the write paths (create, claim, result ingest), the list
+endpoints right after a write (cache invalidated), GET /checks/{id} read
+uncached, from the cache and conditionally (If-None-Match), and batch creation
+and progress. Prints the counts
+as JSON and exits non-zero when a budget is exceeded.
+
+    python bench/query_counts.py
+"""
+import argparse
+import json
+import sys
+
+from common import ThrowawayDatabase, add_database_args, load_backend
+
+BUDGETS = {
+    "create_check": 2,
+    "create_batch_1000": 2,
+    "batch_progress": 2,
+    # Очереди назначений диспетчера, одиночных и пачечных проверок: по запросу на каждую
+    "claim": 7,
+    "heartbeat": 0,
+    "submit_results": 6,
+    "submit_results_bulk": 5,
+    "get_check": 1,
+    "get_check_cached": 0,
+    "get_check_not_modified": 0,
+    "list_check_results": 1,
+    "list_checks": 1,
+    "list_agents": 1,
+}
+
+CHECK_TYPES = ["ping", "http", "dns_a"]
+
+
+def run(args, database_url: str):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    app = load_backend(database_url)
+    from app.database import async_engine, engine
+
+    statements = []
+    for db_engine in (engine, async_engine.sync_engine):
+        event.listen(db_engine, "before_cursor_execute", lambda *params: statements.append(params[2]))
+
+    def count(method, path, **kwargs):
+        statements.clear()
+        response = client.request(method, path, **kwargs)
+        assert response.status_code < 400, (path, response.status_code, response.text)
+        return response, len(statements)
+
+    def results(check_id=None):
+        return [{**({"check_id": check_id} if check_id else {}), "check_type": ct, "success": True, "result_data": {}}
+                for ct in CHECK_TYPES]
+
+    counts = {}
+    with TestClient(app) as client:
+        for i in range(5):
+            client.post("/agents/register", json={"name": f"agent-{i}", "token": "bench"})
+        response, counts["create_check"] = count("POST", "/checks/", json={"target": "example.com", "check_types": CHECK_TYPES})
+        check_id = response.json()["id"]
+        _, counts["claim"] = count("POST", "/agents/agent-0/claim", params={"max": 1})
+        # Повторный heartbeat известного агента только попадает в буфер
+        client.post("/agents/agent-0/heartbeat")
+        _, counts["heartbeat"] = count("POST", "/agents/agent-0/heartbeat")
+        _, counts["submit_results"] = count("POST", "/results/", json={
+            "check_id": check_id, "agent_name": "agent-0", "results": results()
+        })
+        for i in range(1, 5):
+            client.post("/results/", json={"check_id": check_id, "agent_name": f"agent-{i}", "results": results()})
+        bulk_ids = [client.post("/checks/", json={"target": f"bulk-{i}", "check_types": CHECK_TYPES}).json()["id"]
+                    for i in range(10)]
+        _, counts["submit_results_bulk"] = count("POST", "/results/bulk", json={
+            "agent_name": "agent-0", "results": [r for bulk_id in bulk_ids for r in results(bulk_id)]
+        })
+
+        response, counts["get_check"] = count("GET", f"/checks/{check_id}")
+        assert len(response.json()["results"]) == 15
+        response, counts["get_check_cached"] = count("GET", f"/checks/{check_id}")
+        assert len(response.json()["results"]) == 15
+        response, counts["get_check_not_modified"] = count("GET", f"/checks/{check_id}",
+                                                           headers={"If-None-Match": response.headers["etag"]})
+        assert response.status_code == 304
+        _, counts["list_check_results"] = count("GET", f"/checks/{check_id}/results")
+        _, counts["list_checks"] = count("GET", "/checks/", params={"limit": 50})
+        _, counts["list_agents"] = count("GET", "/agents/")
+        response, counts["create_batch_1000"] = count("POST", "/checks/batch", json={
+            "targets": [f"host-{i}.example.com" for i in range(1000)], "check_types": CHECK_TYPES
+        })
+        _, counts["batch_progress"] = count("GET", f"/checks/batch/{response.json()['id']}")
+
+    over = {name: n for name, n in counts.items() if n > BUDGETS[name]}
+    return {"benchmark": "query_counts", "counts": counts, "budgets": BUDGETS, "over_budget": over}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_args(parser)
+    args = parser.parse_args()
+    with ThrowawayDatabase(args) as database_url:
+        report = run(args, database_url)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["over_budget"] else 0)
+
+
+if __name__ == "__main__":
+    main()
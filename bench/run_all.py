@@ -0,0 +1,158 @@
+"""Run the whole benchmark suite and write one JSON report; optionally compare with a baseline.
+
+Every benchmark runs in its own process against its own throwaway database
+(SQLite by default, --postgres for PostgreSQL) and local stand-in targets, so
+the suite needs no network and no running services. Keep the report of a
+known-good commit and pass it with --compare: the run fails when a latency or
+throughput metric got worse by more than --tolerance, or a query count grew.
+
+    python bench/run_all.py --output bench-results/$(git rev-parse --short HEAD).json
+    python bench/run_all.py --quick --compare bench-results/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from common import ROOT
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Аргументы каждого бенчмарка: полный прогон и --quick
+SUITE = {
+    "agent": ("bench_agent.py", ["--calls", "300", "--min-seconds", "2"], ["--calls", "60", "--min-seconds", "0.5"]),
+    "ingest": ("bench_ingest.py", ["--checks", "300"], ["--checks", "150"]),
+    "concurrency": ("bench_concurrency.py", ["--pollers", "200", "--requests", "500", "--wait", "20"],
+                    ["--pollers", "50", "--requests", "200", "--wait", "8"]),
+    "scheduler": ("bench_scheduler.py", ["--wheel-monitors", "100000", "--monitors", "10000", "--seconds", "30"],
+                  ["--wheel-monitors", "20000", "--monitors", "1000", "--seconds", "8"]),
+    "export": ("bench_export.py", ["--results", "200000"], ["--results", "30000", "--skip-orm"]),
+    "query_counts": ("query_counts.py", [], []),
+}
+DATABASE_BENCHMARKS = {"ingest", "concurrency", "scheduler", "export", "query_counts"}
+
+# Абсолютный порог шума: меньшие изменения не считаются регрессией
+NOISE_FLOOR = {"_ms": 2.0, "seconds": 0.01}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(name: str, args) -> Dict:
+    script, full, quick = SUITE[name]
+    command = [sys.executable, os.path.join(BENCH_DIR, script), *(quick if args.quick else full)]
+    if name in DATABASE_BENCHMARKS:
+        if args.database_url:
+            command += ["--database-url", args.database_url]
+        elif args.postgres:
+            command.append("--postgres")
+    started = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True)
+    try:
+        report = json.loads(process.stdout)
+    except ValueError:
+        return {"error": f"exit code {process.returncode}", "stderr": process.stderr[-2000:]}
+    report["wall_seconds"] = round(time.perf_counter() - started, 2)
+    # query_counts завершается с ошибкой при превышении бюджета, но отчёт остаётся валидным
+    if process.returncode:
+        report["exit_code"] = process.returncode
+    return report
+
+
+def flatten(report, prefix: str = "") -> Dict[str, float]:
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def direction(path: str) -> Optional[str]:
+    """'lower' or 'higher' is better, None for metrics that are not compared"""
+    name = path.rsplit(".", 1)[-1]
+    if ".counts." in path:
+        return "lower"
+    if name.endswith(("per_sec", "rps")) or name == "speedup":
+        return "higher"
+    if name == "max_ms":
+        # Единичный выброс, слишком шумно для сравнения
+        return None
+    if name.endswith("_ms") or name == "seconds":
+        return "lower"
+    return None
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    regressions = []
+    old_values = flatten(baseline.get("benchmarks", {}))
+    for path, new in flatten(current.get("benchmarks", {})).items():
+        better = direction(path)
+        old = old_values.get(path)
+        if better is None or old is None or new is None:
+            continue
+        if ".counts." in path:
+            worse = new > old
+        elif better == "lower":
+            floor = next((v for suffix, v in NOISE_FLOOR.items() if path.endswith(suffix)), 0.0)
+            worse = new > old * (1 + tolerance) and new - old > floor
+        else:
+            worse = new < old * (1 - tolerance)
+        if worse:
+            regressions.append({"metric": path, "baseline": old, "current": new,
+                                "change": round((new - old) / old, 3) if old else None})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="*", choices=sorted(SUITE), help="run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller runs for a fast check")
+    parser.add_argument("--postgres", action="store_true", help="throwaway PostgreSQL (pgserver) instead of SQLite")
+    parser.add_argument("--database-url", help="use this database for the backend benchmarks")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--compare", help="baseline report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown, default 0.25")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPU",
+        "database": "external" if args.database_url else "postgresql" if args.postgres else "sqlite",
+        "quick": args.quick,
+        "benchmarks": {},
+    }
+    for name in args.only or SUITE:
+        print(f"running {name}...", file=sys.stderr)
+        report["benchmarks"][name] = run_benchmark(name, args)
+
+    failed = [name for name, result in report["benchmarks"].items() if "error" in result or result.get("exit_code")]
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    sys.exit(1 if failed or report.get("regressions") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Local stand-in targets for agent benchmarks: HTTP server, TCP listener and stub DNS server on loopback."""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DNS_RECORDS = {
+    "A": ["192.0.2.10"],
+    "AAAA": ["2001:db8::10"],
+    "MX": ["10 mail.bench.test."],
+    "NS": ["ns1.bench.test."],
+    "TXT": ['"v=spf1 -all"'],
+}
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Буферизованная запись: заголовки и тело уходят одним сегментом (без задержек Nagle)
+    wbufsize = 64 * 1024
+    body = b"x" * 1024
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _HttpServer(ThreadingHTTPServer):
+    # Стандартная очередь в 5 соединений под нагрузкой даёт повторы SYN через секунду
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class LocalTargets:
+    """Starts the stand-ins on ephemeral loopback ports; use as a context manager"""
+
+    host = "127.0.0.1"
+
+    def __init__(self, dns_delay: float = 0.0):
+        self.dns_delay = dns_delay
+        self.http_port = self.tcp_port = self.closed_port = self.dns_port = None
+        self._closers = []
+
+    def __enter__(self):
+        self._start_http()
+        self._start_tcp()
+        self._start_dns()
+        # Порт, на котором точно никто не слушает: для отказов соединения
+        with socket.socket() as sock:
+            sock.bind((self.host, 0))
+            self.closed_port = sock.getsockname()[1]
+        return self
+
+    def __exit__(self, *exc):
+        for close in self._closers:
+            close()
+
+    @property
+    def http_url(self) -> str:
+        return f"http://{self.host}:{self.http_port}/"
+
+    def _start_http(self):
+        server = _HttpServer((self.host, 0), _HttpHandler)
+        self.http_port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._closers.append(lambda: (server.shutdown(), server.server_close()))
+
+    def _start_tcp(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, 0))
+        sock.listen(1024)
+        self.tcp_port = sock.getsockname()[1]
+
+        def accept():
+            while True:
+                try:
+                    conn, _ = sock.accept()
+                except OSError:
+                    return
+                conn.close()
+        threading.Thread(target=accept, daemon=True).start()
+        self._closers.append(sock.close)
+
+    def _start_dns(self):
+        import dns.flags
+        import dns.message
+        import dns.rdatatype
+        import dns.rrset
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.host, 0))
+        self.dns_port = sock.getsockname()[1]
+        stopped = threading.Event()
+
+        def answer(data, address):
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            response.flags |= dns.flags.AA
+            question = query.question[0]
+            values = DNS_RECORDS.get(dns.rdatatype.to_text(question.rdtype))
+            if values:
+                response.answer.append(dns.rrset.from_text_list(question.name, 300, "IN", question.rdtype, values))
+            if self.dns_delay:
+                stopped.wait(self.dns_delay)
+            sock.sendto(response.to_wire(), address)
+
+        def serve():
+            while not stopped.is_set():
+                try:
+                    data, address = sock.recvfrom(4096)
+                except OSError:
+                    return
+                if self.dns_delay:
+                    threading.Thread(target=answer, args=(data, address), daemon=True).start()
+                else:
+                    answer(data, address)
+        threading.Thread(target=serve, daemon=True).start()
+        self._closers.append(lambda: (stopped.set(), sock.close()))
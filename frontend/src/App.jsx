@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
 
 // Используем VITE_API_URL (поддерживается Vite)
@@ -9,6 +9,7 @@ const CHECK_TYPES = [
   { value: 'http', label: 'HTTP' },
   { value: 'https', label: 'HTTPS' },
   { value: 'tcp', label: 'TCP Port' },
+  { value: 'traceroute', label: 'Traceroute' },
   { value: 'dns_a', label: 'DNS A' },
   { value: 'dns_aaaa', label: 'DNS AAAA' },
   { value: 'dns_mx', label: 'DNS MX' },
@@ -16,6 +17,9 @@ const CHECK_TYPES = [
   { value: 'dns_txt', label: 'DNS TXT' }
 ]
 
+// История обновляется по событиям не чаще раза в столько миллисекунд
+const HISTORY_REFRESH_MS = 2000
+
 const PRESETS = {
   quick: ['ping', 'http'],
   full: ['ping', 'http', 'https', 'dns_a', 'dns_mx'],
@@ -25,11 +29,14 @@ const PRESETS = {
 function App() {
   const [target, setTarget] = useState('')
   const [selectedChecks, setSelectedChecks] = useState(PRESETS.quick)
+  const [ports, setPorts] = useState('')
   const [currentCheck, setCurrentCheck] = useState(null)
   const [checksHistory, setChecksHistory] = useState([])
   const [agents, setAgents] = useState([])
   const [loading, setLoading] = useState(false)
   const [darkMode, setDarkMode] = useState(false)
+  const checkSource = useRef(null)
+  const historyRef = useRef([])
 
   // Загрузка темы из localStorage
   useEffect(() => {
@@ -37,6 +44,10 @@ function App() {
     setDarkMode(saved)
   }, [])
 
+  useEffect(() => {
+    historyRef.current = checksHistory
+  }, [checksHistory])
+
   useEffect(() => {
     document.documentElement.setAttribute('data-theme', darkMode ? 'dark' : 'light')
     localStorage.setItem('darkMode', darkMode)
@@ -61,15 +72,49 @@ function App() {
     }
   }
 
-  // Автообновление каждые 10 секунд
+  // Обновление по событиям сервера (SSE) вместо периодического опроса
   useEffect(() => {
     loadChecksHistory()
     loadAgents()
-    const interval = setInterval(() => {
-      loadChecksHistory()
-      loadAgents()
-    }, 10000)
-    return () => clearInterval(interval)
+    let historyTimer = null
+    let lastRefresh = 0
+    const refreshHistory = () => {
+      // Первое событие обновляет историю сразу, поток событий — не чаще раза в HISTORY_REFRESH_MS:
+      // запрос схлопывает пачку событий, но не откладывается, пока события идут
+      if (historyTimer) return
+      historyTimer = setTimeout(() => {
+        historyTimer = null
+        lastRefresh = Date.now()
+        loadChecksHistory()
+      }, Math.max(0, lastRefresh + HISTORY_REFRESH_MS - Date.now()))
+    }
+    const onChecksUpdated = (event) => {
+      // Изменения проверок, которых нет в списке (или уже завершённых), список не меняют
+      const { check_ids: checkIds = [] } = JSON.parse(event.data)
+      if (historyRef.current.some(c => c.status !== 'completed' && checkIds.includes(c.id))) {
+        refreshHistory()
+      }
+    }
+    const onCheckCompleted = (event) => {
+      // Статус берём из самого события, без запроса
+      const { check_id: checkId } = JSON.parse(event.data)
+      setChecksHistory(prev => prev.map(c => (c.id === checkId ? { ...c, status: 'completed' } : c)))
+    }
+    const source = new EventSource(`${API_URL}/events`)
+    source.addEventListener('check_created', refreshHistory)
+    source.addEventListener('batch_created', refreshHistory)
+    source.addEventListener('checks_scheduled', refreshHistory)
+    source.addEventListener('checks_updated', onChecksUpdated)
+    source.addEventListener('check_completed', onCheckCompleted)
+    source.addEventListener('agents_updated', loadAgents)
+    // Время последнего heartbeat меняется без событий — обновляем агентов изредка
+    const agentsInterval = setInterval(loadAgents, 60000)
+    return () => {
+      source.close()
+      clearTimeout(historyTimer)
+      clearInterval(agentsInterval)
+      checkSource.current?.close()
+    }
   }, [])
 
   const handleCheckboxChange = (checkType) => {
@@ -91,30 +136,32 @@ function App() {
     try {
       const response = await axios.post(`${API_URL}/checks/`, {
         target,
-        check_types: selectedChecks
+        check_types: selectedChecks,
+        ...(selectedChecks.includes('tcp') && ports.trim() ? { ports: ports.trim() } : {})
       })
       const newCheck = response.data
       setCurrentCheck(newCheck)
       // Добавляем в историю сразу (даже если pending)
       setChecksHistory(prev => [newCheck, ...prev.slice(0, 9)])
 
-      // Опрос результата
-      const checkInterval = setInterval(async () => {
-        try {
-          const resultResponse = await axios.get(`${API_URL}/checks/${newCheck.id}`)
-          const updatedCheck = resultResponse.data
-          if (updatedCheck.status === 'completed') {
-            setCurrentCheck(updatedCheck)
-            // Обновляем в истории
-            setChecksHistory(prev =>
-              prev.map(c => (c.id === updatedCheck.id ? updatedCheck : c))
-            )
-            clearInterval(checkInterval)
-          }
-        } catch (error) {
-          console.error('Polling error:', error)
+      // Подписка на изменения проверки
+      checkSource.current?.close()
+      const source = new EventSource(`${API_URL}/checks/${newCheck.id}/events`)
+      checkSource.current = source
+      source.addEventListener('check', (event) => {
+        const updatedCheck = JSON.parse(event.data)
+        // Показываем результаты по мере поступления, не дожидаясь завершения
+        setCurrentCheck(updatedCheck)
+        if (updatedCheck.status === 'completed') {
+          // Обновляем в истории
+          setChecksHistory(prev =>
+            prev.map(c => (c.id === updatedCheck.id ? updatedCheck : c))
+          )
+          // Сервер закрывает поток сам; закрываем и мы, чтобы браузер не переподключался
+          source.close()
         }
-      }, 2000)
+      })
+      source.onerror = (error) => console.error('Check events error:', error)
 
       setLoading(false)
     } catch (error) {
@@ -171,6 +218,18 @@ function App() {
               ))}
             </div>
           </div>
+          {selectedChecks.includes('tcp') && (
+            <div className="form-group">
+              <label htmlFor="ports">TCP ports (e.g. 22,80,443,8000-8010)</label>
+              <input
+                type="text"
+                id="ports"
+                value={ports}
+                onChange={(e) => setPorts(e.target.value)}
+                placeholder="80"
+              />
+            </div>
+          )}
           <button type="submit" className="btn-primary" disabled={loading}>
             {loading ? 'Running Checks…' : 'Run Diagnostic'}
           </button>
@@ -204,6 +263,13 @@ function App() {
                     HTTP {result.result_data.status_code} | {result.result_data.content_length} bytes
                   </div>
                 )}
+                {result.check_type.startsWith('http') && result.result_data?.timings && (
+                  <div className="detail">
+                    DNS {result.result_data.timings.dns} | TCP {result.result_data.timings.connect}
+                    {result.check_type === 'https' && ` | TLS ${result.result_data.timings.tls}`}
+                    {' '}| TTFB {result.result_data.timings.ttfb} ms
+                  </div>
+                )}
                 {result.check_type.startsWith('dns') && result.result_data?.records && (
                   <div className="detail">
                     {result.result_data.records.map((r, i) => (
@@ -213,7 +279,21 @@ function App() {
                 )}
                 {result.check_type === 'tcp' && (
                   <div className="detail">
-                    Port {result.result_data?.port} is {result.result_data?.status}
+                    {result.result_data?.port
+                      ? `Port ${result.result_data.port} is ${result.result_data.status}`
+                      : `Open: ${result.result_data?.open_ports?.join(', ') || 'none'} of ${new Set((result.result_data?.ports || []).map(p => p.port)).size} scanned`}
+                  </div>
+                )}
+                {result.check_type === 'traceroute' && result.result_data?.hops && (
+                  <div className="detail">
+                    {result.result_data.hops.map(hop => (
+                      <div key={hop.ttl}>
+                        {hop.ttl}. {hop.address || '*'}
+                        {hop.avg_rtt !== null && ` ${hop.avg_rtt} ms`}
+                        {hop.loss > 0 && ` (${hop.loss}% loss)`}
+                        {hop.flag && ` ${hop.flag}`}
+                      </div>
+                    ))}
                   </div>
                 )}
                 {result.error_message && (